@@ -1,14 +1,24 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Header, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
+import asyncio
+import threading
+import time
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
@@ -16,14 +26,181 @@ import random
 import jwt
 from email_validator import validate_email
 import base64
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import math
 import mimetypes
+import operator
+import re
+import tempfile
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Mongo Query Tracing
+QUERY_TRACE_ENABLED = os.environ.get('QUERY_TRACE_ENABLED', 'true').lower() == 'true'
+QUERY_TRACE_DEBUG_HEADERS = os.environ.get('QUERY_TRACE_DEBUG_HEADERS', 'false').lower() == 'true'
+# Identical query shapes repeated this often within one request are flagged as N+1 suspects
+QUERY_TRACE_N_PLUS_ONE_THRESHOLD = int(os.environ.get('QUERY_TRACE_N_PLUS_ONE_THRESHOLD', '5'))
+QUERY_TRACE_MAX_SHAPES_PER_ROUTE = 20
+QUERY_TRACE_IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "buildInfo", "saslStart", "saslContinue", "endSessions", "killCursors"
+}
+
+class RequestQueryTrace:
+    """Mongo commands issued while serving one request
+
+    Motor runs commands on executor threads (with the request's context
+    copied), so updates are guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.failures = 0
+        self.duration_ms = 0.0
+        self.documents = 0
+        self.shapes: Dict[str, int] = {}
+
+    def record_started(self, shape: str):
+        with self._lock:
+            self.commands += 1
+            self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def record_finished(self, duration_micros: int, documents: int = 0, failed: bool = False):
+        with self._lock:
+            self.duration_ms += duration_micros / 1000
+            self.documents += documents
+            if failed:
+                self.failures += 1
+
+    def n_plus_one_suspects(self) -> Dict[str, int]:
+        return {shape: count for shape, count in self.shapes.items() if count >= QUERY_TRACE_N_PLUS_ONE_THRESHOLD}
+
+query_trace: ContextVar[Optional[RequestQueryTrace]] = ContextVar("query_trace", default=None)
+
+def query_shape_of(value: Any) -> Any:
+    """Replace literal values with ? so queries that differ only in values share a shape"""
+    if isinstance(value, dict):
+        return {key: query_shape_of(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape_of(value[0])] if value else []
+    return "?"
+
+def command_shape(command_name: str, command: Dict[str, Any]) -> str:
+    """Command name, collection and filter shape, e.g. find users {"id": "?"}"""
+    collection = command.get("collection") if command_name == "getMore" else command.get(command_name)
+    if command_name == "aggregate":
+        detail = [next(iter(stage), "") for stage in command.get("pipeline", [])]
+    elif command_name in ("update", "delete"):
+        statements = command.get(command_name + "s") or [{}]
+        detail = query_shape_of(statements[0].get("q", {}))
+    elif command_name == "find":
+        detail = query_shape_of(command.get("filter", {}))
+    elif command_name in ("count", "distinct", "findAndModify"):
+        detail = query_shape_of(command.get("query", {}))
+    else:
+        detail = None
+    return f"{command_name} {collection}" + (f" {json.dumps(detail, sort_keys=True)}" if detail is not None else "")
+
+class QueryTraceListener(monitoring.CommandListener):
+    """Attributes every Mongo command to the request whose context issued it"""
+
+    def started(self, event):
+        trace = query_trace.get()
+        if trace is not None and event.command_name not in QUERY_TRACE_IGNORED_COMMANDS:
+            trace.record_started(command_shape(event.command_name, event.command))
+
+    def succeeded(self, event):
+        trace = query_trace.get()
+        if trace is None or event.command_name in QUERY_TRACE_IGNORED_COMMANDS:
+            return
+        reply = event.reply or {}
+        cursor = reply.get("cursor") or {}
+        documents = len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+        if event.command_name == "findAndModify" and reply.get("value") is not None:
+            documents = 1
+        trace.record_finished(event.duration_micros, documents)
+
+    def failed(self, event):
+        trace = query_trace.get()
+        if trace is not None and event.command_name not in QUERY_TRACE_IGNORED_COMMANDS:
+            trace.record_finished(event.duration_micros, failed=True)
+
+class RouteQueryMetrics:
+    """Per-route totals of the request traces, for deciding which routes to fix first"""
+
+    def __init__(self):
+        self.routes: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, route: str, trace: RequestQueryTrace, elapsed_ms: float):
+        metrics = self.routes.setdefault(route, {
+            "requests": 0, "commands": 0, "failures": 0, "db_time_ms": 0.0, "request_time_ms": 0.0,
+            "documents": 0, "max_commands": 0, "n_plus_one_requests": 0, "suspect_shapes": {}
+        })
+        metrics["requests"] += 1
+        metrics["commands"] += trace.commands
+        metrics["failures"] += trace.failures
+        metrics["db_time_ms"] += trace.duration_ms
+        metrics["request_time_ms"] += elapsed_ms
+        metrics["documents"] += trace.documents
+        metrics["max_commands"] = max(metrics["max_commands"], trace.commands)
+        
+        suspects = trace.n_plus_one_suspects()
+        if suspects:
+            metrics["n_plus_one_requests"] += 1
+            shapes = metrics["suspect_shapes"]
+            for shape, count in suspects.items():
+                shapes[shape] = max(shapes.get(shape, 0), count)
+            if len(shapes) > QUERY_TRACE_MAX_SHAPES_PER_ROUTE:
+                metrics["suspect_shapes"] = dict(
+                    sorted(shapes.items(), key=lambda item: item[1], reverse=True)[:QUERY_TRACE_MAX_SHAPES_PER_ROUTE]
+                )
+
+    def report(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Routes ordered by total commands issued, with per-request averages"""
+        rows = []
+        for route, metrics in self.routes.items():
+            requests = metrics["requests"]
+            rows.append({
+                "route": route,
+                **{key: value for key, value in metrics.items() if key != "suspect_shapes"},
+                "db_time_ms": round(metrics["db_time_ms"], 1),
+                "request_time_ms": round(metrics["request_time_ms"], 1),
+                "avg_commands": round(metrics["commands"] / requests, 2),
+                "avg_db_time_ms": round(metrics["db_time_ms"] / requests, 2),
+                "avg_documents": round(metrics["documents"] / requests, 1),
+                "n_plus_one_suspects": [
+                    {"shape": shape, "max_repeats": count}
+                    for shape, count in sorted(metrics["suspect_shapes"].items(), key=lambda item: item[1], reverse=True)
+                ]
+            })
+        rows.sort(key=lambda row: row["commands"], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        self.routes = {}
+
+route_query_metrics = RouteQueryMetrics()
+
+def route_template(request) -> str:
+    """Route path pattern (e.g. /api/admin/members/{user_id}) so metrics group by endpoint"""
+    route = request.scope.get("route")
+    if route is None:
+        for candidate in request.app.router.routes:
+            match, _ = candidate.matches(request.scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+    return f"{request.method} {route.path}" if route is not None else f"{request.method} (unmatched)"
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[QueryTraceListener()])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -286,12 +463,13 @@ class CartItem(BaseModel):
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
-    order_number: str = Field(default_factory=lambda: f"FG{int(datetime.now().timestamp())}")
+    order_number: str  # From next_order_number()
+    idempotency_key: Optional[str] = None
     items: List[Dict[str, Any]]  # Cart items with product details
     total_amount: float
     shipping_address: Dict[str, str]
     contact_info: Dict[str, str]
-    status: str = "pending"  # pending, confirmed, shipped, delivered, cancelled
+    status: str = "pending"  # reserving, failed, pending, confirmed, shipped, delivered, cancelled
     payment_status: str = "pending"  # pending, paid, failed, refunded
     payment_method: Optional[str] = None
     tracking_number: Optional[str] = None
@@ -570,6 +748,8 @@ class StudentEnrollmentProgress(BaseModel):
     step_data: Dict[str, Any] = {}  # Store data for each step
     status: str = "in_progress"  # in_progress, completed, on_hold
     enrollment_status: str = "new"  # new, consultation, exam_booked, enrolled
+    version: int = 0  # Bumped on every event so concurrent writers can detect conflicts
+    pending_events: List[Dict[str, Any]] = []  # Outbox of events not yet copied to flow_events
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -698,6 +878,7 @@ class DashboardCardsResponse(BaseModel):
     billing: BillingCard
     notices: NoticesCard
     resources: ResourcesCard
+    failed_cards: List[str] = []  # Cards that fell back to empty data
 
 class ComprehensiveDashboardResponse(BaseModel):
     parent_info: Dict[str, Any]
@@ -823,6 +1004,7 @@ class DashboardCardsResponse(BaseModel):
     billing: BillingCard
     notices: NoticesCard
     resources: ResourcesCard
+    failed_cards: List[str] = []  # Cards that fell back to empty data
 
 class ComprehensiveDashboardResponse(BaseModel):
     parent_info: Dict[str, Any]
@@ -1004,6 +1186,12 @@ class EnrollmentFlowResponse(BaseModel):
     steps: List[Dict[str, Any]]
     is_active: bool
 
+class EnrollmentFlowUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    steps: Optional[List[Dict[str, Any]]] = None
+    is_active: Optional[bool] = None
+
 class ProgressResponse(BaseModel):
     student_id: str
     student_name: str
@@ -1021,6 +1209,16 @@ class FlowEventRequest(BaseModel):
     step_key: str
     event_data: Dict[str, Any] = {}
 
+class BulkFlowEventItem(BaseModel):
+    student_id: str
+    event_type: str
+    step_key: str
+    event_data: Dict[str, Any] = {}
+
+class BulkFlowEventRequest(BaseModel):
+    events: List[BulkFlowEventItem]
+    notify: bool = True
+
 class PaymentRequest(BaseModel):
     payment_type: str
     amount: float
@@ -1074,6 +1272,9 @@ class UpdateCartRequest(BaseModel):
     selected_size: Optional[str] = None
     selected_color: Optional[str] = None
 
+class MergeCartRequest(BaseModel):
+    items: List[AddToCartRequest]  # Guest cart lines collected before login
+
 class CartResponse(BaseModel):
     items: List[Dict[str, Any]]
     total_items: int
@@ -1084,6 +1285,7 @@ class CreateOrderRequest(BaseModel):
     contact_info: Dict[str, str]
     payment_method: str
     notes: Optional[str] = None
+    idempotency_key: Optional[str] = None  # Alternative to the Idempotency-Key header
 
 class OrderResponse(BaseModel):
     id: str
@@ -1094,12 +1296,101 @@ class OrderResponse(BaseModel):
     payment_status: str
     created_at: datetime
 
+# Password Hashing Worker Pool
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_MAX_WORKERS = int(os.environ.get('BCRYPT_MAX_WORKERS', '4'))
+BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', '64'))
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated bounded thread pool so it never blocks the event loop
+
+    At most max_workers jobs run at once and max_queue more may wait; beyond
+    that new jobs are rejected with 503 instead of piling up behind a login burst.
+    """
+
+    def __init__(self, rounds: int, max_workers: int, max_queue: int):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    async def _run(self, fn, *args):
+        if self.in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server is busy, please try again shortly")
+        
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_seconds += time.perf_counter() - started
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._hash_sync, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self._verify_sync, password, hashed)
+
+    def _hash_sync(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds)).decode('utf-8')
+
+    @staticmethod
+    def _verify_sync(password: str, hashed: str) -> bool:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Whether a stored hash ($2b$<cost>$...) was made with a different cost factor"""
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rounds": self.rounds,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.max_workers),
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+password_hasher = PasswordHasher(BCRYPT_ROUNDS, BCRYPT_MAX_WORKERS, BCRYPT_MAX_QUEUE)
+
+async def rehash_password_if_needed(collection_name: str, record_id: str, password: str, hashed: str):
+    """Upgrade a stored password hash to the current cost factor after a successful login"""
+    if not password_hasher.needs_rehash(hashed):
+        return
+    try:
+        new_hash = await password_hasher.hash(password)
+        await db[collection_name].update_one(
+            {"id": record_id, "password_hash": hashed},
+            {"$set": {"password_hash": new_hash}}
+        )
+    except Exception as e:
+        logger.warning(f"Failed to rehash password for {collection_name} {record_id}: {str(e)}")
+
 # Utility functions
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+async def verify_password(password: str, hashed: str) -> bool:
+    return await password_hasher.verify(password, hashed)
 
 def create_jwt_token(user_id: str, household_token: str) -> str:
     payload = {
@@ -1109,6 +1400,77 @@ def create_jwt_token(user_id: str, household_token: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
 
+# Authenticated Principal Cache
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', '30'))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.environ.get('PRINCIPAL_CACHE_MAX_ENTRIES', '10000'))
+
+class PrincipalCache:
+    """Short-lived cache of authenticated users and admins keyed by (kind, id)"""
+
+    def __init__(self, ttl: float, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[tuple, tuple] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, kind: str, principal_id: str, load):
+        """Return the cached principal, or await load() and cache a non-None result"""
+        key = (kind, principal_id)
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        if entry:
+            del self._entries[key]
+        
+        self.misses += 1
+        generation = self._generation
+        principal = await load()
+        # Skip caching if the principal was invalidated while loading
+        if principal is not None and generation == self._generation:
+            self._store(key, principal)
+        return principal
+
+    def _store(self, key: tuple, principal: Any):
+        now = time.monotonic()
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            # Purge expired entries first; only evict live ones (oldest first) if that is not enough
+            for expired_key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[expired_key]
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (now + self.ttl, principal)
+
+    def invalidate(self, kind: str, principal_id: str):
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.pop((kind, principal_id), None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL)
+
+async def load_user_principal(user_id: str) -> Optional[UserResponse]:
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+    return UserResponse(**user) if user else None
+
+async def load_admin_principal(admin_id: str) -> Optional[AdminResponse]:
+    admin = await db.admins.find_one({"id": admin_id}, {"_id": 0, "password_hash": 0})
+    return AdminResponse(**admin) if admin else None
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=['HS256'])
@@ -1116,11 +1478,13 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = await db.users.find_one({"id": user_id})
+        user = await principal_cache.get_or_load("user", user_id, lambda: load_user_principal(user_id))
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
+        if user.status == "disabled":
+            raise HTTPException(status_code=401, detail="Account is disabled")
         
-        return UserResponse(**user)
+        return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
@@ -1133,11 +1497,11 @@ async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(
         if not admin_id:
             raise HTTPException(status_code=401, detail="Invalid admin token")
         
-        admin = await db.admins.find_one({"id": admin_id})
+        admin = await principal_cache.get_or_load("admin", admin_id, lambda: load_admin_principal(admin_id))
         if not admin:
             raise HTTPException(status_code=401, detail="Admin not found")
         
-        return AdminResponse(**admin)
+        return admin
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
@@ -1151,8 +1515,111 @@ def create_admin_jwt_token(admin_id: str, username: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
 
-async def log_audit(actor_user_id: str, action: str, target_type: str, target_id: str, meta: Optional[Dict] = None, ip: Optional[str] = None):
-    """Log admin actions for audit trail"""
+# Audit Log Writer
+AUDIT_WRITE_MODE = os.environ.get('AUDIT_WRITE_MODE', 'buffered')  # buffered or sync
+AUDIT_BUFFER_MAX_ENTRIES = int(os.environ.get('AUDIT_BUFFER_MAX_ENTRIES', '100'))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', '1.0'))
+# Entries kept for retry while the database is unreachable; the oldest are dropped beyond this
+AUDIT_BUFFER_HARD_LIMIT = int(os.environ.get('AUDIT_BUFFER_HARD_LIMIT', '10000'))
+
+class AuditLogWriter:
+    """Write-behind buffer for audit entries
+
+    Entries are collected in memory and written with insert_many once the
+    buffer reaches AUDIT_BUFFER_MAX_ENTRIES or every AUDIT_FLUSH_INTERVAL
+    seconds, and on shutdown. Durable writes (or AUDIT_WRITE_MODE=sync) are
+    inserted before returning, after flushing what is already buffered so
+    the log keeps its order.
+    """
+
+    def __init__(self, max_entries: int = AUDIT_BUFFER_MAX_ENTRIES, flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 sync: bool = AUDIT_WRITE_MODE == "sync"):
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.sync = sync
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = asyncio.Lock()
+        self._counters = {"written": 0, "flushes": 0, "failed_flushes": 0, "dropped": 0}
+
+    async def write(self, entry: Dict[str, Any], durable: bool = False):
+        if durable or self.sync:
+            await self.flush()
+            await db.audit_logs.insert_one(entry)
+            self._counters["written"] += 1
+            return
+        
+        self._buffer.append(entry)
+        if len(self._buffer) >= self.max_entries and not self._lock.locked():
+            run_in_background(self.flush())
+
+    async def flush(self):
+        """Write everything buffered so far; failed entries go back to the buffer
+
+        insert_many sets _id on the entries, so an entry that is retried
+        after the server already stored it (a partial bulk failure, or a
+        timeout after the write landed) fails with a duplicate key and is
+        counted as written instead of being requeued forever.
+        """
+        async with self._lock:
+            while self._buffer:
+                entries, self._buffer = self._buffer, []
+                retry: List[Dict[str, Any]] = []
+                try:
+                    for chunk in chunked(entries, BULK_WRITE_CHUNK_SIZE):
+                        try:
+                            await db.audit_logs.insert_many(chunk, ordered=False)
+                            failed = []
+                        except BulkWriteError as e:
+                            failed_indexes = {error["index"] for error in e.details["writeErrors"] if error["code"] != 11000}
+                            failed = [chunk[index] for index in sorted(failed_indexes)]
+                            if failed:
+                                logger.error(f"Audit log flush failed for {len(failed)} entries: {str(e)}")
+                        self._counters["written"] += len(chunk) - len(failed)
+                        retry.extend(failed)
+                        entries = entries[len(chunk):]
+                    self._counters["flushes"] += 1
+                except BaseException as e:
+                    # Keep unwritten entries, including when the flush task is cancelled
+                    self._buffer = retry + entries + self._buffer
+                    if not isinstance(e, Exception):
+                        raise
+                    self._fail_flush(e)
+                    return
+                if retry:
+                    self._buffer = retry + self._buffer
+                    self._fail_flush(None)
+                    return
+
+    def _fail_flush(self, error: Optional[Exception]):
+        self._counters["failed_flushes"] += 1
+        overflow = len(self._buffer) - AUDIT_BUFFER_HARD_LIMIT
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self._counters["dropped"] += overflow
+        if error is not None:
+            logger.error(f"Audit log flush failed, {len(self._buffer)} entries pending: {str(error)}")
+
+    async def run(self):
+        """Background loop flushing the buffer on the time threshold"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Audit log flush failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": "sync" if self.sync else "buffered", "buffered": len(self._buffer), **self._counters}
+
+audit_log_writer = AuditLogWriter()
+
+async def log_audit(actor_user_id: str, action: str, target_type: str, target_id: str, meta: Optional[Dict] = None,
+                    ip: Optional[str] = None, durable: bool = False):
+    """Log admin actions for audit trail
+
+    Entries are buffered and written in batches; pass durable=True when the
+    entry must be stored before the response is sent.
+    """
     audit_log = AuditLog(
         actor_user_id=actor_user_id,
         action=action,
@@ -1165,7 +1632,1302 @@ async def log_audit(actor_user_id: str, action: str, target_type: str, target_id
     audit_dict = audit_log.dict()
     audit_dict['created_at'] = audit_dict['created_at'].isoformat()
     
-    await db.audit_logs.insert_one(audit_dict)
+    await audit_log_writer.write(audit_dict, durable)
+
+# Audit Query Utility Functions
+ADMIN_NAME_CACHE_TTL = float(os.environ.get('ADMIN_NAME_CACHE_TTL', '600'))
+# Minimum gap between reloads triggered by an unknown admin id
+ADMIN_NAME_MISS_RELOAD_INTERVAL = 5.0
+AUDIT_QUERY_MAX_LIMIT = 500
+
+class AdminNameCache:
+    """Admin id -> username map, loaded whole since the admins collection is small"""
+
+    def __init__(self, ttl: float = ADMIN_NAME_CACHE_TTL):
+        self.ttl = ttl
+        self._names: Dict[str, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def _reload(self):
+        admins = await db.admins.find({}, {"_id": 0, "id": 1, "username": 1}).to_list(None)
+        self._names = {admin["id"]: admin.get("username", "Unknown") for admin in admins}
+        self._loaded_at = time.monotonic()
+
+    async def _ensure_fresh(self, wanted: List[str]):
+        age = time.monotonic() - self._loaded_at if self._loaded_at is not None else None
+        missing = any(admin_id not in self._names for admin_id in wanted)
+        if age is None or age > self.ttl or (missing and age > ADMIN_NAME_MISS_RELOAD_INTERVAL):
+            async with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > ADMIN_NAME_MISS_RELOAD_INTERVAL:
+                    await self._reload()
+
+    async def names_for(self, admin_ids: List[str]) -> Dict[str, str]:
+        await self._ensure_fresh(admin_ids)
+        return {admin_id: self._names[admin_id] for admin_id in admin_ids if admin_id in self._names}
+
+    async def id_for(self, username: str) -> Optional[str]:
+        await self._ensure_fresh([])
+        return next((admin_id for admin_id, name in self._names.items() if name == username), None)
+
+    def invalidate(self):
+        self._loaded_at = None
+
+admin_name_cache = AdminNameCache()
+
+async def attach_actor_names(audit_logs: List[Dict[str, Any]]):
+    """Set actor_name on each entry from the cached admin map"""
+    actor_names = await admin_name_cache.names_for(list({log["actor_user_id"] for log in audit_logs}))
+    for log in audit_logs:
+        log["actor_name"] = actor_names.get(log["actor_user_id"], "System")
+
+def parse_audit_time(value: Optional[str], field: str) -> Optional[str]:
+    """Normalize an ISO datetime (or date) to the UTC ISO string form audit entries are stored in"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {field}: expected an ISO 8601 date or datetime")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+def audit_action_filter(action: str) -> Any:
+    """Exact action, or an anchored prefix match for patterns like SET_PERMISSION:*"""
+    if action.endswith("*"):
+        return {"$regex": "^" + re.escape(action[:-1])}
+    return action
+
+async def build_audit_query(start: Optional[str] = None, end: Optional[str] = None, actor: Optional[str] = None,
+                            target_type: Optional[str] = None, target_id: Optional[str] = None,
+                            action: Optional[str] = None) -> Dict[str, Any]:
+    """Translate audit query parameters into a filter the compound indexes can serve"""
+    query: Dict[str, Any] = {}
+    created_at = {}
+    if start:
+        created_at["$gte"] = parse_audit_time(start, "start")
+    if end:
+        created_at["$lt"] = parse_audit_time(end, "end")
+    if created_at:
+        query["created_at"] = created_at
+    if actor:
+        # Accept an admin id or username
+        query["actor_user_id"] = await admin_name_cache.id_for(actor) or actor
+    if target_type:
+        query["target_type"] = target_type
+    if target_id:
+        query["target_id"] = target_id
+    if action:
+        query["action"] = audit_action_filter(action)
+    return query
+
+def ndjson_chunk(records: List[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records).encode("utf-8")
+
+async def stream_audit_ndjson(query: Dict[str, Any], include_archive: bool = False,
+                              start: Optional[str] = None, end: Optional[str] = None):
+    """Yield matching audit entries, newest first, as newline-delimited JSON
+
+    With include_archive the live entries are followed by the archived ones,
+    which are all older than anything still in MongoDB.
+    """
+    cursor = db.audit_logs.find(query, {"_id": 0}).sort([("created_at", DESCENDING), ("id", DESCENDING)])
+    async for batch in iter_cursor_batches(cursor):
+        await attach_actor_names(batch)
+        yield ndjson_chunk(batch)
+    
+    if include_archive:
+        async for batch in read_archived_records("audit_logs", query, start, end):
+            for record in batch:
+                record.pop("_id", None)
+            await attach_actor_names(batch)
+            yield ndjson_chunk(batch)
+
+# Background Task Utility Functions
+background_tasks = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    """Schedule a coroutine without awaiting it, keeping a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Database Index Catalog
+ENSURE_INDEXES_ON_STARTUP = os.environ.get('ENSURE_INDEXES_ON_STARTUP', 'true').lower() == 'true'
+
+def index_spec(*keys, unique: bool = False, partial: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Describe one index; keys are field names or (field, direction) pairs"""
+    key_list = [(key, ASCENDING) if isinstance(key, str) else key for key in keys]
+    # Same naming scheme as MongoDB's default so pre-existing indexes are recognised
+    spec = {"keys": key_list, "name": "_".join(f"{field}_{direction}" for field, direction in key_list)}
+    if unique:
+        spec["unique"] = True
+    if partial:
+        spec["partialFilterExpression"] = partial
+    return spec
+
+# Unique "id" index on every collection whose documents carry an application id
+ID_INDEX = index_spec("id", unique=True)
+
+INDEX_CATALOG: Dict[str, List[Dict[str, Any]]] = {
+    "users": [
+        ID_INDEX,
+        index_spec("email", unique=True),
+        index_spec("household_token"),
+        index_spec(("created_at", DESCENDING))
+    ],
+    "member_search": [
+        ID_INDEX,
+        index_spec("tokens"),
+        index_spec(("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("branch", ("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec(("last_login_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("name", "id")
+    ],
+    "admins": [ID_INDEX, index_spec("username", unique=True)],
+    "parents": [ID_INDEX, index_spec("user_id"), index_spec("household_token"), index_spec("branch")],
+    "students": [
+        ID_INDEX,
+        index_spec("parent_id"),
+        # Admin student lists keyset-paginate on (created_at, id), usually within branches
+        index_spec(("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("branch", ("created_at", DESCENDING), ("id", DESCENDING))
+    ],
+    "class_placements": [ID_INDEX, index_spec("student_id", "status")],
+    "student_enrollment_progress": [
+        ID_INDEX,
+        index_spec("student_id", unique=True),
+        index_spec("flow_key", "status"),
+        # Progress report pages on (created_at, id), optionally filtered by flow or status
+        index_spec(("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("flow_key", ("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("status", ("created_at", DESCENDING), ("id", DESCENDING))
+    ],
+    "enrollment_flows": [ID_INDEX, index_spec("flow_key", unique=True)],
+    "flow_events": [ID_INDEX, index_spec("student_id", ("created_at", DESCENDING)), index_spec("created_at")],
+    "account_recovery_logs": [index_spec("created_at")],
+    "audit_logs": [
+        ID_INDEX,
+        index_spec("target_id", "action", ("created_at", DESCENDING)),
+        index_spec(("created_at", DESCENDING)),
+        index_spec(("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("actor_user_id", ("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("target_type", ("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("action", ("created_at", DESCENDING), ("id", DESCENDING))
+    ],
+    "notification_logs": [index_spec("status", "created_at"), index_spec("status", "next_attempt_at")],
+    "progress_report_summary": [index_spec("dimension", "value", unique=True)],
+    "admission_data": [index_spec("household_token")],
+    "exam_reservations": [
+        ID_INDEX,
+        index_spec("student_id", ("created_at", DESCENDING)),
+        index_spec("household_token")
+    ],
+    "exam_results": [index_spec("student_id", ("tested_at", DESCENDING))],
+    "homeworks": [ID_INDEX, index_spec("class_assignment_id", ("due_date", DESCENDING), ("id", DESCENDING))],
+    "homework_submissions": [ID_INDEX, index_spec("student_id", "homework_id")],
+    "attendances": [index_spec("student_id", "class_assignment_id", ("date", DESCENDING))],
+    "payment_records": [ID_INDEX, index_spec("student_id", "payment_status", "due_date")],
+    "billings": [index_spec("student_id", "month")],
+    "notices": [index_spec(("created_at", DESCENDING))],
+    "notice_acknowledgments": [index_spec("student_id", "notice_id")],
+    "guide_acknowledgments": [index_spec("student_id", "guide_id")],
+    "student_profiles": [index_spec("student_id")],
+    "password_reset_tokens": [index_spec("email", "reset_token")],
+    "permissions": [index_spec("code", unique=True)],
+    "role_permissions": [index_spec("role", "permission_code", unique=True)],
+    "admin_user_permissions": [index_spec("admin_user_id", "permission_code")],
+    "admin_user_allowed_branches": [index_spec("admin_user_id")],
+    "products": [
+        ID_INDEX,
+        index_spec("is_available", "category"),
+        index_spec("is_available", "is_featured"),
+        # Unfiltered listings keyset-paginate on (sort field, id)
+        *[index_spec("is_available", field, "id") for field in ("created_at", "price", "name")],
+        index_spec("reservations.order_id")
+    ],
+    "cart_items": [
+        ID_INDEX,
+        index_spec("user_id"),
+        # One line per product variant; add_to_cart upserts against it
+        index_spec("user_id", "product_id", "selected_size", "selected_color", unique=True)
+    ],
+    "orders": [
+        ID_INDEX,
+        index_spec("user_id", ("created_at", DESCENDING)),
+        index_spec("order_number", unique=True),
+        index_spec("user_id", "idempotency_key", unique=True, partial={"idempotency_key": {"$type": "string"}}),
+        index_spec("status", "created_at")
+    ],
+    "news_articles": [
+        ID_INDEX,
+        index_spec(("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("published", ("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("category", ("created_at", DESCENDING), ("id", DESCENDING)),
+        index_spec("published", "category", ("created_at", DESCENDING), ("id", DESCENDING))
+    ]
+}
+
+async def ensure_indexes() -> Dict[str, Any]:
+    """Create every catalog index that does not exist yet
+
+    Each index is created on its own so one failure (e.g. duplicates blocking a
+    unique index) does not stop the rest; failures are logged and reported.
+    Duplicate cart lines and order numbers are resolved first so their
+    unique indexes can be built.
+    """
+    created, failed = [], []
+    for prepare in (merge_duplicate_cart_lines, dedupe_order_numbers):
+        try:
+            await prepare()
+        except Exception as e:
+            # The affected unique index then fails to build and is reported below
+            logger.warning(f"Index preparation {prepare.__name__} failed: {str(e)}")
+    
+    async def create(collection_name: str, spec: Dict[str, Any]):
+        options = {key: value for key, value in spec.items() if key != "keys"}
+        try:
+            await db[collection_name].create_index(spec["keys"], **options)
+            created.append(f"{collection_name}.{spec['name']}")
+        except Exception as e:
+            logger.warning(f"Failed to create index {collection_name}.{spec['name']}: {str(e)}")
+            failed.append({"index": f"{collection_name}.{spec['name']}", "error": str(e)})
+    
+    await asyncio.gather(*(
+        create(collection_name, spec)
+        for collection_name, specs in INDEX_CATALOG.items()
+        for spec in specs
+    ))
+    return {"ensured": sorted(created), "failed": failed}
+
+async def get_index_report() -> Dict[str, Any]:
+    """Compare the catalog with the live indexes and their $indexStats usage counters"""
+    async def collection_report(collection_name: str, specs: List[Dict[str, Any]]):
+        existing, usage = await asyncio.gather(
+            db[collection_name].index_information(),
+            db[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+        )
+        existing_keys = {tuple((field, int(direction)) for field, direction in info["key"]): name for name, info in existing.items()}
+        catalog_keys = {tuple(spec["keys"]): spec["name"] for spec in specs}
+        
+        missing = [name for keys, name in catalog_keys.items() if keys not in existing_keys]
+        uncatalogued = [name for keys, name in existing_keys.items() if keys not in catalog_keys and name != "_id_"]
+        ops_by_index = {stat["name"]: stat["accesses"]["ops"] for stat in usage}
+        unused = [name for name, ops in ops_by_index.items() if ops == 0 and name != "_id_"]
+        return collection_name, {
+            "missing": missing,
+            "uncatalogued": uncatalogued,
+            "unused": unused,
+            "ops": ops_by_index
+        }
+    
+    reports = await asyncio.gather(*(
+        collection_report(collection_name, specs) for collection_name, specs in INDEX_CATALOG.items()
+    ))
+    return dict(reports)
+
+# Archival Utility Functions
+# Archived records are deleted from MongoDB and only exist in ARCHIVE_DIR, so
+# scheduled archival is opt-in: ARCHIVE_DIR must be durable storage shared by
+# every worker (the lease holder writes, any worker may serve reads)
+ARCHIVE_DIR = Path(os.environ.get('ARCHIVE_DIR', str(ROOT_DIR / 'archive')))
+ARCHIVE_ENABLED = os.environ.get('ARCHIVE_ENABLED', 'false').lower() == 'true'
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', '86400'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+ARCHIVE_LEASE_NAME = "archival"
+ARCHIVE_LEASE_SECONDS = 600  # Renewed after every batch
+
+# Records older than the horizon (in days) move from MongoDB to gzip NDJSON files
+ARCHIVE_POLICIES: Dict[str, Dict[str, Any]] = {
+    "flow_events": {"days": int(os.environ.get('ARCHIVE_FLOW_EVENTS_AFTER_DAYS', '365'))},
+    "audit_logs": {"days": int(os.environ.get('ARCHIVE_AUDIT_LOGS_AFTER_DAYS', '365'))},
+    "notification_logs": {
+        "days": int(os.environ.get('ARCHIVE_NOTIFICATION_LOGS_AFTER_DAYS', '90')),
+        # Only settled notifications; pending ones still belong to the dispatcher
+        "filter": {"status": {"$in": ["sent", "failed"]}}
+    },
+    "account_recovery_logs": {"days": int(os.environ.get('ARCHIVE_ACCOUNT_RECOVERY_LOGS_AFTER_DAYS', '180'))}
+}
+
+ARCHIVE_COMPARISONS = {"$gte": operator.ge, "$gt": operator.gt, "$lte": operator.le, "$lt": operator.lt}
+
+MAINTENANCE_WORKER_ID = f"{os.getpid()}-{uuid.uuid4()}"
+
+async def acquire_maintenance_lease(name: str, seconds: float) -> bool:
+    """Take (or, for the current holder, extend) a cluster-wide lease so only one worker runs a maintenance job"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.maintenance_leases.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"holder": MAINTENANCE_WORKER_ID}]},
+            {"$set": {"holder": MAINTENANCE_WORKER_ID, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def release_maintenance_lease(name: str):
+    await db.maintenance_leases.update_one(
+        {"_id": name, "holder": MAINTENANCE_WORKER_ID},
+        {"$set": {"expires_at": datetime.now(timezone.utc)}}
+    )
+
+def archive_partition_path(collection_name: str, day: str) -> Path:
+    return ARCHIVE_DIR / collection_name / day[:4] / f"{collection_name}-{day}.ndjson.gz"
+
+def write_archive_partition(path: Path, records: List[Dict[str, Any]]):
+    """Append records to a day's archive file as a new gzip member and fsync it"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+            archive.write(payload.encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+def read_archive_partition(path: Path) -> List[Dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        return [json.loads(line) for line in archive if line.strip()]
+
+async def archive_collection(collection_name: str, policy: Dict[str, Any]) -> int:
+    """Move records past the collection's horizon into day-partitioned archive files"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=policy["days"])).isoformat()
+    query = and_filters(policy.get("filter"), {"created_at": {"$lt": cutoff}})
+    collection = db[collection_name]
+    
+    archived = 0
+    while True:
+        batch = await collection.find(query).sort("created_at", 1).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        
+        object_ids = [doc["_id"] for doc in batch]
+        partitions: Dict[str, List[Dict[str, Any]]] = {}
+        for doc in batch:
+            doc["_id"] = str(doc["_id"])
+            partitions.setdefault(str(doc.get("created_at", ""))[:10], []).append(doc)
+        for day, records in partitions.items():
+            await asyncio.to_thread(write_archive_partition, archive_partition_path(collection_name, day), records)
+        
+        # Delete only once the records are on disk; a crash in between re-archives
+        # the batch, and readers drop the duplicates by _id
+        await collection.delete_many({"_id": {"$in": object_ids}})
+        archived += len(batch)
+        
+        # Stop if another worker took over after the lease ran out (e.g. a stalled disk)
+        if not await acquire_maintenance_lease(ARCHIVE_LEASE_NAME, ARCHIVE_LEASE_SECONDS):
+            raise RuntimeError(f"Lost the archival lease while archiving {collection_name}")
+    return archived
+
+async def run_archival() -> Dict[str, Any]:
+    """Archive every collection in ARCHIVE_POLICIES unless another worker is already doing it"""
+    if not await acquire_maintenance_lease(ARCHIVE_LEASE_NAME, ARCHIVE_LEASE_SECONDS):
+        return {"skipped": True, "archived": {}}
+    try:
+        archived = {}
+        for collection_name, policy in ARCHIVE_POLICIES.items():
+            archived[collection_name] = await archive_collection(collection_name, policy)
+        return {"skipped": False, "archived": archived}
+    finally:
+        await release_maintenance_lease(ARCHIVE_LEASE_NAME)
+
+async def run_archival_loop():
+    """Background loop that archives old records every ARCHIVE_INTERVAL seconds"""
+    while True:
+        try:
+            result = await run_archival()
+            if not result["skipped"]:
+                logger.info(f"Archived records: {result['archived']}")
+        except Exception as e:
+            logger.warning(f"Archival failed: {str(e)}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+def matches_archive_filter(record: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """Evaluate the simple Mongo filters used by the query APIs against an archived record"""
+    for field, condition in query.items():
+        value = record.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for op, operand in condition.items():
+            if op == "$regex" and not (isinstance(value, str) and re.search(operand, value)):
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op in ARCHIVE_COMPARISONS and (value is None or not ARCHIVE_COMPARISONS[op](value, operand)):
+                return False
+    return True
+
+async def read_archived_records(collection_name: str, query: Optional[Dict[str, Any]] = None,
+                                start: Optional[str] = None, end: Optional[str] = None):
+    """Yield batches of archived records in [start, end), newest day first
+
+    Only the day files overlapping the range are opened; start/end are the
+    UTC ISO strings records are stored with.
+    """
+    root = ARCHIVE_DIR / collection_name
+    paths = await asyncio.to_thread(lambda: sorted(root.glob(f"*/{collection_name}-*.ndjson.gz"), reverse=True))
+    for path in paths:
+        day = path.name[len(collection_name) + 1:-len(".ndjson.gz")]
+        if (start and day < start[:10]) or (end and day > end[:10]):
+            continue
+        
+        records, seen = [], set()
+        for record in await asyncio.to_thread(read_archive_partition, path):
+            created_at = str(record.get("created_at", ""))
+            if (start and created_at < start) or (end and created_at >= end) or record["_id"] in seen:
+                continue
+            if matches_archive_filter(record, query or {}):
+                seen.add(record["_id"])
+                records.append(record)
+        if records:
+            records.sort(key=lambda record: str(record.get("created_at", "")), reverse=True)
+            yield records
+
+# Keyset Pagination Utility Functions
+COUNT_CACHE_TTL = float(os.environ.get('COUNT_CACHE_TTL', '30'))
+COUNT_CACHE_MAX_ENTRIES = 1000
+
+# BSON sort order of the value types used as sort keys (null sorts before all of them)
+CURSOR_TYPE_ORDER = ["number", "string", "date"]
+
+count_cache: Dict[str, tuple] = {}
+
+def encode_cursor(sort_value: Any, doc_id: str) -> str:
+    """Encode the last row's sort value and id as an opaque page cursor"""
+    if isinstance(sort_value, datetime):
+        value = {"t": "dt", "v": sort_value.isoformat()}
+    else:
+        value = {"t": "raw", "v": sort_value}
+    payload = json.dumps({"s": value, "id": doc_id}, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a page cursor back into (sort value, id)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        value = payload["s"]
+        sort_value = datetime.fromisoformat(value["v"]) if value["t"] == "dt" else value["v"]
+        return sort_value, payload["id"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def cursor_value_type(value: Any) -> Optional[str]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime):
+        return "date"
+    return None
+
+def keyset_filter(sort_field: str, direction: int, cursor: str) -> Dict[str, Any]:
+    """Range filter selecting rows after the cursor in (sort_field, id) order"""
+    sort_value, last_id = decode_cursor(cursor)
+    op = "$lt" if direction < 0 else "$gt"
+    
+    # Missing/null sort values come first ascending and last descending
+    if sort_value is None:
+        if direction < 0:
+            return {sort_field: None, "id": {op: last_id}}
+        return {"$or": [{sort_field: {"$ne": None}}, {sort_field: None, "id": {op: last_id}}]}
+    
+    clauses = [{sort_field: {op: sort_value}}, {sort_field: sort_value, "id": {op: last_id}}]
+    if direction < 0:
+        clauses.append({sort_field: None})
+    
+    # Range operators only match the cursor's own BSON type, so add rows of the
+    # types that sort after it (e.g. ISO strings after datetimes when descending)
+    value_type = cursor_value_type(sort_value)
+    if value_type:
+        rank = CURSOR_TYPE_ORDER.index(value_type)
+        later_types = CURSOR_TYPE_ORDER[:rank] if direction < 0 else CURSOR_TYPE_ORDER[rank + 1:]
+        if later_types:
+            clauses.append({sort_field: {"$type": later_types}})
+    return {"$or": clauses}
+
+def and_filters(*filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine query filters, dropping empty ones"""
+    filters = [f for f in filters if f]
+    if not filters:
+        return {}
+    return filters[0] if len(filters) == 1 else {"$and": filters}
+
+async def cached_count(namespace: str, query: Any, count) -> int:
+    """Return a recently computed count for the query, or await count() and cache it"""
+    key = f"{namespace}:{json.dumps(query, sort_keys=True, default=str)}"
+    entry = count_cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    
+    total = await count()
+    if len(count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+        count_cache.clear()
+    count_cache[key] = (time.monotonic() + COUNT_CACHE_TTL, total)
+    return total
+
+async def keyset_paginate(collection, query: Dict[str, Any], sort_field: str, direction: int, limit: int,
+                          page: int = 1, cursor: Optional[str] = None, include_total: bool = True,
+                          projection: Optional[Dict[str, Any]] = None, offset: Optional[int] = None) -> Dict[str, Any]:
+    """Fetch one page ordered by (sort_field, id)
+
+    With a cursor the page is an index range seek past the cursor; without one
+    the page number (or a raw offset) is still honoured with skip for existing
+    clients. The total is optional and served from the count cache.
+    """
+    skip = 0
+    if cursor:
+        find_filter = and_filters(query, keyset_filter(sort_field, direction, cursor))
+    else:
+        find_filter = query
+        skip = offset if offset is not None else max(page - 1, 0) * limit
+    
+    fetch = collection.find(find_filter, projection or {"_id": 0}).sort(
+        [(sort_field, direction), ("id", direction)]
+    ).skip(skip).limit(limit + 1).to_list(limit + 1)
+    
+    total = None
+    if include_total:
+        docs, total = await asyncio.gather(
+            fetch,
+            cached_count(collection.name, query, lambda: collection.count_documents(query))
+        )
+    else:
+        docs = await fetch
+    
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = encode_cursor(docs[-1].get(sort_field), docs[-1]["id"]) if has_more and docs else None
+    return {"items": docs, "next_cursor": next_cursor, "has_more": has_more, "total": total}
+
+def total_pages(total: Optional[int], limit: int) -> Optional[int]:
+    return (total + limit - 1) // limit if total is not None and limit > 0 else None
+
+# Member Search Index Utility Functions
+MEMBER_SEARCH_NGRAM_MAX = 3
+
+def normalize_search_text(value: Any) -> str:
+    """Lowercase and collapse whitespace so indexed text and queries compare equal"""
+    return " ".join(str(value or "").lower().split())
+
+def phone_digits(value: Any) -> str:
+    return re.sub(r"\D", "", str(value or ""))
+
+def search_ngrams(value: str, max_n: int = MEMBER_SEARCH_NGRAM_MAX) -> set:
+    """Every substring of the value that is at most max_n characters long"""
+    return {value[start:start + n] for n in range(1, max_n + 1) for start in range(len(value) - n + 1)}
+
+def member_search_terms(query: str) -> tuple:
+    """Normalize a member search query into (text, n-grams the member must contain)"""
+    text = normalize_search_text(query)
+    # Phone numbers match on digits, so "010-1234" finds "010 1234 5678" and "01012345678"
+    if phone_digits(text) and re.fullmatch(r"[\d\s+().-]+", text):
+        text = phone_digits(text)
+    if len(text) <= MEMBER_SEARCH_NGRAM_MAX:
+        return text, [text]
+    n = MEMBER_SEARCH_NGRAM_MAX
+    return text, sorted({text[start:start + n] for start in range(len(text) - n + 1)})
+
+def build_member_search_doc(user: Dict[str, Any], parent: Dict[str, Any],
+                            students: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Denormalized member list row with the n-grams of every searchable field"""
+    values = [
+        normalize_search_text(value)
+        for value in [user.get("name"), user.get("email"), user.get("phone"), phone_digits(user.get("phone"))]
+        + [student.get("name") for student in students]
+        if value
+    ]
+    tokens = set()
+    for value in values:
+        tokens |= search_ngrams(value)
+    
+    return {
+        "id": user["id"],
+        "parent_id": parent["id"],
+        "name": user.get("name", ""),
+        "phone": user.get("phone", ""),
+        "email": user.get("email", ""),
+        "household_token": user.get("household_token", ""),
+        "branch": parent.get("branch", ""),
+        "status": user.get("status", "active"),
+        "students": [{"name": student.get("name", ""), "grade": student.get("grade", "")} for student in students],
+        "created_at": user.get("created_at"),
+        "last_login_at": user.get("last_login_at"),
+        "search_text": "\n".join(values),
+        "tokens": sorted(tokens),
+        "indexed_at": datetime.now(timezone.utc)
+    }
+
+async def refresh_member_search(user_ids: List[str]) -> int:
+    """Rebuild the search rows of the given users from users/parents/students"""
+    refreshed = 0
+    for batch in chunked(list(dict.fromkeys(user_ids)), BULK_WRITE_CHUNK_SIZE):
+        users = await db.users.find({"id": {"$in": batch}}, {"_id": 0, "password_hash": 0}).to_list(None)
+        parents = await db.parents.find({"user_id": {"$in": batch}}, {"_id": 0}).to_list(None)
+        parents_by_user = {parent["user_id"]: parent for parent in parents}
+        students = await db.students.find(
+            {"parent_id": {"$in": [parent["id"] for parent in parents]}}, {"_id": 0}
+        ).to_list(None)
+        students_by_parent: Dict[str, List[Dict[str, Any]]] = {}
+        for student in students:
+            students_by_parent.setdefault(student["parent_id"], []).append(student)
+        
+        docs = []
+        for user in users:
+            parent = parents_by_user.get(user["id"])
+            if parent:
+                docs.append(build_member_search_doc(user, parent, students_by_parent.get(parent["id"], [])))
+        if docs:
+            await db.member_search.bulk_write([ReplaceOne({"id": doc["id"]}, doc, upsert=True) for doc in docs], ordered=False)
+            refreshed += len(docs)
+        
+        # Users without a parent record are not listed as members
+        indexed = {doc["id"] for doc in docs}
+        stale = [user_id for user_id in batch if user_id not in indexed]
+        if stale:
+            await db.member_search.delete_many({"id": {"$in": stale}})
+    return refreshed
+
+async def rebuild_member_search() -> Dict[str, Any]:
+    """Re-index every member and drop rows whose user no longer exists"""
+    started_at = datetime.now(timezone.utc)
+    refreshed = 0
+    last_id = None
+    while True:
+        query = {"id": {"$gt": last_id}} if last_id else {}
+        batch = await db.users.find(query, {"_id": 0, "id": 1}).sort("id", 1).to_list(BULK_WRITE_CHUNK_SIZE)
+        if not batch:
+            break
+        refreshed += await refresh_member_search([user["id"] for user in batch])
+        last_id = batch[-1]["id"]
+    
+    removed = await db.member_search.delete_many({"indexed_at": {"$lt": started_at}})
+    count_cache.clear()
+    return {"indexed": refreshed, "removed": removed.deleted_count}
+
+def build_member_search_query(query: Optional[str] = None, branch: Optional[str] = None,
+                              status: Optional[str] = None) -> Dict[str, Any]:
+    """Member search filter over the n-gram index plus branch/status"""
+    search_query = {}
+    
+    # Substring search across parent name, phone, email and children's names
+    if query:
+        text, grams = member_search_terms(query)
+        if text:
+            search_query["tokens"] = {"$all": grams}
+            if len(text) > MEMBER_SEARCH_NGRAM_MAX:
+                search_query["search_text"] = {"$regex": re.escape(text)}
+    
+    if status:
+        search_query["status"] = status
+    if branch:
+        search_query["branch"] = branch
+    return search_query
+
+async def update_member_search_fields(user_id: str, fields: Dict[str, Any]):
+    """Mirror a change to a non-searchable user field onto the member's search row"""
+    await db.member_search.update_one({"id": user_id}, {"$set": fields})
+
+async def bootstrap_member_search():
+    """Build the member search index on first start against an existing user base"""
+    if await db.member_search.estimated_document_count() == 0 and await db.users.estimated_document_count() > 0:
+        result = await rebuild_member_search()
+        logger.info(f"Built member search index: {result['indexed']} members")
+
+# Student Autocomplete Utility Functions
+STUDENT_AUTOCOMPLETE_REFRESH_INTERVAL = float(os.environ.get('STUDENT_AUTOCOMPLETE_REFRESH_INTERVAL', '300'))
+STUDENT_AUTOCOMPLETE_MAX_LIMIT = 50
+
+HANGUL_SYLLABLE_BASE = 0xAC00
+HANGUL_SYLLABLE_LAST = 0xD7A3
+CHOSUNG = "ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ"
+JUNGSUNG = "ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ"
+JONGSUNG = ["", "ㄱ", "ㄲ", "ㄳ", "ㄴ", "ㄵ", "ㄶ", "ㄷ", "ㄹ", "ㄺ", "ㄻ", "ㄼ", "ㄽ", "ㄾ", "ㄿ", "ㅀ",
+            "ㅁ", "ㅂ", "ㅄ", "ㅅ", "ㅆ", "ㅇ", "ㅈ", "ㅊ", "ㅋ", "ㅌ", "ㅍ", "ㅎ"]
+
+# Compound vowels/finals split into the keystrokes that produce them, so a
+# half-typed syllable ("고" on the way to "괴") is still a prefix of the name
+COMPOUND_JAMO = {
+    "ㅘ": "ㅗㅏ", "ㅙ": "ㅗㅐ", "ㅚ": "ㅗㅣ", "ㅝ": "ㅜㅓ", "ㅞ": "ㅜㅔ", "ㅟ": "ㅜㅣ", "ㅢ": "ㅡㅣ",
+    "ㄳ": "ㄱㅅ", "ㄵ": "ㄴㅈ", "ㄶ": "ㄴㅎ", "ㄺ": "ㄹㄱ", "ㄻ": "ㄹㅁ", "ㄼ": "ㄹㅂ", "ㄽ": "ㄹㅅ",
+    "ㄾ": "ㄹㅌ", "ㄿ": "ㄹㅍ", "ㅀ": "ㄹㅎ", "ㅄ": "ㅂㅅ"
+}
+
+def decompose_hangul(text: str) -> str:
+    """Spell Hangul syllables out as jamo keystrokes; other characters are lowercased"""
+    jamo = []
+    for char in text.lower():
+        code = ord(char)
+        if HANGUL_SYLLABLE_BASE <= code <= HANGUL_SYLLABLE_LAST:
+            offset = code - HANGUL_SYLLABLE_BASE
+            parts = [CHOSUNG[offset // 588], JUNGSUNG[(offset % 588) // 28], JONGSUNG[offset % 28]]
+            jamo.append("".join(COMPOUND_JAMO.get(part, part) for part in parts))
+        else:
+            jamo.append(COMPOUND_JAMO.get(char, char))
+    return "".join(jamo)
+
+def hangul_chosung(text: str) -> str:
+    """Initial consonant of each Hangul syllable, e.g. 김민수 -> ㄱㅁㅅ"""
+    initials = []
+    for char in text.lower():
+        code = ord(char)
+        if HANGUL_SYLLABLE_BASE <= code <= HANGUL_SYLLABLE_LAST:
+            initials.append(CHOSUNG[(code - HANGUL_SYLLABLE_BASE) // 588])
+        else:
+            initials.append(char)
+    return "".join(initials)
+
+def is_chosung_query(text: str) -> bool:
+    return bool(text) and all(char in CHOSUNG or char.isspace() for char in text)
+
+class PrefixTrie:
+    """Character trie where every node holds the values of all keys below it"""
+
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children: Dict[str, "PrefixTrie"] = {}
+        self.values: set = set()
+
+    def insert(self, key: str, value: Any):
+        node = self
+        for char in key:
+            node = node.children.setdefault(char, PrefixTrie())
+            node.values.add(value)
+
+    def remove(self, key: str, value: Any):
+        path = [self]
+        for char in key:
+            node = path[-1].children.get(char)
+            if node is None:
+                break
+            path.append(node)
+        for parent, char, node in reversed(list(zip(path, key, path[1:]))):
+            node.values.discard(value)
+            if not node.values:
+                del parent.children[char]
+
+    def search(self, prefix: str) -> set:
+        node = self
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.values
+
+class StudentAutocompleteIndex:
+    """In-memory type-ahead over student names and ids, partitioned by branch
+
+    Every name is indexed from each syllable onwards (so a given name finds
+    "김민수" without the surname) both as jamo and as chosung, and every id as
+    its lowercase prefix. Writes in this process are applied incrementally;
+    the whole index is reloaded in the background once it is older than
+    STUDENT_AUTOCOMPLETE_REFRESH_INTERVAL to pick up other workers' writes.
+    """
+
+    def __init__(self, refresh_interval: float = STUDENT_AUTOCOMPLETE_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._tries: Dict[str, PrefixTrie] = {}
+        self._students: Dict[str, Dict[str, Any]] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        # Writes made while a reload is scanning, replayed onto the new index
+        self._replay: Optional[List[tuple]] = None
+
+    @staticmethod
+    def _keys(student: Dict[str, Any]) -> set:
+        name = normalize_search_text(student.get("name"))
+        syllables = name.replace(" ", "")
+        keys = {str(student["id"]).lower()}
+        for start in range(len(syllables)):
+            keys.add(decompose_hangul(syllables[start:]))
+            keys.add(hangul_chosung(syllables[start:]))
+        return keys
+
+    @staticmethod
+    def _entry(student: Dict[str, Any]) -> Dict[str, Any]:
+        name = student.get("name", "")
+        return {
+            "id": student["id"],
+            "name": name,
+            "branch": student.get("branch", ""),
+            "grade": student.get("grade", ""),
+            "status": student.get("status", ""),
+            "jamo": decompose_hangul(name.replace(" ", "")),
+            "chosung": hangul_chosung(name.replace(" ", ""))
+        }
+
+    def _add(self, tries: Dict[str, PrefixTrie], students: Dict[str, Dict[str, Any]], student: Dict[str, Any]):
+        entry = self._entry(student)
+        trie = tries.setdefault(entry["branch"], PrefixTrie())
+        for key in self._keys(student):
+            trie.insert(key, entry["id"])
+        students[entry["id"]] = entry
+
+    def _discard(self, tries: Dict[str, PrefixTrie], students: Dict[str, Dict[str, Any]], student_id: str):
+        entry = students.pop(student_id, None)
+        trie = tries.get(entry["branch"]) if entry else None
+        if trie:
+            for key in self._keys(entry):
+                trie.remove(key, student_id)
+
+    def _apply(self, tries: Dict[str, PrefixTrie], students: Dict[str, Dict[str, Any]], op: str, arg: Any):
+        if op == "upsert":
+            self._discard(tries, students, arg["id"])
+            self._add(tries, students, arg)
+        elif op == "remove":
+            self._discard(tries, students, arg)
+        elif op == "update" and arg[0] in students:
+            students[arg[0]].update(arg[1])
+
+    def _write(self, op: str, arg: Any):
+        self._apply(self._tries, self._students, op, arg)
+        if self._replay is not None:
+            self._replay.append((op, arg))
+
+    def upsert(self, student: Dict[str, Any]):
+        """Index a new student or re-index one whose name or branch changed"""
+        self._write("upsert", dict(student))
+
+    def update_fields(self, student_id: str, **fields):
+        """Apply a change to displayed fields (e.g. status) without re-indexing keys"""
+        self._write("update", (student_id, fields))
+
+    def remove(self, student_id: str):
+        self._write("remove", student_id)
+
+    async def reload(self):
+        """Rebuild the index from the students collection and swap it in"""
+        tries: Dict[str, PrefixTrie] = {}
+        students: Dict[str, Dict[str, Any]] = {}
+        projection = {"_id": 0, "id": 1, "name": 1, "branch": 1, "grade": 1, "status": 1}
+        self._replay = []
+        try:
+            async for student in db.students.find({}, projection):
+                self._add(tries, students, student)
+            for op, arg in self._replay:
+                self._apply(tries, students, op, arg)
+            self._tries, self._students = tries, students
+            self._loaded_at = time.monotonic()
+        finally:
+            self._replay = None
+
+    async def ensure_loaded(self):
+        if self._loaded_at is None:
+            async with self._lock:
+                if self._loaded_at is None:
+                    await self.reload()
+        elif time.monotonic() - self._loaded_at > self.refresh_interval and not self._lock.locked():
+            run_in_background(self._refresh())
+
+    async def _refresh(self):
+        async with self._lock:
+            if time.monotonic() - self._loaded_at > self.refresh_interval:
+                await self.reload()
+
+    async def search(self, query: str, branches: List[str], limit: int = 10) -> List[Dict[str, Any]]:
+        """Students in the given branches whose name or id matches the typed prefix"""
+        await self.ensure_loaded()
+        text = normalize_search_text(query).replace(" ", "")
+        if not text:
+            return []
+        
+        chosung_only = is_chosung_query(text)
+        key = text if chosung_only else decompose_hangul(text)
+        matches = set()
+        for branch in branches:
+            trie = self._tries.get(branch)
+            if trie:
+                matches |= trie.search(key)
+        
+        def rank(student_id: str) -> tuple:
+            entry = self._students[student_id]
+            name_key = entry["chosung"] if chosung_only else entry["jamo"]
+            if name_key == key:
+                order = 0
+            elif name_key.startswith(key):
+                order = 1
+            elif key in name_key:
+                order = 2
+            else:
+                order = 3  # id prefix
+            return (order, entry["name"], student_id)
+        
+        ranked = heapq.nsmallest(limit, (student_id for student_id in matches if student_id in self._students), key=rank)
+        return [
+            {field: self._students[student_id][field] for field in ("id", "name", "branch", "grade", "status")}
+            for student_id in ranked
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "students": len(self._students),
+            "branches": sorted(self._tries),
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+        }
+
+student_autocomplete = StudentAutocompleteIndex()
+
+# Streaming Export Utility Functions
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+
+MEMBER_EXPORT_COLUMNS = ["Parent Name", "Email", "Phone", "Branch", "Students", "Status", "Joined At", "Last Login"]
+STUDENT_EXPORT_COLUMNS = [
+    "Student ID", "Name", "Grade", "Birthdate", "Branch", "Program", "Status", "Parent Name", "Parent Phone",
+    "Parent Email", "Class", "Teacher", "Enrollment Progress (%)", "Created At"
+]
+PROGRESS_EXPORT_COLUMNS = [
+    "Student ID", "Student Name", "Branch", "Flow", "Current Step", "Status", "Enrollment Status",
+    "Completed Steps", "Total Steps", "Progress (%)", "Updated At"
+]
+
+async def iter_cursor_batches(cursor, size: int = EXPORT_BATCH_SIZE):
+    """Yield lists of documents from a Motor cursor without materializing the whole result"""
+    batch = []
+    async for doc in cursor.batch_size(size):
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def export_cell(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+async def stream_csv(columns: List[str], row_batches):
+    """Encode row batches as UTF-8 CSV chunks, with a BOM so Excel reads Hangul correctly"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+    async for rows in row_batches:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerows([export_cell(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+
+async def stream_xlsx(columns: List[str], row_batches):
+    """Write row batches to a write-only workbook on disk, then stream the file"""
+    from openpyxl import Workbook
+    
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(columns)
+    
+    def append_rows(rows: List[List[Any]]):
+        for row in rows:
+            sheet.append([export_cell(value) for value in row])
+    
+    with tempfile.TemporaryFile() as file:
+        async for rows in row_batches:
+            await asyncio.to_thread(append_rows, rows)
+        await asyncio.to_thread(workbook.save, file)
+        file.seek(0)
+        while True:
+            chunk = await asyncio.to_thread(file.read, EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def export_response(export_format: str, filename_prefix: str, columns: List[str], row_batches) -> StreamingResponse:
+    """Stream row batches as a CSV or XLSX download"""
+    if export_format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid format. Must be 'csv' or 'xlsx'")
+    
+    if export_format == "xlsx":
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=400, detail="XLSX export is not available on this server")
+        body = stream_xlsx(columns, row_batches)
+    else:
+        body = stream_csv(columns, row_batches)
+    
+    filename = f"{filename_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def member_export_row(row: Dict[str, Any]) -> List[Any]:
+    return [
+        row.get("name", ""),
+        row.get("email", ""),
+        row.get("phone", ""),
+        row.get("branch", ""),
+        "; ".join(student.get("name", "") for student in row.get("students", [])),
+        row.get("status", "active"),
+        row.get("created_at", ""),
+        row.get("last_login_at", "")
+    ]
+
+async def load_member_export_rows(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Member export rows built from users/parents/students, for users without a search row"""
+    users = await db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "password_hash": 0}).to_list(None)
+    parents = await db.parents.find({"user_id": {"$in": user_ids}}, {"_id": 0}).to_list(None)
+    parents_by_user = {parent["user_id"]: parent for parent in parents}
+    students = await db.students.find(
+        {"parent_id": {"$in": [parent["id"] for parent in parents]}}, {"_id": 0, "parent_id": 1, "name": 1}
+    ).to_list(None)
+    students_by_parent: Dict[str, List[Dict[str, Any]]] = {}
+    for student in students:
+        students_by_parent.setdefault(student["parent_id"], []).append(student)
+    
+    rows = {}
+    for user in users:
+        parent = parents_by_user.get(user["id"]) or {}
+        rows[user["id"]] = {
+            **user,
+            "branch": parent.get("branch", ""),
+            "students": students_by_parent.get(parent.get("id"), [])
+        }
+    return rows
+
+async def member_export_batches(search_query: Dict[str, Any]):
+    cursor = db.member_search.find(search_query, {"_id": 0, "tokens": 0, "search_text": 0}).sort(
+        [("created_at", DESCENDING), ("id", DESCENDING)]
+    )
+    async for batch in iter_cursor_batches(cursor):
+        yield [member_export_row(row) for row in batch]
+
+async def student_export_batches(query: Dict[str, Any]):
+    cursor = db.students.find(query, {"_id": 0}).sort([("created_at", DESCENDING), ("id", DESCENDING)])
+    async for batch in iter_cursor_batches(cursor):
+        # A fresh loader per batch keeps its cache from growing with the export
+        students = await enrich_students_for_admin(batch, RequestLoader())
+        yield [
+            [
+                student.id, student.name, student.grade, student.birthdate, student.branch,
+                student.program_subtype, student.status, student.parent_name, student.parent_phone,
+                student.parent_email, student.class_name, student.teacher_name,
+                round(student.enrollment_progress, 1), student.created_at
+            ]
+            for student in students
+        ]
+
+async def progress_export_batches(query: Dict[str, Any], branches: List[str]):
+    if not branches:
+        return
+    # Same parent-branch scoping as the progress report, applied on the server
+    cursor = db.student_enrollment_progress.aggregate([
+        {"$match": query},
+        {"$sort": {"student_id": 1}},
+        *progress_branch_filter_stages(branches),
+        {"$project": {"_id": 0, "pending_events": 0, "step_data": 0}}
+    ])
+    async for batch in iter_cursor_batches(cursor):
+        students = await RequestLoader().students_by_id.load_many([progress["student_id"] for progress in batch])
+        flows = await flow_registry.get_many(list({progress.get("flow_key") for progress in batch}))
+        flows_by_key = {flow.flow_key: flow for flow in flows if flow}
+        
+        rows = []
+        for progress, student in zip(batch, students):
+            student = student or {}
+            flow = flows_by_key.get(progress.get("flow_key"))
+            total_steps = flow.total_steps if flow else 0
+            completed_steps = len(progress.get("completed_steps", []))
+            rows.append([
+                progress["student_id"], student.get("name", ""), student.get("branch", ""),
+                progress.get("flow_key", ""), progress.get("current_step", ""), progress.get("status", ""),
+                progress.get("enrollment_status", ""), completed_steps, total_steps,
+                round(min(completed_steps / total_steps, 1.0) * 100, 1) if total_steps else 0.0,
+                progress.get("updated_at", "")
+            ])
+        if rows:
+            yield rows
+
+# Request-scoped Data Loader
+class BatchLoader:
+    """Coalesces lookups by one key field into a single $in query and caches the results.
+
+    Keys requested while the batch is pending (e.g. from coroutines running under the
+    same asyncio.gather) are fetched together; later requests for a cached key are free.
+    """
+
+    def __init__(self, collection_name: str, key_field: str, base_query: Optional[Dict[str, Any]] = None,
+                 many: bool = False, per_key_limit: Optional[int] = None):
+        self.collection_name = collection_name
+        self.key_field = key_field
+        self.base_query = base_query or {}
+        self.many = many
+        self.per_key_limit = per_key_limit
+        self._cache: Dict[Any, asyncio.Future] = {}
+        self._pending: List[Any] = []
+        self._dispatches: set = set()
+
+    async def load(self, key: Any) -> Any:
+        """Load the document (or list of documents when many=True) for a key"""
+        future = self._cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._cache[key] = future
+            self._pending.append(key)
+            if len(self._pending) == 1:
+                # Dispatch on the next loop iteration so sibling coroutines can join the batch
+                loop.call_soon(self._schedule_dispatch)
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: List[Any]) -> List[Any]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: Any, value: Any):
+        """Seed the cache with a document that was fetched elsewhere"""
+        if key not in self._cache:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._cache[key] = future
+
+    def _schedule_dispatch(self):
+        task = asyncio.ensure_future(self._dispatch())
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self):
+        keys, self._pending = self._pending, []
+        try:
+            query = {**self.base_query, self.key_field: {"$in": keys}}
+            docs = await db[self.collection_name].find(query, {"_id": 0}).to_list(None)
+            
+            grouped: Dict[Any, List[Dict[str, Any]]] = {}
+            for doc in docs:
+                grouped.setdefault(doc.get(self.key_field), []).append(doc)
+            
+            for key in keys:
+                matches = grouped.get(key, [])
+                if self.many:
+                    result = matches[:self.per_key_limit] if self.per_key_limit else matches
+                else:
+                    result = matches[0] if matches else None
+                self._cache[key].set_result(result)
+        except Exception as e:
+            for key in keys:
+                future = self._cache.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+
+class RequestLoader:
+    """Per-request batching/caching loaders for the most frequently re-read documents"""
+
+    def __init__(self):
+        self.parents_by_user_id = BatchLoader("parents", "user_id")
+        self.parents_by_id = BatchLoader("parents", "id")
+        self.students_by_id = BatchLoader("students", "id")
+        self.students_by_parent_id = BatchLoader("students", "parent_id", many=True, per_key_limit=10)
+        self.active_placements = BatchLoader("class_placements", "student_id", base_query={"status": "active"})
+        self.progress_by_student_id = BatchLoader("student_enrollment_progress", "student_id")
+
+    async def parent_for_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        parent = await self.parents_by_user_id.load(user_id)
+        if parent:
+            self.parents_by_id.prime(parent["id"], parent)
+        return parent
+
+    async def students_of_parent(self, parent_id: str) -> List[Dict[str, Any]]:
+        students = await self.students_by_parent_id.load(parent_id)
+        for student in students:
+            self.students_by_id.prime(student["id"], student)
+        return students
+
+async def get_request_loader() -> RequestLoader:
+    """FastAPI dependency providing a fresh RequestLoader for each request"""
+    return RequestLoader()
+
+# Enrollment Flow Registry
+FLOW_REGISTRY_TTL = float(os.environ.get('FLOW_REGISTRY_TTL', '300'))
+
+class CompiledFlow:
+    """Enrollment flow definition with its steps pre-sorted and indexed"""
+
+    def __init__(self, flow: Dict[str, Any]):
+        self.flow = flow
+        self.flow_key = flow["flow_key"]
+        self.name = flow.get("name", self.flow_key)
+        self.description = flow.get("description", "")
+        self.is_active = flow.get("is_active", True)
+        self.steps = sorted(flow.get("steps", []), key=lambda step: step["order"])
+        self.step_keys = [step["key"] for step in self.steps]
+        self.step_index = {key: index for index, key in enumerate(self.step_keys)}
+        self.steps_by_key = {step["key"]: step for step in self.steps}
+        self.total_steps = len(self.steps)
+        self.first_step = self.steps[0] if self.steps else None
+
+    def next_step_key(self, step_key: str) -> Optional[str]:
+        """Key of the step after step_key, or None when it is the last (or unknown) step"""
+        index = self.step_index.get(step_key)
+        if index is None or index + 1 >= self.total_steps:
+            return None
+        return self.step_keys[index + 1]
+
+class FlowRegistry:
+    """Process-wide cache of compiled enrollment flows
+
+    Flows are loaded in one query and kept until invalidated locally (flow
+    init/edit) or until the TTL expires, which bounds staleness when another
+    worker process edits a flow.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._flows: Dict[str, CompiledFlow] = {}
+        self._loaded_at: Optional[float] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def _ensure_loaded(self):
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            generation = self._generation
+            flows = await db.enrollment_flows.find({}, {"_id": 0}).to_list(None)
+            compiled = {flow["flow_key"]: CompiledFlow(flow) for flow in flows}
+            # Don't mark a load as fresh if it raced with an invalidation
+            if generation == self._generation:
+                self._flows = compiled
+                self._loaded_at = time.monotonic()
+
+    async def get(self, flow_key: str, active_only: bool = False) -> Optional[CompiledFlow]:
+        await self._ensure_loaded()
+        flow = self._flows.get(flow_key)
+        if flow and active_only and not flow.is_active:
+            return None
+        return flow
+
+    async def get_many(self, flow_keys: List[str]) -> List[Optional[CompiledFlow]]:
+        await self._ensure_loaded()
+        return [self._flows.get(flow_key) for flow_key in flow_keys]
+
+    async def list_flows(self, active_only: bool = True) -> List[CompiledFlow]:
+        await self._ensure_loaded()
+        return [flow for flow in self._flows.values() if flow.is_active or not active_only]
+
+    def invalidate(self):
+        self._generation += 1
+        self._loaded_at = None
+
+flow_registry = FlowRegistry(FLOW_REGISTRY_TTL)
 
 # Flow Management Utility Functions
 async def initialize_default_flows():
@@ -1256,31 +3018,34 @@ async def initialize_default_flows():
         flow_dict['updated_at'] = flow_dict['updated_at'].isoformat()
         await db.enrollment_flows.insert_one(flow_dict)
     
+    flow_registry.invalidate()
     return f"Successfully created {len(default_flows)} default flows"
 
-async def get_student_progress(student_id: str) -> Optional[ProgressResponse]:
+async def get_student_progress(student_id: str, loader: Optional[RequestLoader] = None) -> Optional[ProgressResponse]:
     """Get current progress for a student"""
-    progress = await db.student_enrollment_progress.find_one({"student_id": student_id})
+    loader = loader or RequestLoader()
+    progress = await loader.progress_by_student_id.load(student_id)
     if not progress:
         return None
     
-    # Get flow definition
-    flow = await db.enrollment_flows.find_one({"flow_key": progress["flow_key"]})
+    # Get flow definition and student info
+    flow, student = await asyncio.gather(
+        flow_registry.get(progress["flow_key"]),
+        loader.students_by_id.load(student_id)
+    )
     if not flow:
         return None
     
-    # Get student info
-    student = await db.students.find_one({"id": student_id})
     student_name = student["name"] if student else "Unknown"
     
-    total_steps = len(flow["steps"])
+    total_steps = flow.total_steps
     completed_count = len(progress["completed_steps"])
     progress_percentage = (completed_count / total_steps) * 100 if total_steps > 0 else 0
     
     # Determine next action
     next_action = None
     if progress["current_step"] and progress["current_step"] not in progress["completed_steps"]:
-        current_step_info = next((s for s in flow["steps"] if s["key"] == progress["current_step"]), None)
+        current_step_info = flow.steps_by_key.get(progress["current_step"])
         if current_step_info:
             next_action = f"Complete: {current_step_info['name']}"
     
@@ -1300,109 +3065,476 @@ async def get_student_progress(student_id: str) -> Optional[ProgressResponse]:
 async def trigger_flow_event(student_id: str, event_type: str, step_key: str, event_data: Dict = None, triggered_by: str = "system"):
     """Trigger a flow event and update progress"""
     try:
-        # Get student and progress
-        student = await db.students.find_one({"id": student_id})
-        if not student:
-            return {"error": "Student not found"}
-        
-        progress = await db.student_enrollment_progress.find_one({"student_id": student_id})
-        if not progress:
+        event = await apply_flow_event(student_id, event_type, step_key, event_data, triggered_by)
+        if not event:
+            student = await db.students.find_one({"id": student_id}, {"_id": 0, "id": 1})
+            if not student:
+                return {"error": "Student not found"}
             return {"error": "Progress record not found"}
         
-        # Log the event
-        event = FlowEvent(
-            student_id=student_id,
-            household_token=progress["household_token"],
-            event_type=event_type,
-            step_key=step_key,
-            event_data=event_data or {},
-            triggered_by=triggered_by
-        )
-        
-        event_dict = event.dict()
-        event_dict['created_at'] = event_dict['created_at'].isoformat()
-        await db.flow_events.insert_one(event_dict)
-        
-        # Update progress based on event
-        await update_progress_from_event(student_id, event_type, step_key, event_data)
-        
-        return {"success": True, "event_id": event.id}
+        return {"success": True, "event_id": event["id"]}
         
     except Exception as e:
         return {"error": str(e)}
 
-async def update_progress_from_event(student_id: str, event_type: str, step_key: str, event_data: Dict = None):
-    """Update student progress based on triggered event"""
-    progress = await db.student_enrollment_progress.find_one({"student_id": student_id})
-    if not progress:
-        return
-    
-    flow = await db.enrollment_flows.find_one({"flow_key": progress["flow_key"]})
+class InvalidFlowStepError(ValueError):
+    pass
+
+def validate_flow_step_key(flow: Optional[CompiledFlow], event_type: str, step_key: str):
+    """Reject step keys that are unsafe as a step_data field name
+
+    Only .completed events write step_data and advance the flow, so only they
+    must name a step of the student's flow; other events (e.g. an exam or
+    payment event for a step this flow doesn't have) are still recorded.
+    """
+    if not step_key or "." in step_key or step_key.startswith("$"):
+        raise InvalidFlowStepError(f"Invalid step_key '{step_key}'")
+    if flow and event_type.endswith(".completed") and step_key not in flow.step_index:
+        raise InvalidFlowStepError(f"Step '{step_key}' is not part of flow {flow.flow_key}")
+
+def compute_flow_event_changes(progress: Dict[str, Any], flow: Optional[CompiledFlow], event_type: str, step_key: str, event_data: Dict = None):
+    """Work out the $set fields and completed step an event applies to a progress record"""
+    set_fields = {}
+    completed_step = None
     if not flow:
-        return
-    
-    # Get flow steps ordered
-    steps = sorted(flow["steps"], key=lambda x: x["order"])
-    step_keys = [s["key"] for s in steps]
-    
-    updates = {
-        "updated_at": datetime.now(timezone.utc).isoformat()
-    }
+        return set_fields, completed_step
+    validate_flow_step_key(flow, event_type, step_key)
     
     # Handle different event types
     if event_type.endswith(".completed"):
-        # Mark step as completed
-        if step_key not in progress["completed_steps"]:
-            updates["$addToSet"] = {"completed_steps": step_key}
-        
-        # Update step data
-        step_data = progress.get("step_data", {})
-        step_data[step_key] = event_data or {}
-        updates["step_data"] = step_data
-        
-        # Move to next step
-        try:
-            current_index = step_keys.index(step_key)
-            if current_index + 1 < len(step_keys):
-                updates["current_step"] = step_keys[current_index + 1]
+        # Mark step as completed and store its data
+        completed_step = step_key
+        set_fields[f"step_data.{step_key}"] = event_data or {}
+        
+        # Move to next step (never backwards, events may arrive out of order)
+        if step_key in flow.step_index:
+            next_step_key = flow.next_step_key(step_key)
+            if next_step_key:
+                current_index = flow.step_index.get(progress.get("current_step"), -1)
+                if flow.step_index[next_step_key] > current_index:
+                    set_fields["current_step"] = next_step_key
             else:
                 # All steps completed
-                updates["status"] = "completed"
-                updates["enrollment_status"] = "enrolled"
-        except ValueError:
-            pass
+                set_fields["status"] = "completed"
+                set_fields["enrollment_status"] = "enrolled"
     
     elif event_type.startswith("payment.paid"):
         # Handle payment events
         if step_key in ["entrance_payment", "tuition_payment"]:
-            if step_key not in progress["completed_steps"]:
-                updates["$addToSet"] = {"completed_steps": step_key}
+            completed_step = step_key
             
             # Update enrollment status
             if step_key == "entrance_payment":
-                updates["enrollment_status"] = "payment_completed"
+                set_fields["enrollment_status"] = "payment_completed"
             elif step_key == "tuition_payment":
-                updates["enrollment_status"] = "tuition_paid"
+                set_fields["enrollment_status"] = "tuition_paid"
     
     elif event_type.startswith("class.assigned"):
         # Handle class placement
         if step_key == "placement":
-            if step_key not in progress["completed_steps"]:
-                updates["$addToSet"] = {"completed_steps": step_key}
-            updates["enrollment_status"] = "enrolled"
-    
-    # Apply updates
-    if "$addToSet" in updates:
-        addToSet = updates.pop("$addToSet")
-        await db.student_enrollment_progress.update_one(
+            completed_step = step_key
+            set_fields["enrollment_status"] = "enrolled"
+    
+    return set_fields, completed_step
+
+async def apply_flow_event(student_id: str, event_type: str, step_key: str, event_data: Dict = None, triggered_by: str = "system") -> Optional[Dict[str, Any]]:
+    """Apply a flow event to a student's progress and outbox the event in the same write
+
+    The write is guarded on the version read, so concurrent events for the
+    same student re-read and retry instead of overwriting each other.
+    Returns the recorded event, or None when the student has no progress.
+    """
+    for _ in range(FLOW_EVENT_MAX_RETRIES):
+        progress = await db.student_enrollment_progress.find_one(
             {"student_id": student_id},
-            {"$set": updates, "$addToSet": addToSet}
+            {"_id": 0, "pending_events": 0}
         )
-    else:
-        await db.student_enrollment_progress.update_one(
+        if not progress:
+            return None
+        
+        flow = await flow_registry.get(progress["flow_key"])
+        set_fields, completed_step = compute_flow_event_changes(progress, flow, event_type, step_key, event_data)
+        set_fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+        
+        event = FlowEvent(
+            student_id=student_id,
+            household_token=progress["household_token"],
+            event_type=event_type,
+            step_key=step_key,
+            event_data=event_data or {},
+            triggered_by=triggered_by
+        )
+        event_dict = event.dict()
+        event_dict['created_at'] = event_dict['created_at'].isoformat()
+        
+        update_doc = {
+            "$set": set_fields,
+            "$inc": {"version": 1},
+            "$push": {"pending_events": event_dict}
+        }
+        if completed_step:
+            update_doc["$addToSet"] = {"completed_steps": completed_step}
+        
+        # A missing version field matches None, so older records are covered too
+        updated = await db.student_enrollment_progress.find_one_and_update(
+            {"student_id": student_id, "version": progress.get("version")},
+            update_doc,
+            projection=PROGRESS_SUMMARY_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if updated:
+            await record_progress_summary_transition(progress, updated)
+            run_in_background(relay_pending_flow_events(student_id))
+            return event_dict
+    
+    raise RuntimeError(f"Progress for student {student_id} kept changing; event {event_type} not applied")
+
+# Flow Event Outbox
+FLOW_EVENT_MAX_RETRIES = 5
+FLOW_EVENT_RELAY_INTERVAL = float(os.environ.get('FLOW_EVENT_RELAY_INTERVAL', '30'))
+
+async def relay_pending_flow_events(student_id: str) -> int:
+    """Copy outboxed events of a progress record into flow_events, then drop them from the outbox"""
+    try:
+        progress = await db.student_enrollment_progress.find_one(
             {"student_id": student_id},
-            {"$set": updates}
+            {"_id": 0, "pending_events": 1}
+        )
+        events = (progress or {}).get("pending_events") or []
+        return await relay_flow_events(events)
+    except Exception as e:
+        logger.warning(f"Failed to relay flow events for student {student_id}: {str(e)}")
+        return 0
+
+async def relay_flow_events(events: List[Dict[str, Any]]) -> int:
+    """Write outboxed events to flow_events and remove them from their progress records"""
+    if not events:
+        return 0
+    
+    # Upsert by event id so a relay interrupted before the $pull can safely run again
+    await db.flow_events.bulk_write(
+        [UpdateOne({"id": event["id"]}, {"$setOnInsert": event}, upsert=True) for event in events],
+        ordered=False
+    )
+    await db.student_enrollment_progress.update_many(
+        {"student_id": {"$in": list({event["student_id"] for event in events})}},
+        {"$pull": {"pending_events": {"id": {"$in": [event["id"] for event in events]}}}}
+    )
+    return len(events)
+
+async def sweep_pending_flow_events(batch_size: int = 100) -> int:
+    """Relay outboxed events left behind by interrupted relays"""
+    progress_records = await db.student_enrollment_progress.find(
+        {"pending_events.0": {"$exists": True}},
+        {"_id": 0, "student_id": 1}
+    ).to_list(batch_size)
+    
+    relayed = 0
+    for record in progress_records:
+        relayed += await relay_pending_flow_events(record["student_id"])
+    return relayed
+
+async def run_flow_event_relay():
+    """Background loop that periodically sweeps the flow event outbox"""
+    while True:
+        try:
+            await sweep_pending_flow_events()
+        except Exception as e:
+            logger.warning(f"Flow event sweep failed: {str(e)}")
+        await asyncio.sleep(FLOW_EVENT_RELAY_INTERVAL)
+
+# Bulk Flow Event Utility Functions
+BULK_FLOW_EVENT_MAX_ITEMS = int(os.environ.get('BULK_FLOW_EVENT_MAX_ITEMS', '5000'))
+BULK_WRITE_CHUNK_SIZE = 500
+
+def chunked(items: List[Any], size: int):
+    """Yield successive slices of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+async def load_progress_for_students(student_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Load progress records for many students with chunked $in queries"""
+    progress_by_student = {}
+    for chunk in chunked(student_ids, BULK_WRITE_CHUNK_SIZE):
+        records = await db.student_enrollment_progress.find(
+            {"student_id": {"$in": chunk}},
+            {"_id": 0, "pending_events": 0}
+        ).to_list(None)
+        progress_by_student.update({record["student_id"]: record for record in records})
+    return progress_by_student
+
+async def apply_flow_events_bulk(items: List[Dict[str, Any]], triggered_by: str) -> List[Dict[str, Any]]:
+    """Apply many flow events with version-guarded bulk writes
+
+    Events for the same student are applied in request order, one per round,
+    each round being a set of unordered bulk writes. Writes that lose a race
+    with a concurrent update are retried against a fresh read, like
+    apply_flow_event. Returns one result per item, in request order.
+    """
+    results = [{"index": index, "student_id": item["student_id"], "success": False} for index, item in enumerate(items)]
+    
+    # Queue each student's events in request order
+    queues: Dict[str, List[int]] = {}
+    for index, item in enumerate(items):
+        queues.setdefault(item["student_id"], []).append(index)
+    
+    progress_by_student = await load_progress_for_students(list(queues.keys()))
+    missing_student_ids = [student_id for student_id in queues if student_id not in progress_by_student]
+    if missing_student_ids:
+        existing_students = await db.students.find(
+            {"id": {"$in": missing_student_ids}}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        existing_ids = {student["id"] for student in existing_students}
+        for student_id in missing_student_ids:
+            error = "Progress record not found" if student_id in existing_ids else "Student not found"
+            for index in queues.pop(student_id):
+                results[index]["error"] = error
+    
+    # Reject events for steps the student's flow does not have before writing anything
+    for student_id in list(queues):
+        flow = await flow_registry.get(progress_by_student[student_id]["flow_key"])
+        for index in list(queues[student_id]):
+            try:
+                validate_flow_step_key(flow, items[index]["event_type"], items[index]["step_key"])
+            except InvalidFlowStepError as e:
+                results[index]["error"] = str(e)
+                queues[student_id].remove(index)
+        if not queues[student_id]:
+            del queues[student_id]
+    
+    applied_events = []
+    transitions = []
+    attempts: Dict[int, int] = {}
+    
+    while queues:
+        # Build one guarded update per student for the head of its queue
+        planned = {}
+        for student_id, indexes in queues.items():
+            index = indexes[0]
+            item = items[index]
+            progress = progress_by_student[student_id]
+            flow = await flow_registry.get(progress["flow_key"])
+            set_fields, completed_step = compute_flow_event_changes(
+                progress, flow, item["event_type"], item["step_key"], item.get("event_data")
+            )
+            set_fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+            
+            event = FlowEvent(
+                student_id=student_id,
+                household_token=progress["household_token"],
+                event_type=item["event_type"],
+                step_key=item["step_key"],
+                event_data=item.get("event_data") or {},
+                triggered_by=triggered_by
+            )
+            event_dict = event.dict()
+            event_dict['created_at'] = event_dict['created_at'].isoformat()
+            
+            update_doc = {
+                "$set": set_fields,
+                "$inc": {"version": 1},
+                "$push": {"pending_events": event_dict}
+            }
+            if completed_step:
+                update_doc["$addToSet"] = {"completed_steps": completed_step}
+            
+            planned[student_id] = (index, event_dict, set_fields, completed_step, UpdateOne(
+                {"student_id": student_id, "version": progress.get("version")},
+                update_doc
+            ))
+        
+        student_ids = list(planned.keys())
+        modified_count = 0
+        for chunk in chunked(student_ids, BULK_WRITE_CHUNK_SIZE):
+            result = await db.student_enrollment_progress.bulk_write(
+                [planned[student_id][4] for student_id in chunk],
+                ordered=False
+            )
+            modified_count += result.modified_count
+        
+        # bulk_write only reports counts, so look up which events landed when some didn't
+        if modified_count == len(student_ids):
+            applied_ids = {planned[student_id][1]["id"] for student_id in student_ids}
+        else:
+            event_ids = [planned[student_id][1]["id"] for student_id in student_ids]
+            landed = await db.student_enrollment_progress.find(
+                {"pending_events.id": {"$in": event_ids}},
+                {"_id": 0, "pending_events.id": 1}
+            ).to_list(None)
+            applied_ids = {event["id"] for record in landed for event in record.get("pending_events", [])}
+            # A concurrent relay may already have moved some of them to flow_events
+            relayed = await db.flow_events.find({"id": {"$in": event_ids}}, {"_id": 0, "id": 1}).to_list(None)
+            applied_ids.update(event["id"] for event in relayed)
+        
+        conflicted = []
+        for student_id in student_ids:
+            index, event_dict, set_fields, completed_step, _ = planned[student_id]
+            if event_dict["id"] in applied_ids:
+                # Mirror the write locally so the student's next event builds on it
+                before = progress_by_student[student_id]
+                after = {**before, **{k: v for k, v in set_fields.items() if not k.startswith("step_data.")}}
+                after["version"] = (before.get("version") or 0) + 1
+                if completed_step and completed_step not in after.get("completed_steps", []):
+                    after["completed_steps"] = after.get("completed_steps", []) + [completed_step]
+                progress_by_student[student_id] = after
+                transitions.append((before, after))
+                applied_events.append(event_dict)
+                
+                results[index].update({"success": True, "event_id": event_dict["id"]})
+                queues[student_id].pop(0)
+            else:
+                attempts[index] = attempts.get(index, 0) + 1
+                if attempts[index] >= FLOW_EVENT_MAX_RETRIES:
+                    results[index]["error"] = "Progress kept changing; event not applied"
+                    queues[student_id].pop(0)
+                else:
+                    conflicted.append(student_id)
+            
+            if not queues[student_id]:
+                del queues[student_id]
+        
+        # Re-read students whose write lost a race before retrying
+        if conflicted:
+            progress_by_student.update(await load_progress_for_students(conflicted))
+    
+    await record_progress_summary_transitions(transitions)
+    
+    # Relay the whole batch now instead of one background relay per student
+    for chunk in chunked(applied_events, BULK_WRITE_CHUNK_SIZE):
+        await relay_flow_events(chunk)
+    
+    return results
+
+# Progress Report Utility Functions
+PROGRESS_SUMMARY_MATERIALIZED = os.environ.get('PROGRESS_SUMMARY_MATERIALIZED', 'false').lower() == 'true'
+
+# Progress field -> statistics bucket in the progress report
+PROGRESS_SUMMARY_DIMENSIONS = {
+    "status": "by_status",
+    "enrollment_status": "by_enrollment_status",
+    "flow_key": "by_flow"
+}
+PROGRESS_SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in PROGRESS_SUMMARY_DIMENSIONS}}
+
+def progress_branch_filter_stages(branch: Union[str, List[str]]) -> List[Dict[str, Any]]:
+    """Pipeline stages keeping only progress records whose parent belongs to a branch (or any of several)"""
+    return [
+        {"$lookup": {"from": "students", "localField": "student_id", "foreignField": "id", "as": "_student"}},
+        {"$lookup": {"from": "parents", "localField": "_student.parent_id", "foreignField": "id", "as": "_parent"}},
+        {"$match": {"_parent.branch": {"$in": branch} if isinstance(branch, list) else branch}},
+        {"$project": {"_student": 0, "_parent": 0}}
+    ]
+
+async def compute_progress_statistics() -> Dict[str, Any]:
+    """Aggregate progress report statistics in a single $facet pass"""
+    facets = {"total": [{"$count": "count"}]}
+    for field, bucket in PROGRESS_SUMMARY_DIMENSIONS.items():
+        facets[bucket] = [{"$group": {"_id": {"$ifNull": [f"${field}", "unknown"]}, "count": {"$sum": 1}}}]
+    
+    result = await db.student_enrollment_progress.aggregate([{"$facet": facets}]).to_list(1)
+    facet_result = result[0] if result else {}
+    
+    total = facet_result.get("total") or [{"count": 0}]
+    stats = {"total_students": total[0]["count"]}
+    for bucket in PROGRESS_SUMMARY_DIMENSIONS.values():
+        stats[bucket] = {group["_id"]: group["count"] for group in facet_result.get(bucket, [])}
+    return stats
+
+progress_summary_rebuild_lock = asyncio.Lock()
+
+async def rebuild_progress_report_summary(only_if_empty: bool = False) -> Optional[Dict[str, Any]]:
+    """Recompute the materialized progress summary from the progress collection
+
+    Rebuilds in this process are serialized, and rows are replaced in place
+    rather than deleted and re-inserted, so a concurrent rebuild or reader
+    never sees an empty summary or hits the unique (dimension, value) index.
+    With only_if_empty, returns None without rebuilding when another caller
+    already filled the summary.
+    """
+    async with progress_summary_rebuild_lock:
+        if only_if_empty and await db.progress_report_summary.find_one({}, {"_id": 1}):
+            return None
+        stats = await compute_progress_statistics()
+        
+        summary_docs = [{"dimension": "total", "value": "all", "count": stats["total_students"]}]
+        for field, bucket in PROGRESS_SUMMARY_DIMENSIONS.items():
+            summary_docs.extend(
+                {"dimension": field, "value": value, "count": count}
+                for value, count in stats[bucket].items()
+            )
+        
+        await db.progress_report_summary.bulk_write([
+            ReplaceOne({"dimension": doc["dimension"], "value": doc["value"]}, doc, upsert=True)
+            for doc in summary_docs
+        ], ordered=False)
+        # Values no longer present in any progress record
+        await db.progress_report_summary.update_many(
+            {"$nor": [{"dimension": doc["dimension"], "value": doc["value"]} for doc in summary_docs]},
+            {"$set": {"count": 0}}
         )
+        return stats
+
+async def read_progress_report_summary() -> Dict[str, Any]:
+    """Read statistics from the materialized summary, rebuilding it when empty"""
+    summary_docs = await db.progress_report_summary.find({}, {"_id": 0}).to_list(None)
+    if not summary_docs:
+        stats = await rebuild_progress_report_summary(only_if_empty=True)
+        if stats is not None:
+            return stats
+        summary_docs = await db.progress_report_summary.find({}, {"_id": 0}).to_list(None)
+    
+    stats = {"total_students": 0, **{bucket: {} for bucket in PROGRESS_SUMMARY_DIMENSIONS.values()}}
+    for doc in summary_docs:
+        if doc["dimension"] == "total":
+            stats["total_students"] = doc["count"]
+        elif doc["dimension"] in PROGRESS_SUMMARY_DIMENSIONS and doc["count"] > 0:
+            stats[PROGRESS_SUMMARY_DIMENSIONS[doc["dimension"]]][doc["value"]] = doc["count"]
+    return stats
+
+async def get_progress_statistics() -> Dict[str, Any]:
+    """Get progress report statistics from the materialized summary or a live aggregation"""
+    if PROGRESS_SUMMARY_MATERIALIZED:
+        return await read_progress_report_summary()
+    return await compute_progress_statistics()
+
+async def record_progress_summary_transition(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+    """Apply a progress record change (insert, update or delete) to the materialized summary"""
+    await record_progress_summary_transitions([(before, after)])
+
+async def record_progress_summary_transitions(transitions: List[tuple]):
+    """Apply many (before, after) progress record changes to the summary in one bulk write"""
+    if not PROGRESS_SUMMARY_MATERIALIZED:
+        return
+    
+    increments = {}
+    for before, after in transitions:
+        if before is None:
+            increments[("total", "all")] = increments.get(("total", "all"), 0) + 1
+        if after is None:
+            increments[("total", "all")] = increments.get(("total", "all"), 0) - 1
+        
+        for field in PROGRESS_SUMMARY_DIMENSIONS:
+            old_value = (before.get(field) or "unknown") if before else None
+            new_value = (after.get(field) or "unknown") if after else None
+            if old_value == new_value:
+                continue
+            if old_value is not None:
+                increments[(field, old_value)] = increments.get((field, old_value), 0) - 1
+            if new_value is not None:
+                increments[(field, new_value)] = increments.get((field, new_value), 0) + 1
+    
+    operations = [
+        UpdateOne({"dimension": dimension, "value": value}, {"$inc": {"count": delta}}, upsert=True)
+        for (dimension, value), delta in increments.items() if delta
+    ]
+    if not operations:
+        return
+    
+    try:
+        await db.progress_report_summary.bulk_write(operations, ordered=False)
+    except Exception as e:
+        # The summary can always be rebuilt, so never fail the progress write over it
+        logger.warning(f"Failed to update progress report summary: {str(e)}")
 
 # Dashboard Utility Functions
 async def get_program_display_name(branch: str, program_subtype: str) -> str:
@@ -1445,9 +3577,33 @@ async def get_student_enrollment_status(student_id: str) -> str:
     assignment = await db.class_placements.find_one({"student_id": student_id, "status": "active"})
     return "enrolled" if assignment else "pre_enrollment"
 
-async def build_admission_progress_card(student_id: str) -> AdmissionProgressCard:
+class DashboardCardContext:
+    """Per-request state shared by the dashboard card builders.
+
+    Lookups that several cards need (the active class placement, progress and
+    flow documents) go through the request's RequestLoader, so they are fetched
+    once and shared by every concurrently running card that asks for them.
+    """
+
+    def __init__(self, student: Dict[str, Any], household_token: str, loader: Optional[RequestLoader] = None):
+        self.student = student
+        self.student_id = student["id"]
+        self.household_token = household_token
+        self.loader = loader or RequestLoader()
+        self.loader.students_by_id.prime(self.student_id, student)
+
+    async def active_placement(self) -> Optional[Dict[str, Any]]:
+        return await self.loader.active_placements.load(self.student_id)
+
+    async def progress(self) -> Optional[ProgressResponse]:
+        return await get_student_progress(self.student_id, self.loader)
+
+    async def flow(self, flow_key: str) -> Optional[CompiledFlow]:
+        return await flow_registry.get(flow_key)
+
+async def build_admission_progress_card(ctx: DashboardCardContext) -> AdmissionProgressCard:
     """Build admission progress card data"""
-    progress = await get_student_progress(student_id)
+    progress = await ctx.progress()
     
     if not progress:
         return AdmissionProgressCard(
@@ -1462,8 +3618,8 @@ async def build_admission_progress_card(student_id: str) -> AdmissionProgressCar
         )
     
     # Get flow info for display name
-    flow = await db.enrollment_flows.find_one({"flow_key": progress.flow_key})
-    flow_name = flow["name"] if flow else progress.flow_key
+    flow = await ctx.flow(progress.flow_key)
+    flow_name = flow.name if flow else progress.flow_key
     
     return AdmissionProgressCard(
         current_step=progress.current_step,
@@ -1476,9 +3632,9 @@ async def build_admission_progress_card(student_id: str) -> AdmissionProgressCar
         flow_name=flow_name
     )
 
-async def build_exam_card(student_id: str, student: Dict[str, Any]) -> ExamCard:
+async def build_exam_card(ctx: DashboardCardContext) -> ExamCard:
     """Build exam card data"""
-    show_card = await should_show_exam_card(student)
+    show_card = await should_show_exam_card(ctx.student)
     
     if not show_card:
         return ExamCard(
@@ -1493,16 +3649,10 @@ async def build_exam_card(student_id: str, student: Dict[str, Any]) -> ExamCard:
             next_action=None
         )
     
-    # Get latest reservation
-    reservation = await db.exam_reservations.find_one(
-        {"student_id": student_id}, 
-        sort=[("created_at", -1)]
-    )
-    
-    # Get latest result
-    result = await db.exam_results.find_one(
-        {"student_id": student_id},
-        sort=[("tested_at", -1)]
+    # Get latest reservation and latest result
+    reservation, result = await asyncio.gather(
+        db.exam_reservations.find_one({"student_id": ctx.student_id}, sort=[("created_at", -1)]),
+        db.exam_results.find_one({"student_id": ctx.student_id}, sort=[("tested_at", -1)])
     )
     
     next_action = None
@@ -1525,9 +3675,9 @@ async def build_exam_card(student_id: str, student: Dict[str, Any]) -> ExamCard:
         next_action=next_action
     )
 
-async def build_timetable_card(student_id: str) -> TimetableCard:
+async def build_timetable_card(ctx: DashboardCardContext) -> TimetableCard:
     """Build timetable card data"""
-    assignment = await db.class_placements.find_one({"student_id": student_id, "status": "active"})
+    assignment = await ctx.active_placement()
     
     if not assignment:
         return TimetableCard(
@@ -1555,10 +3705,10 @@ async def build_timetable_card(student_id: str) -> TimetableCard:
         start_date=assignment["start_date"].isoformat() if assignment.get("start_date") else None
     )
 
-async def build_homework_card(student_id: str) -> HomeworkCard:
+async def build_homework_card(ctx: DashboardCardContext) -> HomeworkCard:
     """Build homework card data"""
     # Get class assignment
-    assignment = await db.class_placements.find_one({"student_id": student_id, "status": "active"})
+    assignment = await ctx.active_placement()
     
     if not assignment:
         return HomeworkCard(
@@ -1569,11 +3719,11 @@ async def build_homework_card(student_id: str) -> HomeworkCard:
             recent_assignments=[]
         )
     
-    # Get homework for this class
-    homework_list = await db.homeworks.find({"class_assignment_id": assignment["id"]}).to_list(100)
-    
-    # Get submissions for this student
-    submissions = await db.homework_submissions.find({"student_id": student_id}).to_list(100)
+    # Get homework for this class and submissions for this student
+    homework_list, submissions = await asyncio.gather(
+        db.homeworks.find({"class_assignment_id": assignment["id"]}).to_list(100),
+        db.homework_submissions.find({"student_id": ctx.student_id}).to_list(100)
+    )
     submission_map = {sub["homework_id"]: sub for sub in submissions}
     
     pending_count = 0
@@ -1608,10 +3758,10 @@ async def build_homework_card(student_id: str) -> HomeworkCard:
         recent_assignments=recent_assignments
     )
 
-async def build_attendance_card(student_id: str) -> AttendanceCard:
+async def build_attendance_card(ctx: DashboardCardContext) -> AttendanceCard:
     """Build attendance card data"""
     # Get class assignment
-    assignment = await db.class_placements.find_one({"student_id": student_id, "status": "active"})
+    assignment = await ctx.active_placement()
     
     if not assignment:
         return AttendanceCard(
@@ -1626,7 +3776,7 @@ async def build_attendance_card(student_id: str) -> AttendanceCard:
     
     # Get attendance records
     attendance_records = await db.attendances.find({
-        "student_id": student_id,
+        "student_id": ctx.student_id,
         "class_assignment_id": assignment["id"]
     }).sort("date", -1).to_list(100)
     
@@ -1656,28 +3806,26 @@ async def build_attendance_card(student_id: str) -> AttendanceCard:
         recent_attendance=recent_attendance
     )
 
-async def build_billing_card(student_id: str, household_token: str) -> BillingCard:
+async def build_billing_card(ctx: DashboardCardContext) -> BillingCard:
     """Build billing card data"""
-    # Get pending payments
-    pending_payments = await db.payment_records.find({
-        "student_id": student_id,
-        "payment_status": "pending"
-    }).sort("due_date", 1).to_list(50)
-    
-    # Get current month billing
+    # Get pending payments, current month billing and payment history count
     current_month = datetime.now(timezone.utc).strftime("%Y-%m")
-    current_billing = await db.billings.find_one({
-        "student_id": student_id,
-        "month": current_month
-    })
+    pending_payments, current_billing, history_count = await asyncio.gather(
+        db.payment_records.find({
+            "student_id": ctx.student_id,
+            "payment_status": "pending"
+        }).sort("due_date", 1).to_list(50),
+        db.billings.find_one({
+            "student_id": ctx.student_id,
+            "month": current_month
+        }),
+        db.payment_records.count_documents({"student_id": ctx.student_id})
+    )
     
     # Count overdue payments
     now = datetime.now(timezone.utc)
     overdue_count = len([p for p in pending_payments if p.get("due_date") and p["due_date"] < now])
     
-    # Get payment history count
-    history_count = await db.payment_records.count_documents({"student_id": student_id})
-    
     pending_list = []
     for payment in pending_payments:
         pending_list.append({
@@ -1696,9 +3844,9 @@ async def build_billing_card(student_id: str, household_token: str) -> BillingCa
         overdue_count=overdue_count
     )
 
-async def build_notices_card(student_id: str, student: Dict[str, Any]) -> NoticesCard:
+async def build_notices_card(ctx: DashboardCardContext) -> NoticesCard:
     """Build notices card data"""
-    branch = student.get("branch", "")
+    branch = ctx.student.get("branch", "")
     
     # Build query for relevant notices
     query = {
@@ -1709,12 +3857,11 @@ async def build_notices_card(student_id: str, student: Dict[str, Any]) -> Notice
         ]
     }
     
-    # Get notices
-    notices = await db.notices.find(query).sort("created_at", -1).limit(20).to_list(20)
-    
-    # Get acknowledgments for this student
-    ack_query = {"student_id": student_id}
-    acknowledgments = await db.notice_acknowledgments.find(ack_query).to_list(100)
+    # Get notices and acknowledgments for this student
+    notices, acknowledgments = await asyncio.gather(
+        db.notices.find(query).sort("created_at", -1).limit(20).to_list(20),
+        db.notice_acknowledgments.find({"student_id": ctx.student_id}).to_list(100)
+    )
     ack_map = {ack["notice_id"]: ack for ack in acknowledgments}
     
     unread_count = 0
@@ -1746,9 +3893,9 @@ async def build_notices_card(student_id: str, student: Dict[str, Any]) -> Notice
         recent_notices=recent_notices[:5]  # Top 5
     )
 
-async def build_resources_card(student_id: str, household_token: str, student: Dict[str, Any]) -> ResourcesCard:
+async def build_resources_card(ctx: DashboardCardContext) -> ResourcesCard:
     """Build resources card data"""
-    branch = student.get("branch", "")
+    branch = ctx.student.get("branch", "")
     
     # Get guides for this branch
     query = {
@@ -1759,10 +3906,12 @@ async def build_resources_card(student_id: str, household_token: str, student: D
         ]
     }
     
-    guides = await db.guides.find(query).to_list(100)
-    
-    # Get guide acknowledgments
-    guide_acks = await db.guide_acknowledgments.find({"student_id": student_id}).to_list(100)
+    # Get guides, guide acknowledgments and consent status (from existing admission_data)
+    guides, guide_acks, admission_data = await asyncio.gather(
+        db.guides.find(query).to_list(100),
+        db.guide_acknowledgments.find({"student_id": ctx.student_id}).to_list(100),
+        db.admission_data.find_one({"household_token": ctx.household_token})
+    )
     ack_map = {ack["guide_id"]: ack for ack in guide_acks}
     
     guides_unread = 0
@@ -1777,8 +3926,7 @@ async def build_resources_card(student_id: str, household_token: str, student: D
         if is_required and not is_acknowledged:
             required_guides_pending += 1
     
-    # Check consent status (from existing admission_data or new consent system)
-    admission_data = await db.admission_data.find_one({"household_token": household_token})
+    # Check consent status
     consent_pending = bool(admission_data and admission_data.get("consent_status") != "completed")
     
     return ResourcesCard(
@@ -1788,8 +3936,65 @@ async def build_resources_card(student_id: str, household_token: str, student: D
         consent_pending=consent_pending
     )
 
-# Routes
-@api_router.get("/")
+# Dashboard Card Assembly
+# Each card is built concurrently; a card that raises or times out is replaced
+# by its fallback so one failing lookup does not fail the whole dashboard.
+DASHBOARD_CARD_TIMEOUT = float(os.environ.get('DASHBOARD_CARD_TIMEOUT', '5'))
+
+DASHBOARD_CARDS = {
+    "admission_progress": (build_admission_progress_card, lambda: AdmissionProgressCard(
+        current_step="", completed_steps=[], total_steps=0, progress_percentage=0,
+        status="unavailable", enrollment_status="new", next_action=None, flow_name=""
+    )),
+    "exam": (build_exam_card, lambda: ExamCard(
+        show_card=False, has_reservation=False, reservation_date=None, reservation_time=None,
+        has_result=False, score=None, level=None, passed=None, next_action=None
+    )),
+    "timetable": (build_timetable_card, lambda: TimetableCard(
+        show_card=False, is_enrolled=False, class_name=None, teacher_name=None,
+        schedule=None, classroom=None, level=None, start_date=None
+    )),
+    "homework": (build_homework_card, lambda: HomeworkCard(
+        show_card=False, total_assignments=0, pending_count=0, overdue_count=0, recent_assignments=[]
+    )),
+    "attendance": (build_attendance_card, lambda: AttendanceCard(
+        show_card=False, total_classes=0, present_count=0, absent_count=0, late_count=0,
+        attendance_rate=0.0, recent_attendance=[]
+    )),
+    "billing": (build_billing_card, lambda: BillingCard(
+        pending_payments=[], current_month_amount=None, due_date=None,
+        payment_history_count=0, overdue_count=0
+    )),
+    "notices": (build_notices_card, lambda: NoticesCard(
+        unread_count=0, urgent_count=0, recent_notices=[]
+    )),
+    "resources": (build_resources_card, lambda: ResourcesCard(
+        guides_total=0, guides_unread=0, required_guides_pending=0, consent_pending=False
+    )),
+}
+
+async def assemble_dashboard_cards(student_info: StudentInfo, ctx: DashboardCardContext) -> DashboardCardsResponse:
+    """Build all dashboard cards concurrently, falling back per card on failure"""
+    card_names = list(DASHBOARD_CARDS.keys())
+    results = await asyncio.gather(
+        *(asyncio.wait_for(DASHBOARD_CARDS[name][0](ctx), DASHBOARD_CARD_TIMEOUT) for name in card_names),
+        return_exceptions=True
+    )
+    
+    cards = {}
+    failed_cards = []
+    for name, result in zip(card_names, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Dashboard card '{name}' failed for student {ctx.student_id}: {result!r}")
+            cards[name] = DASHBOARD_CARDS[name][1]()
+            failed_cards.append(name)
+        else:
+            cards[name] = result
+    
+    return DashboardCardsResponse(student_info=student_info, failed_cards=failed_cards, **cards)
+
+# Routes
+@api_router.get("/")
 async def root():
     return {"message": "Frage EDU API", "version": "1.0"}
 
@@ -1807,14 +4012,8 @@ async def init_enrollment_flows(current_admin: AdminResponse = Depends(get_curre
 async def get_enrollment_flows(current_admin: AdminResponse = Depends(get_current_admin)):
     """Get all enrollment flows"""
     try:
-        flows = await db.enrollment_flows.find({"is_active": True}).to_list(100)
-        
-        # Clean flows
-        for flow in flows:
-            if '_id' in flow:
-                del flow['_id']
-        
-        return {"flows": [EnrollmentFlowResponse(**flow) for flow in flows]}
+        flows = await flow_registry.list_flows()
+        return {"flows": [EnrollmentFlowResponse(**flow.flow) for flow in flows]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching flows: {str(e)}")
 
@@ -1822,19 +4021,53 @@ async def get_enrollment_flows(current_admin: AdminResponse = Depends(get_curren
 async def get_flow_by_key(flow_key: str):
     """Get specific enrollment flow"""
     try:
-        flow = await db.enrollment_flows.find_one({"flow_key": flow_key, "is_active": True})
+        flow = await flow_registry.get(flow_key, active_only=True)
         if not flow:
             raise HTTPException(status_code=404, detail="Flow not found")
         
-        if '_id' in flow:
-            del flow['_id']
-        
-        return EnrollmentFlowResponse(**flow)
+        return EnrollmentFlowResponse(**flow.flow)
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=f"Error fetching flow: {str(e)}")
 
+@api_router.put("/admin/flows/{flow_key}")
+async def update_enrollment_flow(
+    flow_key: str,
+    flow_data: EnrollmentFlowUpdate,
+    current_admin: AdminResponse = Depends(get_current_admin)
+):
+    """Update an enrollment flow definition (super admin only)"""
+    try:
+        if current_admin.role != "super_admin":
+            raise HTTPException(status_code=403, detail="Only super admin can edit enrollment flows")
+        
+        update_data = {k: v for k, v in flow_data.dict().items() if v is not None}
+        if "steps" in update_data:
+            for step in update_data["steps"]:
+                if "key" not in step or "name" not in step or "order" not in step:
+                    raise HTTPException(status_code=400, detail="Each step requires key, name and order")
+        update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+        
+        result = await db.enrollment_flows.update_one({"flow_key": flow_key}, {"$set": update_data})
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="Flow not found")
+        
+        flow_registry.invalidate()
+        await log_audit(
+            current_admin.id,
+            "UPDATE_FLOW",
+            "EnrollmentFlow",
+            flow_key,
+            {"fields": list(update_data.keys())}
+        )
+        
+        return {"message": "Flow updated successfully"}
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error updating flow: {str(e)}")
+
 @api_router.post("/admin/students/{student_id}/progress/init")
 async def init_student_progress(
     student_id: str, 
@@ -1854,8 +4087,8 @@ async def init_student_progress(
             raise HTTPException(status_code=404, detail="Parent not found")
         
         # Check if flow exists
-        flow = await db.enrollment_flows.find_one({"flow_key": flow_key, "is_active": True})
-        if not flow:
+        flow = await flow_registry.get(flow_key, active_only=True)
+        if not flow or not flow.first_step:
             raise HTTPException(status_code=404, detail="Flow not found")
         
         # Check if progress already exists
@@ -1863,15 +4096,12 @@ async def init_student_progress(
         if existing_progress:
             raise HTTPException(status_code=400, detail="Progress already initialized")
         
-        # Get first step
-        first_step = min(flow["steps"], key=lambda x: x["order"])
-        
         # Create progress record
         progress = StudentEnrollmentProgress(
             student_id=student_id,
             household_token=parent["household_token"],
             flow_key=flow_key,
-            current_step=first_step["key"]
+            current_step=flow.first_step["key"]
         )
         
         progress_dict = progress.dict()
@@ -1879,6 +4109,7 @@ async def init_student_progress(
         progress_dict['updated_at'] = progress_dict['updated_at'].isoformat()
         
         await db.student_enrollment_progress.insert_one(progress_dict)
+        await record_progress_summary_transition(None, progress_dict)
         
         return {"message": "Progress initialized successfully", "progress_id": progress.id}
         
@@ -1890,17 +4121,18 @@ async def init_student_progress(
 @api_router.get("/parent/dashboard/enhanced")
 async def get_enhanced_dashboard(
     studentId: Optional[str] = None,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Get enhanced parent dashboard with flow progress"""
     try:
         # Get parent info
-        parent = await db.parents.find_one({"user_id": current_user.id})
+        parent = await loader.parent_for_user(current_user.id)
         if not parent:
             raise HTTPException(status_code=404, detail="Parent info not found")
         
         # Get students
-        students = await db.students.find({"parent_id": parent["id"]}).to_list(10)
+        students = await loader.students_of_parent(parent["id"])
         
         if not students:
             raise HTTPException(status_code=404, detail="No students found")
@@ -1911,21 +4143,22 @@ async def get_enhanced_dashboard(
             if not students:
                 raise HTTPException(status_code=404, detail="Student not found")
         
-        # Get progress for each student
+        # Get progress for each student (batched through the request loader)
+        progress_responses = await asyncio.gather(
+            *(get_student_progress(student["id"], loader) for student in students)
+        )
+        
         dashboard_data = []
         
-        for student in students:
-            # Get progress
-            progress_response = await get_student_progress(student["id"])
-            
+        for student, progress_response in zip(students, progress_responses):
             # Get current tasks (incomplete steps)
             current_tasks = []
             completed_tasks = []
             
             if progress_response:
-                flow = await db.enrollment_flows.find_one({"flow_key": progress_response.flow_key})
+                flow = await flow_registry.get(progress_response.flow_key)
                 if flow:
-                    for step in flow["steps"]:
+                    for step in flow.steps:
                         task_info = {
                             "key": step["key"],
                             "name": step["name"],
@@ -1942,17 +4175,17 @@ async def get_enhanced_dashboard(
                         else:
                             current_tasks.append(task_info)
             
-            # Get pending payments
-            pending_payments = await db.payment_records.find({
-                "student_id": student["id"],
-                "payment_status": "pending"
-            }).to_list(10)
-            
-            # Get class assignments
-            class_assignments = await db.class_placements.find({
-                "student_id": student["id"],
-                "status": "active"
-            }).to_list(10)
+            # Get pending payments and class assignments
+            pending_payments, class_assignments = await asyncio.gather(
+                db.payment_records.find({
+                    "student_id": student["id"],
+                    "payment_status": "pending"
+                }).to_list(10),
+                db.class_placements.find({
+                    "student_id": student["id"],
+                    "status": "active"
+                }).to_list(10)
+            )
             
             # Clean data
             for payment in pending_payments:
@@ -2013,16 +4246,17 @@ async def get_enhanced_dashboard(
 @api_router.post("/parent/flow-event")
 async def trigger_parent_flow_event(
     event_request: FlowEventRequest,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Trigger a flow event from parent dashboard"""
     try:
         # Get parent and students
-        parent = await db.parents.find_one({"user_id": current_user.id})
+        parent = await loader.parent_for_user(current_user.id)
         if not parent:
             raise HTTPException(status_code=404, detail="Parent info not found")
         
-        students = await db.students.find({"parent_id": parent["id"]}).to_list(10)
+        students = await loader.students_of_parent(parent["id"])
         if not students:
             raise HTTPException(status_code=404, detail="No students found")
         
@@ -2082,24 +4316,88 @@ async def admin_trigger_flow_event(
             raise e
         raise HTTPException(status_code=500, detail=f"Error triggering event: {str(e)}")
 
+@api_router.post("/admin/students/bulk/trigger-events")
+async def admin_bulk_trigger_flow_events(
+    bulk_request: BulkFlowEventRequest,
+    current_admin: AdminResponse = Depends(get_current_admin)
+):
+    """Trigger flow events for many students at once (e.g. class placement for a cohort)"""
+    try:
+        if not await has_permission(current_admin.id, current_admin.role, "can_edit_student"):
+            raise HTTPException(status_code=403, detail="Permission denied: cannot edit students")
+        
+        if not bulk_request.events:
+            raise HTTPException(status_code=400, detail="No events provided")
+        if len(bulk_request.events) > BULK_FLOW_EVENT_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"At most {BULK_FLOW_EVENT_MAX_ITEMS} events per request")
+        
+        items = [event.dict() for event in bulk_request.events]
+        results = await apply_flow_events_bulk(items, f"admin:{current_admin.id}")
+        succeeded = [items[result["index"]] for result in results if result["success"]]
+        
+        # Log admin actions in one insert
+        audit_logs = []
+        for item in succeeded:
+            audit_dict = AuditLog(
+                actor_user_id=current_admin.id,
+                action=f"TRIGGER_EVENT:{item['event_type']}",
+                target_type="Student",
+                target_id=item["student_id"],
+                meta=item["event_data"]
+            ).dict()
+            audit_dict['created_at'] = audit_dict['created_at'].isoformat()
+            audit_logs.append(audit_dict)
+        for chunk in chunked(audit_logs, BULK_WRITE_CHUNK_SIZE):
+            await db.audit_logs.insert_many(chunk, ordered=False)
+        
+        if bulk_request.notify:
+            await send_alimtalk_notifications_bulk([
+                (
+                    item["student_id"],
+                    "status_update",
+                    {
+                        "event_type": item["event_type"],
+                        "step_key": item["step_key"],
+                        "updated_by": current_admin.username
+                    }
+                )
+                for item in succeeded
+            ])
+        
+        return {
+            "message": "Bulk events processed",
+            "total": len(items),
+            "succeeded": len(succeeded),
+            "failed": len(items) - len(succeeded),
+            "results": results
+        }
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error triggering bulk events: {str(e)}")
+
 @api_router.get("/admin/students/{student_id}/progress")
 async def get_student_progress_admin(
     student_id: str,
-    current_admin: AdminResponse = Depends(get_current_admin)
+    current_admin: AdminResponse = Depends(get_current_admin),
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Get student progress (admin view)"""
     try:
-        progress_response = await get_student_progress(student_id)
+        progress_response = await get_student_progress(student_id, loader)
         if not progress_response:
             raise HTTPException(status_code=404, detail="Progress not found")
         
-        # Get flow events history
-        events = await db.flow_events.find({"student_id": student_id}).sort("created_at", -1).limit(50).to_list(50)
-        
-        # Clean events
-        for event in events:
-            if '_id' in event:
-                del event['_id']
+        # Get flow events history, including events not yet relayed from the outbox
+        events, progress = await asyncio.gather(
+            db.flow_events.find({"student_id": student_id}, {"_id": 0}).sort("created_at", -1).limit(50).to_list(50),
+            loader.progress_by_student_id.load(student_id)
+        )
+        relayed_ids = {event["id"] for event in events}
+        pending_events = [event for event in (progress or {}).get("pending_events", []) if event["id"] not in relayed_ids]
+        if pending_events:
+            events = sorted(events + pending_events, key=lambda event: event["created_at"], reverse=True)[:50]
         
         return {
             "progress": progress_response,
@@ -2119,96 +4417,87 @@ async def get_progress_report(
     status: Optional[str] = None,
     enrollment_status: Optional[str] = None,
     page: int = 1,
-    limit: int = 50
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Get progress report with filtering (admin view)"""
     try:
         # Build query
         query = {}
-        if branch or flow_key or status or enrollment_status:
-            if flow_key:
-                query["flow_key"] = flow_key
-            if status:
-                query["status"] = status
-            if enrollment_status:
-                query["enrollment_status"] = enrollment_status
-            
-            # For branch filtering, we need to join with students/parents
-            if branch:
-                # Get students in the branch first
-                parents_in_branch = await db.parents.find({"branch": branch}).to_list(1000)
-                parent_ids = [p["id"] for p in parents_in_branch]
-                students_in_branch = await db.students.find({"parent_id": {"$in": parent_ids}}).to_list(1000)
-                student_ids = [s["id"] for s in students_in_branch]
-                query["student_id"] = {"$in": student_ids}
-        
-        # Get progress records
-        skip = (page - 1) * limit
-        progress_records = await db.student_enrollment_progress.find(query).skip(skip).limit(limit).to_list(limit)
-        total_count = await db.student_enrollment_progress.count_documents(query)
-        
-        # Enrich with student and parent info
+        if flow_key:
+            query["flow_key"] = flow_key
+        if status:
+            query["status"] = status
+        if enrollment_status:
+            query["enrollment_status"] = enrollment_status
+        
+        # For branch filtering, join progress -> students -> parents on the server
+        branch_stages = progress_branch_filter_stages(branch) if branch else []
+        
+        # Seek past the cursor in (created_at, id) order, then join only as far as the page needs
+        page_match = and_filters(query, keyset_filter("created_at", -1, cursor) if cursor else None)
+        pipeline = [{"$match": page_match}, {"$sort": {"created_at": -1, "id": -1}}, *branch_stages]
+        if not cursor:
+            pipeline.append({"$skip": (page - 1) * limit})
+        pipeline.extend([{"$limit": limit + 1}, {"$project": {"_id": 0, "pending_events": 0}}])
+        
+        async def count_records():
+            counted = await db.student_enrollment_progress.aggregate(
+                [{"$match": query}, *branch_stages, {"$count": "count"}]
+            ).to_list(1)
+            return counted[0]["count"] if counted else 0
+        
+        fetch_page = db.student_enrollment_progress.aggregate(pipeline).to_list(limit + 1)
+        if include_total:
+            progress_records, total_count, stats = await asyncio.gather(
+                fetch_page,
+                cached_count("student_enrollment_progress", {"query": query, "branch": branch}, count_records),
+                get_progress_statistics()
+            )
+        else:
+            total_count = None
+            progress_records, stats = await asyncio.gather(fetch_page, get_progress_statistics())
+        has_more = len(progress_records) > limit
+        progress_records = progress_records[:limit]
+        next_cursor = encode_cursor(progress_records[-1].get("created_at"), progress_records[-1]["id"]) if has_more else None
+        
+        # Enrich with student, parent and flow info (one batched query per collection)
+        students = await loader.students_by_id.load_many([r["student_id"] for r in progress_records])
+        parents = await loader.parents_by_id.load_many([s["parent_id"] for s in students if s])
+        parents_by_id = {p["id"]: p for p in parents if p}
+        flows = await flow_registry.get_many([r["flow_key"] for r in progress_records])
+        
         enriched_records = []
-        for record in progress_records:
-            if '_id' in record:
-                del record['_id']
-            
-            # Get student info
-            student = await db.students.find_one({"id": record["student_id"]})
+        for record, student, flow in zip(progress_records, students, flows):
+            # Attach student and parent info
             if student:
-                if '_id' in student:
-                    del student['_id']
                 record["student_info"] = student
                 
-                # Get parent info
-                parent = await db.parents.find_one({"id": student["parent_id"]})
+                parent = parents_by_id.get(student["parent_id"])
                 if parent:
-                    if '_id' in parent:
-                        del parent['_id']
                     record["parent_info"] = parent
             
-            # Get flow info
-            flow = await db.enrollment_flows.find_one({"flow_key": record["flow_key"]})
+            # Attach flow info
             if flow:
-                if '_id' in flow:
-                    del flow['_id']
                 record["flow_info"] = {
-                    "name": flow["name"],
-                    "description": flow["description"],
-                    "total_steps": len(flow["steps"])
+                    "name": flow.name,
+                    "description": flow.description,
+                    "total_steps": flow.total_steps
                 }
             
             enriched_records.append(record)
         
-        # Calculate summary statistics
-        all_records = await db.student_enrollment_progress.find({}).to_list(10000)
-        stats = {
-            "total_students": len(all_records),
-            "by_status": {},
-            "by_enrollment_status": {},
-            "by_flow": {}
-        }
-        
-        for record in all_records:
-            # Count by status
-            status = record.get("status", "unknown")
-            stats["by_status"][status] = stats["by_status"].get(status, 0) + 1
-            
-            # Count by enrollment status
-            enrollment_status = record.get("enrollment_status", "unknown")
-            stats["by_enrollment_status"][enrollment_status] = stats["by_enrollment_status"].get(enrollment_status, 0) + 1
-            
-            # Count by flow
-            flow_key = record.get("flow_key", "unknown")
-            stats["by_flow"][flow_key] = stats["by_flow"].get(flow_key, 0) + 1
-        
         return {
             "records": enriched_records,
             "pagination": {
                 "page": page,
                 "limit": limit,
                 "total": total_count,
-                "total_pages": (total_count + limit - 1) // limit
+                "total_pages": total_pages(total_count, limit),
+                "next_cursor": next_cursor,
+                "has_more": has_more
             },
             "statistics": stats
         }
@@ -2216,20 +4505,36 @@ async def get_progress_report(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching progress report: {str(e)}")
 
+@api_router.post("/admin/progress-report/summary/rebuild")
+async def rebuild_progress_summary(current_admin: AdminResponse = Depends(get_current_admin)):
+    """Rebuild the materialized progress report summary (super admin only)"""
+    try:
+        if current_admin.role != "super_admin":
+            raise HTTPException(status_code=403, detail="Only super admin can rebuild the progress summary")
+        
+        stats = await rebuild_progress_report_summary()
+        return {"message": "Progress summary rebuilt successfully", "statistics": stats}
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error rebuilding progress summary: {str(e)}")
+
 @api_router.get("/parent/dashboard/comprehensive")
 async def get_comprehensive_dashboard(
     studentId: Optional[str] = None,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Get comprehensive card-based parent dashboard"""
     try:
         # Get parent info
-        parent = await db.parents.find_one({"user_id": current_user.id})
+        parent = await loader.parent_for_user(current_user.id)
         if not parent:
             raise HTTPException(status_code=404, detail="Parent info not found")
         
         # Get all students for dropdown
-        students = await db.students.find({"parent_id": parent["id"]}).to_list(10)
+        students = await loader.students_of_parent(parent["id"])
         
         if not students:
             raise HTTPException(status_code=404, detail="No students found")
@@ -2275,27 +4580,12 @@ async def get_comprehensive_dashboard(
         target_student_info = next((s for s in student_info_list if s.id == target_student["id"]), student_info_list[0])
         
         # Build all dashboard cards
-        admission_progress = await build_admission_progress_card(target_student["id"])
-        exam_card = await build_exam_card(target_student["id"], target_student)
-        timetable_card = await build_timetable_card(target_student["id"])
-        homework_card = await build_homework_card(target_student["id"])
-        attendance_card = await build_attendance_card(target_student["id"])
-        billing_card = await build_billing_card(target_student["id"], parent["household_token"])
-        notices_card = await build_notices_card(target_student["id"], target_student)
-        resources_card = await build_resources_card(target_student["id"], parent["household_token"], target_student)
-        
-        # Build dashboard cards response
-        dashboard_cards = DashboardCardsResponse(
-            student_info=target_student_info,
-            admission_progress=admission_progress,
-            exam=exam_card,
-            timetable=timetable_card,
-            homework=homework_card,
-            attendance=attendance_card,
-            billing=billing_card,
-            notices=notices_card,
-            resources=resources_card
-        )
+        card_context = DashboardCardContext(target_student, parent["household_token"], loader)
+        dashboard_cards = await assemble_dashboard_cards(target_student_info, card_context)
+        notices_card = dashboard_cards.notices
+        billing_card = dashboard_cards.billing
+        homework_card = dashboard_cards.homework
+        resources_card = dashboard_cards.resources
         
         # Get global notifications (urgent notices, overdue items)
         global_notifications = []
@@ -2399,8 +4689,8 @@ async def reserve_exam(
         
         await db.exam_reservations.insert_one(reservation_dict)
         
-        # Trigger flow event
-        await trigger_flow_event(
+        # Trigger flow event; the reservation stands even if the event can't be recorded
+        event_result = await trigger_flow_event(
             reservation_request.student_id,
             "exam.scheduled",
             "consultation",
@@ -2411,6 +4701,8 @@ async def reserve_exam(
             },
             f"parent:{current_user.id}"
         )
+        if "error" in event_result:
+            logger.warning(f"Exam reservation {reservation.id}: flow event not recorded: {event_result['error']}")
         
         return {"message": "Exam reservation successful", "reservation_id": reservation.id}
         
@@ -2425,16 +4717,19 @@ async def get_homework_list(
     student_id: Optional[str] = None,
     status: Optional[str] = None,  # pending, submitted, graded, overdue
     page: int = 1,
-    limit: int = 20
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Get homework list for student"""
     try:
         # Get parent and students
-        parent = await db.parents.find_one({"user_id": current_user.id})
+        parent = await loader.parent_for_user(current_user.id)
         if not parent:
             raise HTTPException(status_code=404, detail="Parent info not found")
         
-        students = await db.students.find({"parent_id": parent["id"]}).to_list(10)
+        students = await loader.students_of_parent(parent["id"])
         if not students:
             raise HTTPException(status_code=404, detail="No students found")
         
@@ -2447,28 +4742,27 @@ async def get_homework_list(
             target_student = students[0]
         
         # Get class assignment
-        assignment = await db.class_placements.find_one({
-            "student_id": target_student["id"], 
-            "status": "active"
-        })
+        assignment = await loader.active_placements.load(target_student["id"])
         
         if not assignment:
             return {
                 "homework_list": [],
-                "pagination": {"page": page, "limit": limit, "total": 0, "total_pages": 0}
+                "pagination": {"page": page, "limit": limit, "total": 0, "total_pages": 0, "next_cursor": None, "has_more": False}
             }
         
         # Build query
         query = {"class_assignment_id": assignment["id"]}
         
         # Get homework
-        skip = (page - 1) * limit
-        homework_list = await db.homeworks.find(query).sort("due_date", -1).skip(skip).limit(limit).to_list(limit)
-        total_count = await db.homeworks.count_documents(query)
+        result = await keyset_paginate(db.homeworks, query, "due_date", -1, limit, page, cursor, include_total)
+        homework_list = result["items"]
         
-        # Get submissions
-        submission_query = {"student_id": target_student["id"]}
-        submissions = await db.homework_submissions.find(submission_query).to_list(1000)
+        # Get submissions for the homework on this page only
+        submission_query = {
+            "student_id": target_student["id"],
+            "homework_id": {"$in": [hw["id"] for hw in homework_list]}
+        }
+        submissions = await db.homework_submissions.find(submission_query, {"_id": 0}).to_list(None)
         submission_map = {sub["homework_id"]: sub for sub in submissions}
         
         # Build response
@@ -2476,9 +4770,6 @@ async def get_homework_list(
         now = datetime.now(timezone.utc)
         
         for hw in homework_list:
-            if '_id' in hw:
-                del hw['_id']
-            
             submission = submission_map.get(hw["id"])
             hw_status = "not_started"
             is_overdue = False
@@ -2508,8 +4799,10 @@ async def get_homework_list(
             "pagination": {
                 "page": page,
                 "limit": limit,
-                "total": total_count,
-                "total_pages": (total_count + limit - 1) // limit
+                "total": result["total"],
+                "total_pages": total_pages(result["total"], limit),
+                "next_cursor": result["next_cursor"],
+                "has_more": result["has_more"]
             }
         }
         
@@ -2605,15 +4898,16 @@ async def submit_homework(
 @api_router.post("/parent/notices/acknowledge")
 async def acknowledge_notices(
     ack_request: NoticeAcknowledgmentRequest,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Mark notices as read/acknowledged"""
     try:
-        parent = await db.parents.find_one({"user_id": current_user.id})
+        parent = await loader.parent_for_user(current_user.id)
         if not parent:
             raise HTTPException(status_code=404, detail="Parent info not found")
         
-        students = await db.students.find({"parent_id": parent["id"]}).to_list(10)
+        students = await loader.students_of_parent(parent["id"])
         if not students:
             raise HTTPException(status_code=404, detail="No students found")
         
@@ -2728,6 +5022,7 @@ async def create_sample_student_data(current_admin: AdminResponse = Depends(get_
         
         created_students = 0
         created_parents = 0
+        created_user_ids = []
         
         for family in sample_families:
             # Create user
@@ -2735,12 +5030,13 @@ async def create_sample_student_data(current_admin: AdminResponse = Depends(get_
                 email=family["parent"]["email"],
                 phone=family["parent"]["phone"],
                 name=family["parent"]["name"],
-                password_hash=hash_password("Test123!")  # Default password for test data
+                password_hash=await hash_password("Test123!")  # Default password for test data
             )
             user_dict = user.dict()
             user_dict['created_at'] = user_dict['created_at'].isoformat()
             user_dict['last_login_at'] = None
             await db.users.insert_one(user_dict)
+            created_user_ids.append(user.id)
             
             # Create parent
             parent = Parent(
@@ -2770,8 +5066,11 @@ async def create_sample_student_data(current_admin: AdminResponse = Depends(get_
                 )
                 student_dict = student.dict()
                 await db.students.insert_one(student_dict)
+                student_autocomplete.upsert(student_dict)
                 created_students += 1
         
+        await refresh_member_search(created_user_ids)
+        
         return {
             "message": f"Sample data created successfully", 
             "created_parents": created_parents,
@@ -2798,6 +5097,57 @@ async def init_rbac_system(current_admin: AdminResponse = Depends(get_current_ad
             raise e
         raise HTTPException(status_code=500, detail=f"Error initializing RBAC: {str(e)}")
 
+async def enrich_students_for_admin(students: List[Dict[str, Any]], loader: RequestLoader) -> List[StudentManagement]:
+    """Attach parent, class and enrollment progress info to a page of students"""
+    # One $in query per collection for the whole page
+    student_ids = [student["id"] for student in students]
+    parents, class_assignments, progress_records = await asyncio.gather(
+        loader.parents_by_id.load_many([student.get("parent_id") for student in students]),
+        loader.active_placements.load_many(student_ids),
+        loader.progress_by_student_id.load_many(student_ids)
+    )
+    
+    # Step counts come from each student's actual enrollment flow
+    flow_keys = list({progress["flow_key"] for progress in progress_records if progress and progress.get("flow_key")})
+    flows = await flow_registry.get_many(flow_keys)
+    total_steps_by_flow = {flow.flow_key: flow.total_steps for flow in flows if flow}
+    
+    formatted_students = []
+    for student, parent, class_assignment, progress in zip(students, parents, class_assignments, progress_records):
+        # Calculate enrollment progress
+        progress_percentage = 0.0
+        if progress:
+            total_steps = total_steps_by_flow.get(progress.get("flow_key"), 0)
+            completed_steps = len(progress.get("completed_steps", []))
+            if total_steps > 0:
+                progress_percentage = min(completed_steps / total_steps, 1.0) * 100
+        
+        created_at = student.get("created_at") or datetime.now(timezone.utc)
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        
+        formatted_students.append(StudentManagement(
+            id=student["id"],
+            name=student["name"],
+            grade=student.get("grade", ""),
+            birthdate=student.get("birthdate"),
+            branch=student.get("branch", ""),
+            program_subtype=student.get("program_subtype", "regular"),
+            status=student.get("status", "active"),
+            parent_name=parent["name"] if parent else "",
+            parent_phone=parent["phone"] if parent else "",
+            parent_email=parent["email"] if parent else "",
+            class_name=class_assignment["class_name"] if class_assignment else None,
+            teacher_name=class_assignment["teacher_name"] if class_assignment else None,
+            attendance_rate=95.0,  # Placeholder
+            payment_status="paid",  # Placeholder
+            last_attendance=None,  # Placeholder
+            enrollment_progress=progress_percentage,
+            created_at=created_at
+        ))
+    
+    return formatted_students
+
 @api_router.get("/admin/students")
 async def get_students_for_admin(
     current_admin: AdminResponse = Depends(get_current_admin),
@@ -2806,7 +5156,10 @@ async def get_students_for_admin(
     search: Optional[str] = None,
     branch_filter: Optional[str] = None,
     status_filter: Optional[str] = None,
-    grade_filter: Optional[str] = None
+    grade_filter: Optional[str] = None,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Get students list with admin role-based filtering (alias for student-management)"""
     # This is essentially the same as the student-management endpoint
@@ -2847,53 +5200,11 @@ async def get_students_for_admin(
             ]
         
         # Get students with pagination
-        skip = (page - 1) * limit
-        students = await db.students.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-        total_count = await db.students.count_documents(query)
+        result = await keyset_paginate(db.students, query, "created_at", -1, limit, page, cursor, include_total)
+        students = result["items"]
         
-        # Enrich student data
-        formatted_students = []
-        for student in students:
-            if '_id' in student:
-                del student['_id']
-            
-            # Get parent info
-            parent = await db.parents.find_one({"id": student["parent_id"]})
-            
-            # Get class info
-            class_assignment = await db.class_placements.find_one({"student_id": student["id"], "status": "active"})
-            
-            # Get progress info
-            progress = await db.student_enrollment_progress.find_one({"student_id": student["id"]})
-            
-            # Calculate enrollment progress
-            if progress:
-                completed_steps = len(progress.get("completed_steps", []))
-                total_steps = 5  # Default flow steps
-                progress_percentage = (completed_steps / total_steps) * 100 if total_steps > 0 else 0
-            else:
-                progress_percentage = 0.0
-            
-            formatted_student = StudentManagement(
-                id=student["id"],
-                name=student["name"],
-                grade=student.get("grade", ""),
-                birthdate=student.get("birthdate"),
-                branch=student.get("branch", ""),
-                program_subtype=student.get("program_subtype", "regular"),
-                status=student.get("status", "active"),
-                parent_name=parent["name"] if parent else "",
-                parent_phone=parent["phone"] if parent else "",
-                parent_email=parent["email"] if parent else "",
-                class_name=class_assignment["class_name"] if class_assignment else None,
-                teacher_name=class_assignment["teacher_name"] if class_assignment else None,
-                attendance_rate=95.0,  # Placeholder
-                payment_status="paid",  # Placeholder
-                last_attendance=None,  # Placeholder
-                enrollment_progress=progress_percentage,
-                created_at=datetime.fromisoformat(student.get("created_at", datetime.now(timezone.utc).isoformat())) if isinstance(student.get("created_at"), str) else student.get("created_at", datetime.now(timezone.utc))
-            )
-            formatted_students.append(formatted_student)
+        # Enrich student data with parent, class and progress info
+        formatted_students = await enrich_students_for_admin(students, loader)
         
         # Get user permissions for UI
         permission_codes = []
@@ -2907,8 +5218,10 @@ async def get_students_for_admin(
             pagination={
                 "page": page,
                 "limit": limit,
-                "total": total_count,
-                "total_pages": (total_count + limit - 1) // limit
+                "total": result["total"],
+                "total_pages": total_pages(result["total"], limit),
+                "next_cursor": result["next_cursor"],
+                "has_more": result["has_more"]
             },
             allowed_branches=allowed_branches,
             user_permissions=permission_codes
@@ -2919,6 +5232,117 @@ async def get_students_for_admin(
             raise e
         raise HTTPException(status_code=500, detail=f"Error fetching students list: {str(e)}")
 
+@api_router.get("/admin/students/autocomplete")
+async def autocomplete_students(
+    q: str,
+    branch: Optional[str] = None,
+    limit: int = 10,
+    current_admin: AdminResponse = Depends(get_current_admin)
+):
+    """Type-ahead student lookup by name (jamo or chosung) or id prefix within the admin's branches"""
+    try:
+        if not await has_permission(current_admin.id, current_admin.role, "can_view_student"):
+            raise HTTPException(status_code=403, detail="Permission denied: cannot view students")
+        
+        access_info = await filter_students_by_admin_access(current_admin.id, current_admin.role)
+        branches = access_info["allowed_branches"]
+        if branch:
+            branches = [branch] if branch in branches else []
+        
+        limit = max(1, min(limit, STUDENT_AUTOCOMPLETE_MAX_LIMIT))
+        students = await student_autocomplete.search(q, branches, limit)
+        return {"query": q, "students": students}
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error searching students: {str(e)}")
+
+@api_router.get("/admin/students/export")
+async def export_students(
+    current_admin: AdminResponse = Depends(get_current_admin),
+    format: str = "csv",
+    branch_filter: Optional[str] = None,
+    status_filter: Optional[str] = None,
+    grade_filter: Optional[str] = None
+):
+    """Stream the students visible to the admin as CSV or XLSX"""
+    try:
+        if not await has_permission(current_admin.id, current_admin.role, "can_view_student"):
+            raise HTTPException(status_code=403, detail="Permission denied: cannot view students")
+        
+        access_info = await filter_students_by_admin_access(current_admin.id, current_admin.role)
+        allowed_branches = access_info["allowed_branches"]
+        
+        # A branch the admin cannot access yields an empty export
+        query = {}
+        if branch_filter:
+            query["branch"] = branch_filter if branch_filter in allowed_branches else {"$in": []}
+        else:
+            query["branch"] = {"$in": allowed_branches}
+        if status_filter:
+            query["status"] = status_filter
+        if grade_filter:
+            query["grade"] = grade_filter
+        
+        response = export_response(format, "students_export", STUDENT_EXPORT_COLUMNS, student_export_batches(query))
+        
+        await log_audit(
+            current_admin.id,
+            "EXPORT",
+            "Student",
+            "filter",
+            {"format": format, "filters": {"branch": branch_filter, "status": status_filter, "grade": grade_filter}}
+        )
+        return response
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error exporting students: {str(e)}")
+
+@api_router.get("/admin/progress-report/export")
+async def export_progress_records(
+    current_admin: AdminResponse = Depends(get_current_admin),
+    format: str = "csv",
+    branch: Optional[str] = None,
+    flow_key: Optional[str] = None,
+    status: Optional[str] = None
+):
+    """Stream enrollment progress records of the admin's students as CSV or XLSX"""
+    try:
+        if not await has_permission(current_admin.id, current_admin.role, "can_view_student"):
+            raise HTTPException(status_code=403, detail="Permission denied: cannot view students")
+        
+        access_info = await filter_students_by_admin_access(current_admin.id, current_admin.role)
+        branches = access_info["allowed_branches"]
+        if branch:
+            branches = [branch] if branch in branches else []
+        
+        query = {}
+        if flow_key:
+            query["flow_key"] = flow_key
+        if status:
+            query["status"] = status
+        
+        response = export_response(
+            format, "progress_export", PROGRESS_EXPORT_COLUMNS, progress_export_batches(query, branches)
+        )
+        
+        await log_audit(
+            current_admin.id,
+            "EXPORT",
+            "StudentEnrollmentProgress",
+            "filter",
+            {"format": format, "filters": {"branch": branch, "flow_key": flow_key, "status": status}}
+        )
+        return response
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error exporting progress records: {str(e)}")
+
 @api_router.get("/admin/student-management")
 async def get_student_management_list(
     current_admin: AdminResponse = Depends(get_current_admin),
@@ -2927,7 +5351,10 @@ async def get_student_management_list(
     search: Optional[str] = None,
     branch_filter: Optional[str] = None,
     status_filter: Optional[str] = None,
-    grade_filter: Optional[str] = None
+    grade_filter: Optional[str] = None,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Get students list with admin role-based filtering"""
     try:
@@ -2966,53 +5393,11 @@ async def get_student_management_list(
             ]
         
         # Get students with pagination
-        skip = (page - 1) * limit
-        students = await db.students.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-        total_count = await db.students.count_documents(query)
+        result = await keyset_paginate(db.students, query, "created_at", -1, limit, page, cursor, include_total)
+        students = result["items"]
         
-        # Enrich student data
-        formatted_students = []
-        for student in students:
-            if '_id' in student:
-                del student['_id']
-            
-            # Get parent info
-            parent = await db.parents.find_one({"id": student["parent_id"]})
-            
-            # Get class info
-            class_assignment = await db.class_placements.find_one({"student_id": student["id"], "status": "active"})
-            
-            # Get progress info
-            progress = await db.student_enrollment_progress.find_one({"student_id": student["id"]})
-            
-            # Calculate enrollment progress
-            if progress:
-                completed_steps = len(progress.get("completed_steps", []))
-                total_steps = 5  # Default flow steps
-                progress_percentage = (completed_steps / total_steps) * 100 if total_steps > 0 else 0
-            else:
-                progress_percentage = 0.0
-            
-            formatted_student = StudentManagement(
-                id=student["id"],
-                name=student["name"],
-                grade=student.get("grade", ""),
-                birthdate=student.get("birthdate"),
-                branch=student.get("branch", ""),
-                program_subtype=student.get("program_subtype", "regular"),
-                status=student.get("status", "active"),
-                parent_name=parent["name"] if parent else "",
-                parent_phone=parent["phone"] if parent else "",
-                parent_email=parent["email"] if parent else "",
-                class_name=class_assignment["class_name"] if class_assignment else None,
-                teacher_name=class_assignment["teacher_name"] if class_assignment else None,
-                attendance_rate=95.0,  # Placeholder
-                payment_status="paid",  # Placeholder
-                last_attendance="2025-08-30",  # Placeholder
-                enrollment_progress=progress_percentage,
-                created_at=datetime.now(timezone.utc)
-            )
-            formatted_students.append(formatted_student)
+        # Enrich student data with parent, class and progress info
+        formatted_students = await enrich_students_for_admin(students, loader)
         
         # Get user permissions
         user_permissions = await get_user_permissions(current_admin.id, current_admin.role)
@@ -3023,8 +5408,10 @@ async def get_student_management_list(
             pagination={
                 "page": page,
                 "limit": limit,
-                "total": total_count,
-                "total_pages": (total_count + limit - 1) // limit
+                "total": result["total"],
+                "total_pages": total_pages(result["total"], limit),
+                "next_cursor": result["next_cursor"],
+                "has_more": result["has_more"]
             },
             allowed_branches=allowed_branches,
             user_permissions=permission_codes
@@ -3052,7 +5439,7 @@ async def get_admin_user_permissions(
         
         # Get permissions and branches
         permissions = await get_user_permissions(admin_user_id, target_admin["role"])
-        allowed_branches = await get_allowed_branches(admin_user_id)
+        allowed_branches = await get_allowed_branches(admin_user_id, target_admin["role"])
         
         return AdminUserResponse(
             id=target_admin["id"],
@@ -3152,17 +5539,20 @@ async def update_student_enrollment_status(
         
         # Update progress if enrollment status provided
         if new_enrollment_status:
-            progress = await db.student_enrollment_progress.find_one({"student_id": student_id})
-            if progress:
-                await db.student_enrollment_progress.update_one(
-                    {"student_id": student_id},
-                    {
-                        "$set": {
-                            "enrollment_status": new_enrollment_status,
-                            "updated_at": datetime.now(timezone.utc).isoformat()
-                        }
-                    }
-                )
+            previous = await db.student_enrollment_progress.find_one_and_update(
+                {"student_id": student_id},
+                {
+                    "$set": {
+                        "enrollment_status": new_enrollment_status,
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    },
+                    "$inc": {"version": 1}
+                },
+                projection=PROGRESS_SUMMARY_PROJECTION,
+                return_document=ReturnDocument.BEFORE
+            )
+            if previous:
+                await record_progress_summary_transition(previous, {**previous, "enrollment_status": new_enrollment_status})
         
         # Trigger flow event if step provided  
         if new_flow_step:
@@ -3215,7 +5605,7 @@ async def update_student_enrollment_status(
                 await db.class_placements.insert_one(assignment_dict)
                 
                 # Trigger placement event
-                await trigger_flow_event(
+                event_result = await trigger_flow_event(
                     student_id,
                     "class.assigned",
                     "placement",
@@ -3226,6 +5616,8 @@ async def update_student_enrollment_status(
                     },
                     f"admin:{current_admin.id}"
                 )
+                if "error" in event_result:
+                    logger.warning(f"Placement of student {student_id}: flow event not recorded: {event_result['error']}")
         
         # Log admin action
         await log_audit(
@@ -3332,6 +5724,7 @@ async def assign_student_to_class(
                 }
             }
         )
+        student_autocomplete.update_fields(student_id, status="enrolled")
         
         # Log audit trail
         await log_audit(
@@ -3404,6 +5797,7 @@ async def approve_student_admission(
                 }
             }
         )
+        student_autocomplete.update_fields(student_id, status="admitted_pending")
         
         # Log audit trail
         await log_audit(
@@ -3486,6 +5880,7 @@ async def update_student_status(
                 }
             }
         )
+        student_autocomplete.update_fields(student_id, status=status_update.status)
         
         # Log audit trail
         await log_audit(
@@ -3550,6 +5945,7 @@ async def reserve_student_test(
                 }
             }
         )
+        student_autocomplete.update_fields(student_id, status="reserved_test")
         
         # Log audit trail
         await log_audit(
@@ -3578,17 +5974,18 @@ async def reserve_student_test(
 @api_router.get("/admin/students/{student_id}/dashboard-preview")
 async def get_student_dashboard_preview(
     student_id: str,
-    current_admin: AdminResponse = Depends(get_current_admin)
+    current_admin: AdminResponse = Depends(get_current_admin),
+    loader: RequestLoader = Depends(get_request_loader)
 ):
     """Admin endpoint to preview how student dashboard looks"""
     try:
         # Get student info
-        student = await db.students.find_one({"id": student_id})
+        student = await loader.students_by_id.load(student_id)
         if not student:
             raise HTTPException(status_code=404, detail="Student not found")
         
         # Get parent info
-        parent = await db.parents.find_one({"id": student["parent_id"]})
+        parent = await loader.parents_by_id.load(student["parent_id"])
         if not parent:
             raise HTTPException(status_code=404, detail="Parent not found")
         
@@ -3614,27 +6011,9 @@ async def get_student_dashboard_preview(
         )
         
         # Build all dashboard cards (same as parent view)
-        admission_progress = await build_admission_progress_card(student["id"])
-        exam_card = await build_exam_card(student["id"], student)
-        timetable_card = await build_timetable_card(student["id"])
-        homework_card = await build_homework_card(student["id"])
-        attendance_card = await build_attendance_card(student["id"]) 
-        billing_card = await build_billing_card(student["id"], parent["household_token"])
-        notices_card = await build_notices_card(student["id"], student)
-        resources_card = await build_resources_card(student["id"], parent["household_token"], student)
-        
-        # Build dashboard preview
-        dashboard_preview = DashboardCardsResponse(
-            student_info=student_info,
-            admission_progress=admission_progress,
-            exam=exam_card,
-            timetable=timetable_card,
-            homework=homework_card,
-            attendance=attendance_card,
-            billing=billing_card,
-            notices=notices_card,
-            resources=resources_card
-        )
+        card_context = DashboardCardContext(student, parent["household_token"], loader)
+        dashboard_preview = await assemble_dashboard_cards(student_info, card_context)
+        timetable_card = dashboard_preview.timetable
         
         return {
             "student_info": student_info,
@@ -3799,7 +6178,7 @@ async def confirm_password_reset(request: PasswordResetConfirm):
             raise HTTPException(status_code=404, detail="사용자를 찾을 수 없습니다.")
         
         # Update password
-        new_password_hash = hash_password(request.new_password)
+        new_password_hash = await hash_password(request.new_password)
         await db.users.update_one(
             {"id": user["id"]},
             {
@@ -3809,6 +6188,7 @@ async def confirm_password_reset(request: PasswordResetConfirm):
                 }
             }
         )
+        principal_cache.invalidate("user", user["id"])
         
         # Mark reset token as used
         await db.password_reset_tokens.update_one(
@@ -3907,50 +6287,102 @@ async def initialize_rbac_system():
                 role_perm_dict['created_at'] = role_perm_dict['created_at'].isoformat()
                 await db.role_permissions.insert_one(role_perm_dict)
     
+    permission_matrix_cache.invalidate()
     return "RBAC system initialized successfully"
 
-async def get_allowed_branches(admin_user_id: str) -> List[str]:
+# RBAC Permission Matrix Cache
+RBAC_CACHE_TTL = float(os.environ.get('RBAC_CACHE_TTL', '60'))
+
+ALL_BRANCHES = ["kinder", "junior", "middle", "kinder_single"]
+
+# Branches used when an admin has no explicit branch assignments
+ROLE_DEFAULT_BRANCHES = {
+    "kinder_admin": ["kinder"],
+    "junior_admin": ["junior", "kinder_single", "middle"],  # As requested
+    "middle_admin": ["middle"]
+}
+
+class PermissionMatrix:
+    """Effective permissions and branch access of one admin user under one role"""
+
+    def __init__(self, admin_role: Optional[str], catalog: List[Dict[str, Any]], role_defaults: List[Dict[str, Any]],
+                 overrides: List[Dict[str, Any]], branches: List[Dict[str, Any]]):
+        self.catalog = catalog
+        
+        # User-specific overrides win over role defaults
+        self.grants = {perm["permission_code"]: perm["default_value"] for perm in role_defaults}
+        self.grants.update({perm["permission_code"]: perm["value"] for perm in overrides})
+        
+        self.allowed_branches = [branch["branch"] for branch in branches]
+        if admin_role == "super_admin":
+            self.accessible_branches = list(ALL_BRANCHES)
+        else:
+            self.accessible_branches = self.allowed_branches or list(ROLE_DEFAULT_BRANCHES.get(admin_role, []))
+
+    def has(self, permission_code: str) -> bool:
+        return self.grants.get(permission_code, False)
+
+class PermissionMatrixCache:
+    """TTL cache of compiled permission matrices keyed by (admin_user_id, role)"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[tuple, tuple] = {}
+        self._generation = 0
+
+    async def get(self, admin_user_id: str, admin_role: Optional[str]) -> PermissionMatrix:
+        key = (admin_user_id, admin_role)
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        
+        generation = self._generation
+        catalog, role_defaults, overrides, branches = await asyncio.gather(
+            db.permissions.find({}, {"_id": 0}).to_list(100),
+            db.role_permissions.find({"role": admin_role}, {"_id": 0}).to_list(None),
+            db.admin_user_permissions.find({"admin_user_id": admin_user_id}, {"_id": 0}).to_list(None),
+            db.admin_user_allowed_branches.find({"admin_user_id": admin_user_id}, {"_id": 0}).to_list(10)
+        )
+        matrix = PermissionMatrix(admin_role, catalog, role_defaults, overrides, branches)
+        
+        # Don't cache a matrix built from data an invalidation may have changed
+        if generation == self._generation:
+            self._entries[key] = (time.monotonic() + self.ttl, matrix)
+        return matrix
+
+    def invalidate(self, admin_user_id: Optional[str] = None):
+        """Drop cached matrices for one admin user, or all of them"""
+        self._generation += 1
+        if admin_user_id is None:
+            self._entries.clear()
+        else:
+            for key in [key for key in self._entries if key[0] == admin_user_id]:
+                del self._entries[key]
+
+permission_matrix_cache = PermissionMatrixCache(RBAC_CACHE_TTL)
+
+async def get_allowed_branches(admin_user_id: str, admin_role: Optional[str] = None) -> List[str]:
     """Get branches that an admin user is allowed to access"""
-    branches = await db.admin_user_allowed_branches.find({"admin_user_id": admin_user_id}).to_list(10)
-    return [branch["branch"] for branch in branches]
+    matrix = await permission_matrix_cache.get(admin_user_id, admin_role)
+    return list(matrix.allowed_branches)
 
 async def has_permission(admin_user_id: str, admin_role: str, permission_code: str) -> bool:
     """Check if admin user has specific permission"""
-    
-    # Check user-specific permission override first
-    user_override = await db.admin_user_permissions.find_one({
-        "admin_user_id": admin_user_id,
-        "permission_code": permission_code
-    })
-    
-    if user_override:
-        return user_override["value"]
-    
-    # Check role default permission
-    role_permission = await db.role_permissions.find_one({
-        "role": admin_role,
-        "permission_code": permission_code
-    })
-    
-    return role_permission["default_value"] if role_permission else False
+    matrix = await permission_matrix_cache.get(admin_user_id, admin_role)
+    return matrix.has(permission_code)
 
 async def get_user_permissions(admin_user_id: str, admin_role: str) -> List[PermissionResponse]:
     """Get all permissions for an admin user"""
-    
-    # Get all permissions
-    all_permissions = await db.permissions.find({}).to_list(100)
-    
-    result = []
-    for perm in all_permissions:
-        has_perm = await has_permission(admin_user_id, admin_role, perm["code"])
-        result.append(PermissionResponse(
+    matrix = await permission_matrix_cache.get(admin_user_id, admin_role)
+    return [
+        PermissionResponse(
             code=perm["code"],
             description=perm["description"],
             category=perm["category"],
-            has_permission=has_perm
-        ))
-    
-    return result
+            has_permission=matrix.has(perm["code"])
+        )
+        for perm in matrix.catalog
+    ]
 
 async def set_admin_branches(admin_user_id: str, branches: List[str], granted_by: str):
     """Set allowed branches for an admin user"""
@@ -3959,6 +6391,7 @@ async def set_admin_branches(admin_user_id: str, branches: List[str], granted_by
     await db.admin_user_allowed_branches.delete_many({"admin_user_id": admin_user_id})
     
     # Add new branches
+    branch_records = []
     for branch in branches:
         branch_record = AdminUserAllowedBranch(
             admin_user_id=admin_user_id,
@@ -3966,7 +6399,11 @@ async def set_admin_branches(admin_user_id: str, branches: List[str], granted_by
         )
         branch_dict = branch_record.dict()
         branch_dict['created_at'] = branch_dict['created_at'].isoformat()
-        await db.admin_user_allowed_branches.insert_one(branch_dict)
+        branch_records.append(branch_dict)
+    if branch_records:
+        await db.admin_user_allowed_branches.insert_many(branch_records)
+    
+    permission_matrix_cache.invalidate(admin_user_id)
     
     # Log the change
     await log_audit(
@@ -3997,6 +6434,8 @@ async def set_admin_permission(admin_user_id: str, permission_code: str, value:
     perm_dict['created_at'] = perm_dict['created_at'].isoformat()
     await db.admin_user_permissions.insert_one(perm_dict)
     
+    permission_matrix_cache.invalidate(admin_user_id)
+    
     # Log the change
     await log_audit(
         granted_by,
@@ -4009,51 +6448,296 @@ async def set_admin_permission(admin_user_id: str, permission_code: str, value:
 async def filter_students_by_admin_access(admin_user_id: str, admin_role: str) -> Dict[str, Any]:
     """Get students filtered by admin's allowed branches"""
     
-    # Super admin sees all
-    if admin_role == "super_admin":
-        allowed_branches = ["kinder", "junior", "middle", "kinder_single"]
-    else:
-        allowed_branches = await get_allowed_branches(admin_user_id)
-        
-        # If no branches set, use role defaults
-        if not allowed_branches:
-            if admin_role == "kinder_admin":
-                allowed_branches = ["kinder"]
-            elif admin_role == "junior_admin":
-                allowed_branches = ["junior", "kinder_single", "middle"]  # As requested
-            elif admin_role == "middle_admin":
-                allowed_branches = ["middle"]
+    # Super admin sees all; admins without branch assignments fall back to role defaults
+    matrix = await permission_matrix_cache.get(admin_user_id, admin_role)
+    allowed_branches = list(matrix.accessible_branches)
     
     return {
         "allowed_branches": allowed_branches,
         "branch_filter": {"$in": allowed_branches} if allowed_branches else {}
     }
 
-async def send_alimtalk_notification(student_id: str, template_type: str, data: Dict = None):
-    """Send AlimTalk notification (placeholder for integration)"""
-    # TODO: Integrate with Solapi AlimTalk API
-    # For now, just log the notification
-    
-    student = await db.students.find_one({"id": student_id})
-    if not student:
-        return
-    
-    parent = await db.parents.find_one({"id": student["parent_id"]})
-    if not parent:
-        return
-    
-    notification_log = {
+# Notification Outbox Utility Functions
+NOTIFICATION_PROVIDER = os.environ.get('NOTIFICATION_PROVIDER', 'fake')
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', '100'))
+NOTIFICATION_DISPATCH_INTERVAL = float(os.environ.get('NOTIFICATION_DISPATCH_INTERVAL', '5'))
+NOTIFICATION_RATE_PER_SECOND = float(os.environ.get('NOTIFICATION_RATE_PER_SECOND', '20'))
+NOTIFICATION_SEND_CONCURRENCY = int(os.environ.get('NOTIFICATION_SEND_CONCURRENCY', '4'))
+NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', '5'))
+NOTIFICATION_BACKOFF_BASE = float(os.environ.get('NOTIFICATION_BACKOFF_BASE', '30'))
+NOTIFICATION_BACKOFF_MAX = float(os.environ.get('NOTIFICATION_BACKOFF_MAX', '3600'))
+NOTIFICATION_CLAIM_LEASE = float(os.environ.get('NOTIFICATION_CLAIM_LEASE', '300'))
+NOTIFICATION_COALESCE = os.environ.get('NOTIFICATION_COALESCE', 'true').lower() == 'true'
+
+NOTIFICATION_TEMPLATES = {
+    "admission_approved": "입학 승인되었습니다. 반 배정 안내를 기다려 주세요.",
+    "class_assigned": "반 배정이 완료되었습니다. 담임교사: {teacher}",
+    "status_leave": "휴학 처리가 완료되었습니다.",
+    "status_withdrawn": "퇴원 처리가 완료되었습니다.",
+    "status_update": "입학 진행 상태가 변경되었습니다."
+}
+
+class NotificationSendError(Exception):
+    """Raised by a notification sender; permanent errors are not retried"""
+
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+class FakeNotificationSender:
+    """Local provider that only logs, keeping the most recent messages for inspection"""
+
+    name = "fake"
+
+    def __init__(self, keep: int = 100):
+        self.sent: List[Dict[str, Any]] = []
+        self.keep = keep
+
+    async def send(self, recipient: str, message: str, template_type: str, data: Dict[str, Any]) -> str:
+        message_id = f"fake-{uuid.uuid4()}"
+        self.sent = (self.sent + [{"id": message_id, "recipient": recipient, "message": message}])[-self.keep:]
+        logger.info(f"[fake notification] {template_type} to {recipient}: {message}")
+        return message_id
+
+# Providers selectable with NOTIFICATION_PROVIDER; register real integrations (e.g. Solapi AlimTalk) here
+NOTIFICATION_SENDERS = {"fake": FakeNotificationSender}
+
+def render_notification_message(template_type: str, data: Optional[Dict[str, Any]]) -> str:
+    template = NOTIFICATION_TEMPLATES.get(template_type, "상태가 변경되었습니다.")
+    try:
+        return template.format(**{"teacher": "N/A", **(data or {})})
+    except (KeyError, IndexError, ValueError):
+        return template
+
+def build_notification(template_type: str, data: Optional[Dict[str, Any]] = None, student_id: Optional[str] = None,
+                       user_id: Optional[str] = None, message: Optional[str] = None) -> Dict[str, Any]:
+    """Outbox record for one notification; the recipient is resolved when it is dispatched"""
+    return {
+        "id": str(uuid.uuid4()),
+        "channel": "alimtalk",
         "student_id": student_id,
-        "parent_phone": parent.get("phone", ""),
+        "user_id": user_id,
         "template_type": template_type,
+        "message": message,
         "data": data or {},
         "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": datetime.now(timezone.utc),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    
-    await db.notification_logs.insert_one(notification_log)
-    
-    print(f"AlimTalk notification queued: {template_type} to {parent.get('phone', 'N/A')} for student {student['name']}")
+
+async def enqueue_notifications(notifications: List[Dict[str, Any]]):
+    """Persist notifications to the outbox and wake the dispatcher"""
+    for chunk in chunked(notifications, BULK_WRITE_CHUNK_SIZE):
+        await db.notification_logs.insert_many(chunk, ordered=False)
+    if notifications:
+        notification_dispatcher.wake()
+
+async def send_alimtalk_notification(student_id: str, template_type: str, data: Dict = None):
+    """Queue an AlimTalk notification to the student's parent"""
+    await enqueue_notifications([build_notification(template_type, data, student_id=student_id)])
+
+async def send_alimtalk_notifications_bulk(notifications: List[tuple]):
+    """Queue many AlimTalk notifications, given as (student_id, template_type, data) tuples"""
+    await enqueue_notifications([
+        build_notification(template_type, data, student_id=student_id)
+        for student_id, template_type, data in notifications
+    ])
+
+class RateLimiter:
+    """Token bucket spacing sends to at most rate per second"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class NotificationDispatcher:
+    """Drains notification_logs in batches and hands messages to the configured sender
+
+    Records are claimed with a lease so several workers can dispatch
+    concurrently and a crashed worker's batch is picked up again once the
+    lease expires. Recipients are resolved for the whole batch with $in
+    queries, notifications of the same template to the same phone in one
+    batch are coalesced into a single message, sends are rate limited, and failures are retried
+    with exponential backoff until NOTIFICATION_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, sender):
+        self.sender = sender
+        self.rate_limiter = RateLimiter(NOTIFICATION_RATE_PER_SECOND)
+        self._wakeup = asyncio.Event()
+        self._counters = {"sent": 0, "coalesced": 0, "retried": 0, "failed": 0, "batches": 0}
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _claim_batch(self) -> List[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        claimable = {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "pending", "next_attempt_at": None},
+            {"status": "sending", "claim_expires_at": {"$lt": now}}
+        ]}
+        candidates = await db.notification_logs.find(claimable, {"_id": 1}).sort("created_at", 1).to_list(NOTIFICATION_BATCH_SIZE)
+        if not candidates:
+            return []
+        
+        claim_token = str(uuid.uuid4())
+        await db.notification_logs.update_many(
+            {"$and": [{"_id": {"$in": [doc["_id"] for doc in candidates]}}, claimable]},
+            {"$set": {
+                "status": "sending",
+                "claim_token": claim_token,
+                "claim_expires_at": now + timedelta(seconds=NOTIFICATION_CLAIM_LEASE)
+            }}
+        )
+        return await db.notification_logs.find(
+            {"_id": {"$in": [doc["_id"] for doc in candidates]}, "claim_token": claim_token}
+        ).sort("created_at", 1).to_list(None)
+
+    async def _resolve_recipients(self, notifications: List[Dict[str, Any]]):
+        """Fill in recipient phones for the batch with one $in query per collection"""
+        student_ids = list({n["student_id"] for n in notifications if not n.get("parent_phone") and n.get("student_id")})
+        user_ids = list({n["user_id"] for n in notifications if not n.get("parent_phone") and n.get("user_id")})
+        
+        students = await db.students.find({"id": {"$in": student_ids}}, {"_id": 0, "id": 1, "parent_id": 1}).to_list(None)
+        parents = await db.parents.find(
+            {"id": {"$in": list({student["parent_id"] for student in students})}}, {"_id": 0, "id": 1, "phone": 1}
+        ).to_list(None)
+        users = await db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "phone": 1}).to_list(None)
+        phone_by_parent = {parent["id"]: parent.get("phone") for parent in parents}
+        phone_by_student = {student["id"]: phone_by_parent.get(student["parent_id"]) for student in students}
+        phone_by_user = {user["id"]: user.get("phone") for user in users}
+        
+        for notification in notifications:
+            if not notification.get("parent_phone"):
+                notification["parent_phone"] = (
+                    phone_by_student.get(notification.get("student_id"))
+                    or phone_by_user.get(notification.get("user_id"))
+                )
+
+    @staticmethod
+    def _group_key(notification: Dict[str, Any]) -> Any:
+        """Notifications that can go out as one message share a key
+
+        Only the same template to the same phone is coalesced, since the
+        group is sent under the first notification's template. Template-
+        rendered messages also need the same data; free-text messages are
+        joined.
+        """
+        if not NOTIFICATION_COALESCE:
+            return notification["_id"]
+        data = None if notification.get("message") else json.dumps(notification.get("data") or {}, sort_keys=True, default=str)
+        return (notification["parent_phone"], notification.get("template_type"), data)
+
+    async def _send_group(self, recipient: str, group: List[Dict[str, Any]], semaphore: asyncio.Semaphore):
+        messages = [
+            notification.get("message") or render_notification_message(notification.get("template_type"), notification.get("data"))
+            for notification in group
+        ]
+        async with semaphore:
+            await self.rate_limiter.acquire()
+            try:
+                message_id = await self.sender.send(
+                    recipient, "\n".join(dict.fromkeys(messages)), group[0].get("template_type"), group[0].get("data") or {}
+                )
+                return group, message_id, None
+            except Exception as e:
+                return group, None, e
+
+    async def dispatch_batch(self) -> int:
+        """Claim, send and settle one batch; returns the number of records handled"""
+        notifications = await self._claim_batch()
+        if not notifications:
+            return 0
+        await self._resolve_recipients(notifications)
+        
+        now = datetime.now(timezone.utc)
+        operations = []
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for notification in notifications:
+            recipient = notification.get("parent_phone")
+            if not recipient:
+                operations.append(UpdateOne({"_id": notification["_id"]}, {
+                    "$set": {"status": "failed", "last_error": "No recipient phone"},
+                    "$unset": {"claim_token": "", "claim_expires_at": ""}
+                }))
+                self._counters["failed"] += 1
+                continue
+            groups.setdefault(self._group_key(notification), []).append(notification)
+        
+        semaphore = asyncio.Semaphore(NOTIFICATION_SEND_CONCURRENCY)
+        results = await asyncio.gather(*(
+            self._send_group(group[0]["parent_phone"], group, semaphore) for group in groups.values()
+        ))
+        
+        for group, message_id, error in results:
+            self._counters["coalesced"] += len(group) - 1
+            for notification in group:
+                if error is None:
+                    update = {"$set": {
+                        "status": "sent", "sent_at": now.isoformat(), "parent_phone": notification["parent_phone"],
+                        "provider": self.sender.name, "provider_message_id": message_id, "coalesced_count": len(group)
+                    }, "$inc": {"attempts": 1}}
+                    self._counters["sent"] += 1
+                else:
+                    attempts = notification.get("attempts", 0) + 1
+                    permanent = getattr(error, "permanent", False)
+                    if permanent or attempts >= NOTIFICATION_MAX_ATTEMPTS:
+                        update = {"$set": {"status": "failed", "last_error": str(error)}, "$inc": {"attempts": 1}}
+                        self._counters["failed"] += 1
+                    else:
+                        delay = min(NOTIFICATION_BACKOFF_BASE * 2 ** (attempts - 1), NOTIFICATION_BACKOFF_MAX)
+                        update = {"$set": {
+                            "status": "pending", "last_error": str(error),
+                            "next_attempt_at": now + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+                        }, "$inc": {"attempts": 1}}
+                        self._counters["retried"] += 1
+                update["$unset"] = {"claim_token": "", "claim_expires_at": ""}
+                operations.append(UpdateOne({"_id": notification["_id"]}, update))
+        
+        if operations:
+            await db.notification_logs.bulk_write(operations, ordered=False)
+        self._counters["batches"] += 1
+        return len(notifications)
+
+    async def run(self):
+        """Background loop: drain full batches back to back, otherwise wait for a wake-up or the interval"""
+        while True:
+            try:
+                handled = await self.dispatch_batch()
+            except Exception as e:
+                logger.warning(f"Notification dispatch failed: {str(e)}")
+                handled = 0
+            if handled >= NOTIFICATION_BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), NOTIFICATION_DISPATCH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"provider": self.sender.name, **self._counters}
+
+if NOTIFICATION_PROVIDER not in NOTIFICATION_SENDERS:
+    logging.warning(f"Unknown NOTIFICATION_PROVIDER '{NOTIFICATION_PROVIDER}', falling back to the fake provider")
+notification_dispatcher = NotificationDispatcher(NOTIFICATION_SENDERS.get(NOTIFICATION_PROVIDER, FakeNotificationSender)())
 
 async def can_access_branch(admin_user_id: str, admin_role: str, branch: str) -> bool:
     """Check if admin user can access specific branch"""
@@ -4061,45 +6745,15 @@ async def can_access_branch(admin_user_id: str, admin_role: str, branch: str) ->
         return True
     
     # Check user's allowed branches
-    allowed_branches = await get_allowed_branches(admin_user_id)
+    allowed_branches = await get_allowed_branches(admin_user_id, admin_role)
     return branch in allowed_branches
 
 async def send_status_change_notification(student_id: str, notification_type: str, data: Dict = None):
-    """Send notification when student status changes"""
+    """Queue a notification to the parent when a student's status changes"""
     try:
-        student = await db.students.find_one({"id": student_id})
-        if not student:
-            return
-        
-        parent = await db.parents.find_one({"id": student["parent_id"]})
-        if not parent:
-            return
-        
-        notification_templates = {
-            "admission_approved": "입학 승인되었습니다. 반 배정 안내를 기다려 주세요.",
-            "class_assigned": f"반 배정이 완료되었습니다. 담임교사: {data.get('teacher', 'N/A')}",
-            "status_leave": "휴학 처리가 완료되었습니다.",
-            "status_withdrawn": "퇴원 처리가 완료되었습니다."
-        }
-        
-        message = notification_templates.get(notification_type, f"상태가 변경되었습니다.")
-        
-        # Log notification (actual AlimTalk integration would go here)
-        notification_log = {
-            "student_id": student_id,
-            "parent_phone": parent.get("phone", ""),
-            "notification_type": notification_type,
-            "message": message,
-            "data": data or {},
-            "status": "pending",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        
-        await db.notification_logs.insert_one(notification_log)
-        print(f"Status change notification queued: {notification_type} for student {student['name']}")
-        
+        await enqueue_notifications([build_notification(notification_type, data, student_id=student_id)])
     except Exception as e:
-        print(f"Error sending status change notification: {str(e)}")
+        logger.warning(f"Error queueing status change notification: {str(e)}")
 
 @api_router.post("/signup")
 async def signup(user_data: UserCreate):
@@ -4117,7 +6771,7 @@ async def signup(user_data: UserCreate):
             email=user_data.email,
             phone=user_data.phone,
             name=user_data.name,
-            password_hash=hash_password(user_data.password)
+            password_hash=await hash_password(user_data.password)
         )
         
         # Insert user
@@ -4161,6 +6815,8 @@ async def signup(user_data: UserCreate):
         print(f"DEBUG: Inserting student with ID: {student.id} for parent: {parent.id}")
         await db.students.insert_one(student_dict)
         print(f"DEBUG: Student inserted successfully")
+        student_autocomplete.upsert(student_dict)
+        await refresh_member_search([user.id])
         
         # Create admission data (legacy)
         admission = AdmissionData(household_token=user.household_token)
@@ -4180,17 +6836,14 @@ async def signup(user_data: UserCreate):
         # Initialize enrollment progress
         try:
             # Check if flow exists
-            flow = await db.enrollment_flows.find_one({"flow_key": flow_key, "is_active": True})
-            if flow:
-                # Get first step
-                first_step = min(flow["steps"], key=lambda x: x["order"])
-                
+            flow = await flow_registry.get(flow_key, active_only=True)
+            if flow and flow.first_step:
                 # Create progress record
                 progress = StudentEnrollmentProgress(
                     student_id=student.id,
                     household_token=user.household_token,
                     flow_key=flow_key,
-                    current_step=first_step["key"]
+                    current_step=flow.first_step["key"]
                 )
                 
                 progress_dict = progress.dict()
@@ -4198,6 +6851,7 @@ async def signup(user_data: UserCreate):
                 progress_dict['updated_at'] = progress_dict['updated_at'].isoformat()
                 
                 await db.student_enrollment_progress.insert_one(progress_dict)
+                await record_progress_summary_transition(None, progress_dict)
         except Exception as e:
             # Don't fail signup if progress init fails, just log it
             print(f"Warning: Failed to initialize progress for student {student.id}: {str(e)}")
@@ -4220,18 +6874,22 @@ async def signup(user_data: UserCreate):
 @api_router.post("/login")
 async def login(login_data: UserLogin):
     user = await db.users.find_one({"email": login_data.email})
-    if not user or not verify_password(login_data.password, user['password_hash']):
+    if not user or not await verify_password(login_data.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Check if user is active
     if user.get('status') == 'disabled':
         raise HTTPException(status_code=401, detail="Account is disabled")
+    run_in_background(rehash_password_if_needed("users", user['id'], login_data.password, user['password_hash']))
     
     # Update last login
+    last_login_at = datetime.now(timezone.utc).isoformat()
     await db.users.update_one(
         {"id": user['id']},
-        {"$set": {"last_login_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"last_login_at": last_login_at}}
     )
+    principal_cache.invalidate("user", user['id'])
+    run_in_background(update_member_search_fields(user['id'], {"last_login_at": last_login_at}))
     
     token = create_jwt_token(user['id'], user['household_token'])
     
@@ -4396,40 +7054,194 @@ async def get_audit_logs(
     targetId: str = None,
     type: str = None,
     page: int = 1,
-    limit: int = 50
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    includeTotal: bool = True
 ):
+    # Make entries still sitting in the write-behind buffer visible
+    await audit_log_writer.flush()
+    
     query = {}
     if targetId:
         query["target_id"] = targetId
     if type:
         query["action"] = type
     
-    skip = (page - 1) * limit
-    
-    audit_logs = await db.audit_logs.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    total_count = await db.audit_logs.count_documents(query)
+    result = await keyset_paginate(db.audit_logs, query, "created_at", -1, limit, page, cursor, includeTotal)
+    audit_logs = result["items"]
     
-    # Clean audit logs and add actor names
-    for log in audit_logs:
-        if '_id' in log:
-            del log['_id']
-        
-        actor = await db.admins.find_one({"id": log["actor_user_id"]})
-        if actor:
-            log["actor_name"] = actor.get("username", "Unknown")
-        else:
-            log["actor_name"] = "System"
+    # Add actor names from the cached admin map
+    await attach_actor_names(audit_logs)
     
     return {
         "audit_logs": audit_logs,
         "pagination": {
             "page": page,
             "limit": limit,
-            "total": total_count,
-            "totalPages": (total_count + limit - 1) // limit
+            "total": result["total"],
+            "totalPages": total_pages(result["total"], limit),
+            "nextCursor": result["next_cursor"],
+            "hasMore": result["has_more"]
+        }
+    }
+
+@api_router.get("/admin/audit/query")
+async def query_audit_logs(
+    current_admin: AdminResponse = Depends(get_current_admin),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    actor: Optional[str] = None,
+    targetType: Optional[str] = None,
+    targetId: Optional[str] = None,
+    action: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    includeTotal: bool = False,
+    includeArchive: bool = False,
+    format: str = "json"
+):
+    """Query audit logs by time range, actor, target and action (exact or PREFIX:*)
+
+    format=ndjson streams every match; with includeArchive it also reads archived ranges.
+    """
+    try:
+        if not await has_permission(current_admin.id, current_admin.role, "can_view_audit_log"):
+            raise HTTPException(status_code=403, detail="Permission denied: cannot view audit logs")
+        if format not in ("json", "ndjson"):
+            raise HTTPException(status_code=400, detail="Invalid format. Must be 'json' or 'ndjson'")
+        if includeArchive and format != "ndjson":
+            raise HTTPException(status_code=400, detail="includeArchive requires format=ndjson")
+        
+        await audit_log_writer.flush()
+        query = await build_audit_query(start, end, actor, targetType, targetId, action)
+        
+        if format == "ndjson":
+            return StreamingResponse(
+                stream_audit_ndjson(query, includeArchive, parse_audit_time(start, "start"), parse_audit_time(end, "end")),
+                media_type="application/x-ndjson"
+            )
+        
+        limit = max(1, min(limit, AUDIT_QUERY_MAX_LIMIT))
+        result = await keyset_paginate(db.audit_logs, query, "created_at", -1, limit, 1, cursor, includeTotal)
+        await attach_actor_names(result["items"])
+        
+        return {
+            "audit_logs": result["items"],
+            "pagination": {
+                "limit": limit,
+                "total": result["total"],
+                "nextCursor": result["next_cursor"],
+                "hasMore": result["has_more"]
+            }
         }
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error querying audit logs: {str(e)}")
+
+@api_router.get("/admin/system/stats")
+async def get_system_stats(current_admin: AdminResponse = Depends(get_current_admin)):
+    """Get in-process cache and worker statistics (super admin only)"""
+    if current_admin.role != "super_admin":
+        raise HTTPException(status_code=403, detail="Only super admin can view system stats")
+    
+    return {
+        "principal_cache": principal_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "student_autocomplete": student_autocomplete.stats(),
+        "notifications": notification_dispatcher.stats(),
+        "audit_log_writer": audit_log_writer.stats(),
+        "product_cache": product_cache.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "product_search": product_search.stats()
     }
 
+@api_router.get("/admin/system/query-metrics")
+async def get_query_metrics(limit: int = 50, current_admin: AdminResponse = Depends(get_current_admin)):
+    """Mongo commands, time and documents per route, with N+1 suspects (super admin only)"""
+    if current_admin.role != "super_admin":
+        raise HTTPException(status_code=403, detail="Only super admin can view query metrics")
+    
+    return {
+        "enabled": QUERY_TRACE_ENABLED,
+        "n_plus_one_threshold": QUERY_TRACE_N_PLUS_ONE_THRESHOLD,
+        "routes": route_query_metrics.report(limit)
+    }
+
+@api_router.delete("/admin/system/query-metrics")
+async def reset_query_metrics(current_admin: AdminResponse = Depends(get_current_admin)):
+    """Clear the per-route query metrics (super admin only)"""
+    if current_admin.role != "super_admin":
+        raise HTTPException(status_code=403, detail="Only super admin can reset query metrics")
+    
+    route_query_metrics.reset()
+    return {"message": "Query metrics reset"}
+
+@api_router.get("/admin/system/indexes")
+async def get_system_indexes(current_admin: AdminResponse = Depends(get_current_admin)):
+    """Report missing, uncatalogued and unused indexes (super admin only)"""
+    try:
+        if current_admin.role != "super_admin":
+            raise HTTPException(status_code=403, detail="Only super admin can view index status")
+        
+        return {"collections": await get_index_report()}
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error fetching index report: {str(e)}")
+
+@api_router.post("/admin/system/indexes/ensure")
+async def ensure_system_indexes(current_admin: AdminResponse = Depends(get_current_admin)):
+    """Create any missing catalog indexes (super admin only)"""
+    try:
+        if current_admin.role != "super_admin":
+            raise HTTPException(status_code=403, detail="Only super admin can manage indexes")
+        
+        return await ensure_indexes()
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error ensuring indexes: {str(e)}")
+
+@api_router.post("/admin/archive/run")
+async def run_archive_now(current_admin: AdminResponse = Depends(get_current_admin)):
+    """Move records past their retention horizon into archive files now (super admin only)"""
+    try:
+        if current_admin.role != "super_admin":
+            raise HTTPException(status_code=403, detail="Only super admin can run archival")
+        
+        result = await run_archival()
+        if result["skipped"]:
+            raise HTTPException(status_code=409, detail="Archival is already running on another worker")
+        return {"message": "Archival completed", "archived": result["archived"]}
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error running archival: {str(e)}")
+
+@api_router.get("/admin/archive/{collection_name}")
+async def read_archive(
+    collection_name: str,
+    current_admin: AdminResponse = Depends(get_current_admin),
+    start: Optional[str] = None,
+    end: Optional[str] = None
+):
+    """Stream archived records of a collection in [start, end) as NDJSON (super admin only)"""
+    if current_admin.role != "super_admin":
+        raise HTTPException(status_code=403, detail="Only super admin can read archives")
+    if collection_name not in ARCHIVE_POLICIES:
+        raise HTTPException(status_code=404, detail="No archive for this collection")
+    
+    start, end = parse_audit_time(start, "start"), parse_audit_time(end, "end")
+    
+    async def stream():
+        async for batch in read_archived_records(collection_name, None, start, end):
+            yield ndjson_chunk(batch)
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @api_router.get("/exam/available-slots")
 async def get_available_exam_slots(brchType: str, campus: str = None):
     # Mock available slots for demo
@@ -4473,16 +7285,19 @@ async def get_available_exam_slots(brchType: str, campus: str = None):
     return {"available_slots": mock_slots}
 
 @api_router.get("/parent/dashboard")
-async def get_parent_dashboard(current_user: UserResponse = Depends(get_current_user)):
+async def get_parent_dashboard(
+    current_user: UserResponse = Depends(get_current_user),
+    loader: RequestLoader = Depends(get_request_loader)
+):
     """Get comprehensive parent dashboard data"""
     try:
         # Get parent info
-        parent = await db.parents.find_one({"user_id": current_user.id})
+        parent = await loader.parent_for_user(current_user.id)
         if not parent:
             raise HTTPException(status_code=404, detail="Parent info not found")
         
         # Get students
-        students = await db.students.find({"parent_id": parent["id"]}).to_list(10)
+        students = await loader.students_of_parent(parent["id"])
         
         # Get admission data
         admission_data = await db.admission_data.find_one({"household_token": current_user.household_token})
@@ -4603,14 +7418,14 @@ async def get_test_results(current_user: UserResponse = Depends(get_current_user
         parent = await db.parents.find_one({"user_id": current_user.id})
         students = await db.students.find({"parent_id": parent["id"] if parent else ""}).to_list(10)
         
+        # Check if the household has taken a test (has exam reservation with completed status)
+        exam_reservations = await db.exam_reservations.find({
+            "household_token": current_user.household_token,
+            "status": {"$in": ["completed", "confirmed"]}
+        }).to_list(10)
+        
         results = []
         for student in students:
-            # Check if student has taken test (has exam reservation with completed status)
-            exam_reservations = await db.exam_reservations.find({
-                "household_token": current_user.household_token,
-                "status": {"$in": ["completed", "confirmed"]}
-            }).to_list(10)
-            
             if exam_reservations:
                 result = {
                     "id": f"result_{student.get('id', '')}",
@@ -4672,69 +7487,792 @@ async def get_class_assignments(current_user: UserResponse = Depends(get_current
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching class assignments: {str(e)}")
 
+# Product Cache
+PRODUCT_CACHE_TTL = float(os.environ.get('PRODUCT_CACHE_TTL', '60'))
+PRODUCT_CACHE_MAX_ENTRIES = int(os.environ.get('PRODUCT_CACHE_MAX_ENTRIES', '5000'))
+PRODUCT_RESPONSE_PROJECTION = {"_id": 0, **{field: 1 for field in ProductResponse.model_fields}}
+
+class ProductCache:
+    """Validated ProductResponse objects by product id
+
+    Misses are fetched together with one $in query. Invalidation bumps a
+    per-product version (or a global epoch), and a load only stores its
+    result if no invalidation happened while it was in flight, so a
+    concurrent reader cannot put a stale product back.
+    """
+
+    def __init__(self, ttl: float = PRODUCT_CACHE_TTL, max_entries: int = PRODUCT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, tuple] = {}
+        self._versions: Dict[str, int] = {}
+        self._epoch = 0
+        self._counters = {"hits": 0, "misses": 0, "loads": 0}
+
+    async def get_many(self, product_ids: List[str]) -> Dict[str, ProductResponse]:
+        """Products by id; ids that do not exist are left out"""
+        now = time.monotonic()
+        found: Dict[str, ProductResponse] = {}
+        missing = []
+        for product_id in dict.fromkeys(product_ids):
+            entry = self._entries.get(product_id)
+            if entry and entry[0] > now:
+                found[product_id] = entry[1]
+            else:
+                missing.append(product_id)
+        self._counters["hits"] += len(found)
+        self._counters["misses"] += len(missing)
+        
+        if missing:
+            epoch = self._epoch
+            versions = {product_id: self._versions.get(product_id, 0) for product_id in missing}
+            products = await db.products.find({"id": {"$in": missing}}, PRODUCT_RESPONSE_PROJECTION).to_list(None)
+            self._counters["loads"] += 1
+            for product in products:
+                response = ProductResponse(**product)
+                found[response.id] = response
+                if epoch == self._epoch and versions[response.id] == self._versions.get(response.id, 0):
+                    self._store(response, now)
+        return found
+
+    async def get(self, product_id: str) -> Optional[ProductResponse]:
+        return (await self.get_many([product_id])).get(product_id)
+
+    def _store(self, product: ProductResponse, now: float):
+        if product.id not in self._entries and len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[product.id] = (now + self.ttl, product)
+
+    def invalidate(self, product_ids: Optional[List[str]] = None):
+        """Drop the given products, or every product when no ids are given"""
+        if product_ids is None:
+            self._epoch += 1
+            self._entries.clear()
+            return
+        for product_id in product_ids:
+            self._versions[product_id] = self._versions.get(product_id, 0) + 1
+            self._entries.pop(product_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), **self._counters}
+
+product_cache = ProductCache()
+
+# Catalog Response Cache Utility Functions
+CATALOG_CACHE_TTL = float(os.environ.get('CATALOG_CACHE_TTL', '30'))
+CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', '1000'))
+
+class CatalogCache:
+    """Serialized market responses keyed by endpoint and normalized query params
+
+    Entries remember the catalog version they were built from; product writes
+    bump the version, which retires every entry at once. Concurrent misses for
+    the same key share one load, so an expiring entry costs Mongo one query
+    no matter how many requests arrive at that moment. Stock changes from
+    checkouts do not bump the version: listings may show stock up to
+    CATALOG_CACHE_TTL old, while reservations are checked against Mongo.
+    """
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL, max_entries: int = CATALOG_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = 0
+        self._entries: Dict[tuple, tuple] = {}
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self._counters = {"hits": 0, "misses": 0, "shared_loads": 0, "loads": 0}
+
+    async def get(self, key: tuple, loader) -> tuple:
+        """(body, etag) for key, calling loader() to build the payload on a miss"""
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic() and entry[1] == self.version:
+            self._counters["hits"] += 1
+            return entry[2], entry[3]
+        
+        load = self._inflight.get(key)
+        if load:
+            self._counters["shared_loads"] += 1
+        else:
+            self._counters["misses"] += 1
+            # The load runs as its own task so a cancelled request (e.g. a client
+            # disconnect) does not cancel it for the other requests waiting on it
+            load = asyncio.ensure_future(self._load(key, loader))
+            load.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self._inflight[key] = load
+        return await asyncio.shield(load)
+
+    async def _load(self, key: tuple, loader) -> tuple:
+        version = self.version
+        try:
+            payload = await loader()
+            self._counters["loads"] += 1
+            body = json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            result = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+            if version == self.version:
+                self._store(key, version, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def _store(self, key: tuple, version: int, result: tuple):
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic() + self.ttl, version, *result)
+
+    def invalidate(self):
+        """Retire every cached response after a catalog write"""
+        self.version += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "version": self.version, **self._counters}
+
+catalog_cache = CatalogCache()
+
+def catalog_key(endpoint: str, **params) -> tuple:
+    """Cache key that ignores param order, unset params and surrounding whitespace"""
+    normalized = []
+    for name, value in sorted(params.items()):
+        if isinstance(value, str):
+            value = value.strip() or None
+        if value is not None:
+            normalized.append((name, value))
+    return (endpoint, *normalized)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def conditional_json_response(request: Request, body: bytes, etag: str) -> Response:
+    """JSON response carrying an ETag, or an empty 304 when the client already has it"""
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=0, must-revalidate"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def cached_catalog_response(request: Request, key: tuple, loader) -> Response:
+    body, etag = await catalog_cache.get(key, loader)
+    return conditional_json_response(request, body, etag)
+
+def invalidate_catalog(product_ids: Optional[List[str]] = None):
+    """Call after writing product data other than stock"""
+    product_cache.invalidate(product_ids)
+    catalog_cache.invalidate()
+
+# Product Search Utility Functions
+PRODUCT_SEARCH_REFRESH_INTERVAL = float(os.environ.get('PRODUCT_SEARCH_REFRESH_INTERVAL', '300'))
+PRODUCT_SEARCH_MAX_EXPANSIONS = 50
+PRODUCT_SEARCH_FUZZY_MIN_LENGTH = 4  # In jamo keystrokes; shorter words match too much with one typo
+PRODUCT_SEARCH_FIELD_WEIGHTS = {
+    "name": 3.0,
+    "brand": 2.0,
+    "tags": 2.0,
+    "category": 1.0,
+    "subcategory": 1.0,
+    "color_options": 1.0,
+    "description": 1.0
+}
+PRODUCT_SEARCH_FACETS = {
+    "category": "category",
+    "subcategory": "subcategory",
+    "size": "size_options",
+    "color": "color_options"
+}
+PRODUCT_SORT_FIELDS = ["relevance", "created_at", "price", "name"]
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def product_search_words(text: Any) -> List[str]:
+    """Runs of Latin letters/digits and of Hangul syllables; punctuation splits words"""
+    return re.findall(r"[a-z0-9]+|[가-힣]+", normalize_search_text(text))
+
+def product_search_terms(text: Any) -> List[str]:
+    """Indexed terms: every word, plus syllable bigrams of Hangul words
+
+    Korean compounds and particles are written without spaces, so "교복상의"
+    is also indexed as 교복, 복상 and 상의 and a search for "상의" finds it.
+    """
+    terms = []
+    for word in product_search_words(text):
+        terms.append(word)
+        if len(word) > 2 and "가" <= word[0] <= "힣":
+            terms.extend(word[start:start + 2] for start in range(len(word) - 1))
+    return terms
+
+def typo_variants(key: str) -> set:
+    """The key and every way of deleting one character from it"""
+    return {key} | {key[:position] + key[position + 1:] for position in range(len(key))}
+
+class ProductSearchCorpus:
+    """Postings, prefix trie, typo index and facet sets for one build of the catalog"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.products: Dict[str, Dict[str, Any]] = {}
+        self.prefixes = PrefixTrie()  # jamo spelling of each term -> term
+        self.typos: Dict[str, set] = {}  # one-deletion variants of each jamo spelling -> terms
+        self.facets: Dict[tuple, set] = {}
+        self.total_length = 0.0
+
+    @staticmethod
+    def _weighted_terms(product: Dict[str, Any]) -> Dict[str, float]:
+        weights: Dict[str, float] = {}
+        for field, weight in PRODUCT_SEARCH_FIELD_WEIGHTS.items():
+            value = product.get(field)
+            for text in (value if isinstance(value, list) else [value]):
+                for term in product_search_terms(text):
+                    weights[term] = weights.get(term, 0.0) + weight
+        return weights
+
+    @staticmethod
+    def _facet_values(product: Dict[str, Any]) -> List[tuple]:
+        values = []
+        for facet, field in PRODUCT_SEARCH_FACETS.items():
+            value = product.get(field)
+            for item in (value if isinstance(value, list) else [value]):
+                if item:
+                    values.append((facet, item))
+        return values
+
+    def add(self, product: Dict[str, Any]):
+        terms = self._weighted_terms(product)
+        entry = {
+            "id": product["id"],
+            "name": product.get("name", ""),
+            "price": product.get("price", 0),
+            "created_at": str(product.get("created_at", "")),
+            "terms": terms,
+            "length": sum(terms.values()),
+            "facets": self._facet_values(product)
+        }
+        for term, weight in terms.items():
+            postings = self.postings.setdefault(term, {})
+            if not postings:
+                jamo = decompose_hangul(term)
+                self.prefixes.insert(jamo, term)
+                if len(jamo) >= PRODUCT_SEARCH_FUZZY_MIN_LENGTH:
+                    for variant in typo_variants(jamo):
+                        self.typos.setdefault(variant, set()).add(term)
+            postings[entry["id"]] = weight
+        for facet_value in entry["facets"]:
+            self.facets.setdefault(facet_value, set()).add(entry["id"])
+        self.products[entry["id"]] = entry
+        self.total_length += entry["length"]
+
+    def discard(self, product_id: str):
+        entry = self.products.pop(product_id, None)
+        if not entry:
+            return
+        self.total_length -= entry["length"]
+        for term in entry["terms"]:
+            postings = self.postings.get(term, {})
+            postings.pop(product_id, None)
+            if not postings:
+                self.postings.pop(term, None)
+                jamo = decompose_hangul(term)
+                self.prefixes.remove(jamo, term)
+                if len(jamo) >= PRODUCT_SEARCH_FUZZY_MIN_LENGTH:
+                    for variant in typo_variants(jamo):
+                        terms = self.typos.get(variant)
+                        if terms is not None:
+                            terms.discard(term)
+                            if not terms:
+                                del self.typos[variant]
+        for facet_value in entry["facets"]:
+            members = self.facets.get(facet_value)
+            if members is not None:
+                members.discard(product_id)
+                if not members:
+                    del self.facets[facet_value]
+
+    def bm25(self, term: str) -> Dict[str, float]:
+        """BM25 score of the term for every product containing it"""
+        postings = self.postings.get(term)
+        if not postings:
+            return {}
+        count = len(self.products)
+        idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+        average_length = self.total_length / count if count else 1.0
+        scores = {}
+        for product_id, weight in postings.items():
+            length_norm = 1 - BM25_B + BM25_B * self.products[product_id]["length"] / (average_length or 1.0)
+            scores[product_id] = idf * weight * (BM25_K1 + 1) / (weight + BM25_K1 * length_norm)
+        return scores
+
+    def match_word(self, word: str) -> Dict[str, float]:
+        """Scores for one query word: exact, then prefix and bigram, then one-typo matches"""
+        scores: Dict[str, float] = {}
+
+        def merge(term_scores: Dict[str, float], factor: float):
+            for product_id, score in term_scores.items():
+                scores[product_id] = max(scores.get(product_id, 0.0), score * factor)
+
+        merge(self.bm25(word), 1.0)
+        jamo = decompose_hangul(word)
+        expansions = sorted(self.prefixes.search(jamo) - {word}, key=lambda term: (len(term), term))
+        for term in expansions[:PRODUCT_SEARCH_MAX_EXPANSIONS]:
+            merge(self.bm25(term), 0.8)
+        if len(word) > 2 and "가" <= word[0] <= "힣":
+            # "교복상의" finds "교복 상의": products need two thirds of the word's bigrams
+            bigrams = [self.bm25(word[start:start + 2]) for start in range(len(word) - 1)]
+            needed = math.ceil(len(bigrams) * 2 / 3)
+            hits: Dict[str, List[float]] = {}
+            for bigram in bigrams:
+                for product_id, score in bigram.items():
+                    hits.setdefault(product_id, []).append(score)
+            merge({product_id: sum(found) / len(bigrams) for product_id, found in hits.items() if len(found) >= needed}, 0.9)
+        
+        if not scores and len(jamo) >= PRODUCT_SEARCH_FUZZY_MIN_LENGTH:
+            candidates = set()
+            for variant in typo_variants(jamo):
+                candidates |= self.typos.get(variant, set())
+            for term in sorted(candidates)[:PRODUCT_SEARCH_MAX_EXPANSIONS]:
+                merge(self.bm25(term), 0.5)
+        return scores
+
+class ProductSearchIndex:
+    """In-memory full-text search over available products
+
+    Words from names, brands, tags, categories and descriptions are scored
+    with BM25 (name matches weigh most). A query word also matches as a
+    prefix, through Hangul bigrams and, when nothing else matched, with one
+    typo, so lookups only touch the postings of the words searched for.
+    Writes in this process are applied incrementally; the index is rebuilt
+    in the background after PRODUCT_SEARCH_REFRESH_INTERVAL to pick up other
+    workers' writes.
+    """
+
+    def __init__(self, refresh_interval: float = PRODUCT_SEARCH_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._corpus = ProductSearchCorpus()
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        # Writes made while a reload is scanning, replayed onto the new corpus
+        self._replay: Optional[List[tuple]] = None
+
+    @staticmethod
+    def _apply(corpus: ProductSearchCorpus, op: str, arg: Any):
+        if op == "upsert":
+            corpus.discard(arg["id"])
+            if arg.get("is_available", True):
+                corpus.add(arg)
+        elif op == "remove":
+            corpus.discard(arg)
+
+    def _write(self, op: str, arg: Any):
+        self._apply(self._corpus, op, arg)
+        if self._replay is not None:
+            self._replay.append((op, arg))
+
+    def upsert(self, product: Dict[str, Any]):
+        """Index a new or changed product; unavailable products are dropped from the index"""
+        self._write("upsert", dict(product))
+
+    def remove(self, product_id: str):
+        self._write("remove", product_id)
+
+    async def reload(self):
+        """Rebuild the index from the products collection and swap it in"""
+        corpus = ProductSearchCorpus()
+        projection = {"_id": 0, "id": 1, "name": 1, "price": 1, "created_at": 1, "is_available": 1,
+                      **{field: 1 for field in PRODUCT_SEARCH_FIELD_WEIGHTS},
+                      **{field: 1 for field in PRODUCT_SEARCH_FACETS.values()}}
+        self._replay = []
+        try:
+            async for product in db.products.find({"is_available": True}, projection):
+                corpus.add(product)
+            for op, arg in self._replay:
+                self._apply(corpus, op, arg)
+            self._corpus = corpus
+            self._loaded_at = time.monotonic()
+        finally:
+            self._replay = None
+
+    async def ensure_loaded(self):
+        if self._loaded_at is None:
+            async with self._lock:
+                if self._loaded_at is None:
+                    await self.reload()
+        elif time.monotonic() - self._loaded_at > self.refresh_interval and not self._lock.locked():
+            run_in_background(self._refresh())
+
+    async def _refresh(self):
+        async with self._lock:
+            if time.monotonic() - self._loaded_at > self.refresh_interval:
+                await self.reload()
+
+    async def search(self, query: str, filters: Dict[str, Optional[str]], sort_by: str = "relevance",
+                     descending: bool = True, offset: int = 0, limit: int = 20) -> Dict[str, Any]:
+        """One page of matching product ids, the total, and facet counts over all matches
+
+        Every query word must match; when no product matches them all the
+        query is relaxed to any word.
+        """
+        await self.ensure_loaded()
+        corpus = self._corpus
+        word_scores = [corpus.match_word(word) for word in product_search_words(query)]
+        
+        if word_scores:
+            matched = set.intersection(*(set(scores) for scores in word_scores)) or set.union(*(set(scores) for scores in word_scores))
+        else:
+            matched = set(corpus.products)
+        for facet, value in filters.items():
+            if value:
+                matched &= corpus.facets.get((facet, value), set())
+        
+        facet_counts: Dict[str, Dict[str, int]] = {facet: {} for facet in PRODUCT_SEARCH_FACETS}
+        for product_id in matched:
+            for facet, value in corpus.products[product_id]["facets"]:
+                facet_counts[facet][value] = facet_counts[facet].get(value, 0) + 1
+        
+        if sort_by == "relevance":
+            def sort_key(product_id: str) -> tuple:
+                score = sum(scores.get(product_id, 0.0) for scores in word_scores)
+                return (-round(score, 6), corpus.products[product_id]["name"], product_id)
+            ranked = heapq.nsmallest(offset + limit, matched, key=sort_key)
+        else:
+            ranked = sorted(matched, key=lambda product_id: (corpus.products[product_id][sort_by], product_id), reverse=descending)
+        
+        return {
+            "ids": ranked[offset:offset + limit],
+            "total": len(matched),
+            "facets": {facet: dict(sorted(counts.items())) for facet, counts in facet_counts.items()}
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "products": len(self._corpus.products),
+            "terms": len(self._corpus.postings),
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+        }
+
+product_search = ProductSearchIndex()
+
+# Order Placement Utility Functions
+ORDER_RESERVATION_TIMEOUT = float(os.environ.get('ORDER_RESERVATION_TIMEOUT', '120'))
+ORDER_RECOVERY_INTERVAL = float(os.environ.get('ORDER_RECOVERY_INTERVAL', '60'))
+
+class InsufficientStockError(Exception):
+    def __init__(self, product_id: str):
+        super().__init__(f"Insufficient stock for product {product_id}")
+        self.product_id = product_id
+
+async def next_order_number() -> str:
+    """Collision-free order number from a per-day counter, e.g. FG2025030100042"""
+    day = datetime.now(timezone.utc).strftime("%Y%m%d")
+    counter = await db.counters.find_one_and_update(
+        {"_id": f"order_number:{day}"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return f"FG{day}{counter['seq']:05d}"
+
+async def reserve_stock(order_id: str, quantities: Dict[str, int]):
+    """Take stock for every product of the order, or none of it
+
+    Each reservation is a conditional $inc that also records the order on the
+    product, so it is applied at most once and can be found again by the
+    compensation step or the recovery sweep after a crash.
+    """
+    reserved: Dict[str, int] = {}
+    try:
+        for product_id, quantity in quantities.items():
+            result = await db.products.update_one(
+                {
+                    "id": product_id,
+                    "is_available": True,
+                    "stock_quantity": {"$gte": quantity},
+                    "reservations.order_id": {"$ne": order_id}
+                },
+                {
+                    "$inc": {"stock_quantity": -quantity},
+                    "$push": {"reservations": {
+                        "order_id": order_id,
+                        "quantity": quantity,
+                        "reserved_at": datetime.now(timezone.utc).isoformat()
+                    }}
+                }
+            )
+            if result.modified_count == 0:
+                raise InsufficientStockError(product_id)
+            reserved[product_id] = quantity
+    except Exception:
+        await release_stock(order_id, reserved)
+        raise
+
+async def release_stock(order_id: str, quantities: Dict[str, int]):
+    """Compensation: give reserved stock back; a reservation is only ever returned once"""
+    for product_id, quantity in quantities.items():
+        await db.products.update_one(
+            {"id": product_id, "reservations.order_id": order_id},
+            {"$inc": {"stock_quantity": quantity}, "$pull": {"reservations": {"order_id": order_id}}}
+        )
+
+async def commit_stock(order_id: str, product_ids: List[str]):
+    """Make the order's reservations final by dropping their markers"""
+    await db.products.update_many(
+        {"id": {"$in": product_ids}},
+        {"$pull": {"reservations": {"order_id": order_id}}}
+    )
+
+async def recover_order_reservations() -> Dict[str, int]:
+    """Settle reservations left behind by interrupted checkouts
+
+    Orders still reserving after ORDER_RESERVATION_TIMEOUT are failed and
+    their stock returned; reservations of placed orders are committed.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=ORDER_RESERVATION_TIMEOUT)).isoformat()
+    products = await db.products.find(
+        {"reservations.reserved_at": {"$lt": cutoff}}, {"_id": 0, "id": 1, "reservations": 1}
+    ).to_list(None)
+    
+    reservations_by_order: Dict[str, Dict[str, int]] = {}
+    for product in products:
+        for reservation in product.get("reservations", []):
+            if reservation["reserved_at"] < cutoff:
+                reservations_by_order.setdefault(reservation["order_id"], {})[product["id"]] = reservation["quantity"]
+    
+    orders = await db.orders.find(
+        {"id": {"$in": list(reservations_by_order)}}, {"_id": 0, "id": 1, "status": 1}
+    ).to_list(None)
+    status_by_order = {order["id"]: order["status"] for order in orders}
+    
+    released = committed = 0
+    for order_id, quantities in reservations_by_order.items():
+        status = status_by_order.get(order_id)
+        if status == "reserving":
+            # Fail the order first so a checkout that is still running cannot confirm it;
+            # if the checkout confirmed it in the meantime, its stock stays taken
+            result = await db.orders.update_one(
+                {"id": order_id, "status": "reserving"},
+                {"$set": {"status": "failed", "failure_reason": "reservation_timeout"}}
+            )
+            if result.modified_count == 0:
+                order = await db.orders.find_one({"id": order_id}, {"_id": 0, "status": 1})
+                status = order["status"] if order else None
+            else:
+                status = "failed"
+        if status in (None, "failed"):
+            await release_stock(order_id, quantities)
+            released += 1
+        else:
+            await commit_stock(order_id, list(quantities))
+            committed += 1
+    
+    # Orders that never got as far as reserving anything
+    stale = await db.orders.update_many(
+        {"status": "reserving", "created_at": {"$lt": cutoff}},
+        {"$set": {"status": "failed", "failure_reason": "reservation_timeout"}}
+    )
+    if reservations_by_order:
+        product_cache.invalidate([product["id"] for product in products])
+    return {"released": released, "committed": committed, "failed_orders": stale.modified_count}
+
+async def dedupe_order_numbers() -> int:
+    """Renumber orders sharing a legacy FG{timestamp} number so order_number can be unique
+
+    The oldest order keeps the number; later ones get a -2, -3, ... suffix,
+    and orders without a number get a fresh one.
+    """
+    duplicates = await db.orders.aggregate([
+        {"$sort": {"created_at": 1}},
+        {"$group": {"_id": "$order_number", "ids": {"$push": "$id"}, "count": {"$sum": 1}}},
+        {"$match": {"$or": [{"count": {"$gt": 1}}, {"_id": None}]}}
+    ], allowDiskUse=True).to_list(None)
+    
+    renumbered = 0
+    for duplicate in duplicates:
+        if duplicate["_id"] is None:
+            updates = [(order_id, await next_order_number()) for order_id in duplicate["ids"]]
+        else:
+            updates = [(order_id, f"{duplicate['_id']}-{position}") for position, order_id in enumerate(duplicate["ids"][1:], 2)]
+        for order_id, order_number in updates:
+            await db.orders.update_one({"id": order_id}, {"$set": {"order_number": order_number}})
+            renumbered += 1
+    if renumbered:
+        logger.info(f"Renumbered {renumbered} orders with duplicate or missing order numbers")
+    return renumbered
+
+async def run_order_recovery():
+    """Background loop that periodically settles interrupted checkouts"""
+    while True:
+        try:
+            await recover_order_reservations()
+        except Exception as e:
+            logger.warning(f"Order reservation recovery failed: {str(e)}")
+        await asyncio.sleep(ORDER_RECOVERY_INTERVAL)
+
+def order_response(order: Dict[str, Any]) -> OrderResponse:
+    return OrderResponse(
+        id=order["id"],
+        order_number=order["order_number"],
+        items=order["items"],
+        total_amount=order["total_amount"],
+        status=order["status"],
+        payment_status=order["payment_status"],
+        created_at=order["created_at"]
+    )
+
+async def replay_order(user_id: str, idempotency_key: str) -> Optional[OrderResponse]:
+    """Result of an earlier request with the same idempotency key, if there was one"""
+    order = await db.orders.find_one({"user_id": user_id, "idempotency_key": idempotency_key}, {"_id": 0})
+    if not order:
+        return None
+    if order["status"] == "reserving":
+        raise HTTPException(status_code=409, detail="This order is still being placed")
+    if order["status"] == "failed":
+        raise HTTPException(status_code=409, detail=order.get("failure_detail") or "Order could not be placed")
+    return order_response(order)
+
+# Cart Utility Functions
+CART_MAX_LINES = 100
+
+def cart_line_key(user_id: str, product_id: str, selected_size: Optional[str], selected_color: Optional[str]) -> Dict[str, Any]:
+    """Filter on the unique (user, product, size, color) key of a cart line"""
+    return {"user_id": user_id, "product_id": product_id, "selected_size": selected_size, "selected_color": selected_color}
+
+def cart_line_increment(quantity: int, price: float) -> Dict[str, Any]:
+    """Upsert update adding quantity to a cart line, creating the line if needed"""
+    return {
+        "$inc": {"quantity": quantity},
+        "$setOnInsert": {
+            "id": str(uuid.uuid4()),
+            "price_at_time": price,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+    }
+
+async def add_cart_quantity(key: Dict[str, Any], quantity: int, price: float):
+    """Add to a cart line in one round trip, creating it if it does not exist"""
+    try:
+        await db.cart_items.update_one(key, cart_line_increment(quantity, price), upsert=True)
+    except DuplicateKeyError:
+        # Lost an insert race against a concurrent upsert; the line exists now
+        await db.cart_items.update_one(key, {"$inc": {"quantity": quantity}})
+
+async def merge_duplicate_cart_lines() -> int:
+    """Fold cart lines that share a (user, product, size, color) key into the oldest one"""
+    duplicates = await db.cart_items.aggregate([
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {field: f"${field}" for field in ("user_id", "product_id", "selected_size", "selected_color")},
+            "ids": {"$push": "$id"},
+            "quantity": {"$sum": "$quantity"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True).to_list(None)
+    
+    merged = 0
+    for duplicate in duplicates:
+        keep, *extra = duplicate["ids"]
+        await db.cart_items.update_one({"id": keep}, {"$set": {"quantity": duplicate["quantity"]}})
+        result = await db.cart_items.delete_many({"id": {"$in": extra}})
+        merged += result.deleted_count
+    if merged:
+        logger.info(f"Merged {merged} duplicate cart lines")
+    return merged
+
 # Frage Market API Routes
 @api_router.get("/market/products")
 async def get_products(
+    request: Request,
     category: Optional[str] = None,
+    subcategory: Optional[str] = None,
+    size: Optional[str] = None,
+    color: Optional[str] = None,
     search: Optional[str] = None,
     page: int = 1,
     limit: int = 20,
-    sort_by: str = "created_at",
-    sort_order: str = "desc"
+    sort_by: Optional[str] = None,
+    sort_order: str = "desc",
+    cursor: Optional[str] = None,
+    include_total: bool = True
 ):
-    """Get products with filtering and pagination"""
-    try:
+    """Get products with filtering and pagination; searches go through the in-memory index"""
+    if sort_by is not None and sort_by not in PRODUCT_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort_by. Must be one of: {PRODUCT_SORT_FIELDS}")
+    if page < 1 or not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="page must be >= 1 and limit between 1 and 100")
+    filters = {
+        "category": (category or "").strip() or None,
+        "subcategory": (subcategory or "").strip() or None,
+        "size": (size or "").strip() or None,
+        "color": (color or "").strip() or None
+    }
+    search = (search or "").strip()
+    
+    async def load_search():
+        result = await product_search.search(
+            search, filters, sort_by or "relevance", sort_order == "desc", (page - 1) * limit, limit
+        )
+        products = await product_cache.get_many(result["ids"])
+        return {
+            "products": [products[product_id] for product_id in result["ids"] if product_id in products],
+            "facets": result["facets"],
+            "pagination": {
+                "page": page,
+                "limit": limit,
+                "total": result["total"],
+                "total_pages": total_pages(result["total"], limit),
+                "next_cursor": None,
+                "has_more": page * limit < result["total"]
+            }
+        }
+    
+    async def load_listing():
         # Build query
         query = {"is_available": True}
-        if category:
-            query["category"] = category
-        if search:
-            query["$or"] = [
-                {"name": {"$regex": search, "$options": "i"}},
-                {"description": {"$regex": search, "$options": "i"}},
-                {"tags": {"$in": [search]}}
-            ]
-        
-        # Calculate skip
-        skip = (page - 1) * limit
+        for facet, value in filters.items():
+            if value:
+                query[PRODUCT_SEARCH_FACETS[facet]] = value
         
         # Sort configuration
+        sort_field = sort_by if sort_by and sort_by != "relevance" else "created_at"
         sort_direction = -1 if sort_order == "desc" else 1
         
         # Get products
-        products = await db.products.find(query).sort(sort_by, sort_direction).skip(skip).limit(limit).to_list(limit)
-        total_count = await db.products.count_documents(query)
-        
-        # Clean products
-        for product in products:
-            if '_id' in product:
-                del product['_id']
+        result = await keyset_paginate(db.products, query, sort_field, sort_direction, limit, page, cursor, include_total)
+        products = result["items"]
         
         return {
             "products": [ProductResponse(**product) for product in products],
             "pagination": {
                 "page": page,
                 "limit": limit,
-                "total": total_count,
-                "total_pages": (total_count + limit - 1) // limit
+                "total": result["total"],
+                "total_pages": total_pages(result["total"], limit),
+                "next_cursor": result["next_cursor"],
+                "has_more": result["has_more"]
             }
         }
+    
+    try:
+        key = catalog_key(
+            "products", search=search, page=page, limit=limit, sort_by=sort_by, sort_order=sort_order,
+            cursor=cursor, include_total=include_total, **filters
+        )
+        return await cached_catalog_response(request, key, load_search if search else load_listing)
         
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=f"Error fetching products: {str(e)}")
 
 @api_router.get("/market/products/{product_id}")
-async def get_product(product_id: str):
+async def get_product(product_id: str, request: Request):
     """Get single product details"""
     try:
-        product = await db.products.find_one({"id": product_id, "is_available": True})
-        if not product:
+        product = await product_cache.get(product_id)
+        if not product or not product.is_available:
             raise HTTPException(status_code=404, detail="Product not found")
         
-        if '_id' in product:
-            del product['_id']
-        
-        return ProductResponse(**product)
+        # Already served from product_cache, so only the conditional GET is added here
+        body = json.dumps(jsonable_encoder(product), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return conditional_json_response(request, body, f'"{hashlib.sha1(body).hexdigest()}"')
         
     except Exception as e:
         if isinstance(e, HTTPException):
@@ -4742,42 +8280,33 @@ async def get_product(product_id: str):
         raise HTTPException(status_code=500, detail=f"Error fetching product: {str(e)}")
 
 @api_router.get("/market/categories")
-async def get_categories():
+async def get_categories(request: Request):
     """Get available product categories"""
+    async def load():
+        categories = await db.products.aggregate([
+            {"$match": {"is_available": True}},
+            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}}
+        ]).to_list(None)
+        return {"categories": [{"name": category["_id"], "count": category["count"]} for category in categories]}
+    
     try:
-        categories = await db.products.distinct("category", {"is_available": True})
-        
-        # Get category counts
-        category_counts = {}
-        for category in categories:
-            count = await db.products.count_documents({"category": category, "is_available": True})
-            category_counts[category] = count
-        
-        return {
-            "categories": [
-                {"name": cat, "count": category_counts[cat]} 
-                for cat in categories
-            ]
-        }
+        return await cached_catalog_response(request, catalog_key("categories"), load)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching categories: {str(e)}")
 
 @api_router.get("/market/featured")
-async def get_featured_products(limit: int = 8):
+async def get_featured_products(request: Request, limit: int = 8):
     """Get featured products"""
-    try:
-        products = await db.products.find({
-            "is_available": True, 
-            "is_featured": True
-        }).limit(limit).to_list(limit)
-        
-        # Clean products
-        for product in products:
-            if '_id' in product:
-                del product['_id']
-        
+    async def load():
+        products = await db.products.find(
+            {"is_available": True, "is_featured": True}, PRODUCT_RESPONSE_PROJECTION
+        ).limit(limit).to_list(limit)
         return {"products": [ProductResponse(**product) for product in products]}
+    
+    try:
+        return await cached_catalog_response(request, catalog_key("featured", limit=limit), load)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching featured products: {str(e)}")
@@ -4786,40 +8315,17 @@ async def get_featured_products(limit: int = 8):
 async def add_to_cart(cart_request: AddToCartRequest, current_user: UserResponse = Depends(get_current_user)):
     """Add item to cart"""
     try:
+        if cart_request.quantity < 1:
+            raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+        
         # Check if product exists and is available
-        product = await db.products.find_one({"id": cart_request.product_id, "is_available": True})
-        if not product:
+        product = await product_cache.get(cart_request.product_id)
+        if not product or not product.is_available:
             raise HTTPException(status_code=404, detail="Product not found")
         
-        # Check if item already exists in cart
-        existing_item = await db.cart_items.find_one({
-            "user_id": current_user.id,
-            "product_id": cart_request.product_id,
-            "selected_size": cart_request.selected_size,
-            "selected_color": cart_request.selected_color
-        })
-        
-        if existing_item:
-            # Update quantity
-            new_quantity = existing_item["quantity"] + cart_request.quantity
-            await db.cart_items.update_one(
-                {"id": existing_item["id"]},
-                {"$set": {"quantity": new_quantity}}
-            )
-        else:
-            # Create new cart item
-            cart_item = CartItem(
-                user_id=current_user.id,
-                product_id=cart_request.product_id,
-                quantity=cart_request.quantity,
-                selected_size=cart_request.selected_size,
-                selected_color=cart_request.selected_color,
-                price_at_time=product["price"]
-            )
-            
-            cart_dict = cart_item.dict()
-            cart_dict['created_at'] = cart_dict['created_at'].isoformat()
-            await db.cart_items.insert_one(cart_dict)
+        # Increments the existing line for this variant or creates it
+        key = cart_line_key(current_user.id, cart_request.product_id, cart_request.selected_size, cart_request.selected_color)
+        await add_cart_quantity(key, cart_request.quantity, product.price)
         
         return {"message": "Item added to cart successfully"}
         
@@ -4828,27 +8334,80 @@ async def add_to_cart(cart_request: AddToCartRequest, current_user: UserResponse
             raise e
         raise HTTPException(status_code=500, detail=f"Error adding to cart: {str(e)}")
 
+@api_router.post("/market/cart/merge")
+async def merge_cart(merge_request: MergeCartRequest, current_user: UserResponse = Depends(get_current_user)):
+    """Add a guest cart to the user's cart after login"""
+    try:
+        if len(merge_request.items) > CART_MAX_LINES:
+            raise HTTPException(status_code=400, detail=f"A cart can hold at most {CART_MAX_LINES} lines")
+        
+        products = await product_cache.get_many([item.product_id for item in merge_request.items])
+        quantities: Dict[tuple, int] = {}
+        skipped = []
+        for item in merge_request.items:
+            product = products.get(item.product_id)
+            if not product or not product.is_available or item.quantity < 1:
+                skipped.append(item.product_id)
+                continue
+            variant = (item.product_id, item.selected_size, item.selected_color)
+            quantities[variant] = quantities.get(variant, 0) + item.quantity
+        
+        operations = [
+            UpdateOne(
+                cart_line_key(current_user.id, *variant),
+                cart_line_increment(quantity, products[variant[0]].price),
+                upsert=True
+            )
+            for variant, quantity in quantities.items()
+        ]
+        if operations:
+            try:
+                await db.cart_items.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # Lines a concurrent request created first: add to them instead
+                retry = [error["index"] for error in e.details["writeErrors"] if error["code"] == 11000]
+                if len(retry) < len(e.details["writeErrors"]):
+                    raise
+                variants = list(quantities)
+                await db.cart_items.bulk_write([
+                    UpdateOne(cart_line_key(current_user.id, *variants[index]), {"$inc": {"quantity": quantities[variants[index]]}})
+                    for index in retry
+                ], ordered=False)
+        
+        return {
+            "message": "Cart merged successfully",
+            "merged_items": len(operations),
+            "skipped_product_ids": skipped
+        }
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error merging cart: {str(e)}")
+
 @api_router.get("/market/cart")
 async def get_cart(current_user: UserResponse = Depends(get_current_user)):
     """Get user's cart"""
     try:
-        cart_items = await db.cart_items.find({"user_id": current_user.id}).to_list(100)
+        cart_items = await db.cart_items.find({"user_id": current_user.id}, {"_id": 0}).to_list(100)
+        
+        # Product details for the whole cart, from the cache or one $in query
+        products = await product_cache.get_many([cart_item["product_id"] for cart_item in cart_items])
         
         items = []
         total_amount = 0
         total_items = 0
         
         for cart_item in cart_items:
-            # Get product details
-            product = await db.products.find_one({"id": cart_item["product_id"]})
-            if product and product.get("is_available", True):
+            product = products.get(cart_item["product_id"])
+            if product and product.is_available:
                 item_total = cart_item["price_at_time"] * cart_item["quantity"]
                 total_amount += item_total
                 total_items += cart_item["quantity"]
                 
                 items.append({
                     "cart_item_id": cart_item["id"],
-                    "product": ProductResponse(**{k: v for k, v in product.items() if k != '_id'}),
+                    "product": product,
                     "quantity": cart_item["quantity"],
                     "selected_size": cart_item.get("selected_size"),
                     "selected_color": cart_item.get("selected_color"),
@@ -4865,6 +8424,46 @@ async def get_cart(current_user: UserResponse = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching cart: {str(e)}")
 
+@api_router.put("/market/cart/{cart_item_id}")
+async def update_cart_item(cart_item_id: str, update_request: UpdateCartRequest, current_user: UserResponse = Depends(get_current_user)):
+    """Set the quantity of a cart item, optionally switching its size or color"""
+    try:
+        if update_request.quantity < 1:
+            raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+        
+        variant_fields = {
+            field: getattr(update_request, field)
+            for field in ("selected_size", "selected_color")
+            if field in update_request.model_fields_set
+        }
+        line_filter = {"id": cart_item_id, "user_id": current_user.id}
+        try:
+            result = await db.cart_items.update_one(line_filter, {"$set": {"quantity": update_request.quantity, **variant_fields}})
+        except DuplicateKeyError:
+            # The user already has a line for the new size/color: move the quantity onto it
+            cart_item = await db.cart_items.find_one(line_filter, {"_id": 0})
+            if not cart_item:
+                raise HTTPException(status_code=404, detail="Cart item not found")
+            target = cart_line_key(
+                current_user.id,
+                cart_item["product_id"],
+                variant_fields.get("selected_size", cart_item.get("selected_size")),
+                variant_fields.get("selected_color", cart_item.get("selected_color"))
+            )
+            await db.cart_items.update_one(target, {"$inc": {"quantity": update_request.quantity}})
+            await db.cart_items.delete_one(line_filter)
+            return {"message": "Cart item merged into existing item"}
+        
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="Cart item not found")
+        
+        return {"message": "Cart item updated"}
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error updating cart item: {str(e)}")
+
 @api_router.delete("/market/cart/{cart_item_id}")
 async def remove_from_cart(cart_item_id: str, current_user: UserResponse = Depends(get_current_user)):
     """Remove item from cart"""
@@ -4885,9 +8484,19 @@ async def remove_from_cart(cart_item_id: str, current_user: UserResponse = Depen
         raise HTTPException(status_code=500, detail=f"Error removing from cart: {str(e)}")
 
 @api_router.post("/market/orders")
-async def create_order(order_request: CreateOrderRequest, current_user: UserResponse = Depends(get_current_user)):
-    """Create order from cart"""
+async def create_order(
+    order_request: CreateOrderRequest,
+    current_user: UserResponse = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Create order from cart, reserving stock for every item"""
     try:
+        idempotency_key = idempotency_key or order_request.idempotency_key
+        if idempotency_key:
+            replayed = await replay_order(current_user.id, idempotency_key)
+            if replayed:
+                return replayed
+        
         # Get cart items
         cart_items = await db.cart_items.find({"user_id": current_user.id}).to_list(100)
         
@@ -4895,32 +8504,43 @@ async def create_order(order_request: CreateOrderRequest, current_user: UserResp
             raise HTTPException(status_code=400, detail="Cart is empty")
         
         # Prepare order items
+        products = await product_cache.get_many([cart_item["product_id"] for cart_item in cart_items])
         order_items = []
+        ordered_cart_item_ids = []
+        quantities: Dict[str, int] = {}
         total_amount = 0
         
         for cart_item in cart_items:
-            product = await db.products.find_one({"id": cart_item["product_id"]})
-            if product and product.get("is_available", True):
+            product = products.get(cart_item["product_id"])
+            if product and product.is_available:
                 item_total = cart_item["price_at_time"] * cart_item["quantity"]
                 total_amount += item_total
                 
                 order_items.append({
                     "product_id": cart_item["product_id"],
-                    "product_name": product["name"],
+                    "product_name": product.name,
                     "quantity": cart_item["quantity"],
                     "selected_size": cart_item.get("selected_size"),
                     "selected_color": cart_item.get("selected_color"),
                     "price_at_time": cart_item["price_at_time"],
                     "item_total": item_total
                 })
+                ordered_cart_item_ids.append(cart_item["id"])
+                quantities[cart_item["product_id"]] = quantities.get(cart_item["product_id"], 0) + cart_item["quantity"]
+        
+        if not order_items:
+            raise HTTPException(status_code=400, detail="No available products in cart")
         
-        # Create order
+        # Record the attempt before touching stock so an interrupted checkout can be recovered
         order = Order(
             user_id=current_user.id,
+            order_number=await next_order_number(),
+            idempotency_key=idempotency_key,
             items=order_items,
             total_amount=total_amount,
             shipping_address=order_request.shipping_address,
             contact_info=order_request.contact_info,
+            status="reserving",
             payment_method=order_request.payment_method,
             notes=order_request.notes
         )
@@ -4928,20 +8548,42 @@ async def create_order(order_request: CreateOrderRequest, current_user: UserResp
         order_dict = order.dict()
         order_dict['created_at'] = order_dict['created_at'].isoformat()
         order_dict['updated_at'] = order_dict['updated_at'].isoformat()
-        await db.orders.insert_one(order_dict)
+        try:
+            await db.orders.insert_one(order_dict)
+        except DuplicateKeyError:
+            # A concurrent retry with the same idempotency key got there first
+            replayed = await replay_order(current_user.id, idempotency_key) if idempotency_key else None
+            if replayed:
+                return replayed
+            raise
         
-        # Clear cart
-        await db.cart_items.delete_many({"user_id": current_user.id})
+        try:
+            await reserve_stock(order.id, quantities)
+        except InsufficientStockError as e:
+            product_name = products[e.product_id].name
+            detail = f"Insufficient stock: {product_name}"
+            await db.orders.update_one(
+                {"id": order.id},
+                {"$set": {"status": "failed", "failure_reason": "insufficient_stock", "failure_detail": detail}}
+            )
+            product_cache.invalidate([e.product_id])
+            raise HTTPException(status_code=409, detail=detail)
         
-        return OrderResponse(
-            id=order.id,
-            order_number=order.order_number,
-            items=order_items,
-            total_amount=total_amount,
-            status=order.status,
-            payment_status=order.payment_status,
-            created_at=order.created_at
+        placed = await db.orders.update_one(
+            {"id": order.id, "status": "reserving"},
+            {"$set": {"status": "pending", "updated_at": datetime.now(timezone.utc).isoformat()}}
         )
+        if placed.modified_count == 0:
+            # The recovery sweep timed this checkout out and is returning its stock
+            raise HTTPException(status_code=409, detail="Order could not be placed, please try again")
+        await commit_stock(order.id, list(quantities))
+        product_cache.invalidate(list(quantities))
+        
+        # Clear only what was ordered; items added meanwhile stay in the cart
+        await db.cart_items.delete_many({"user_id": current_user.id, "id": {"$in": ordered_cart_item_ids}})
+        
+        order_dict["status"] = "pending"
+        return order_response(order_dict)
         
     except Exception as e:
         if isinstance(e, HTTPException):
@@ -4952,7 +8594,9 @@ async def create_order(order_request: CreateOrderRequest, current_user: UserResp
 async def get_orders(current_user: UserResponse = Depends(get_current_user)):
     """Get user's orders"""
     try:
-        orders = await db.orders.find({"user_id": current_user.id}).sort("created_at", -1).to_list(50)
+        orders = await db.orders.find(
+            {"user_id": current_user.id, "status": {"$nin": ["reserving", "failed"]}}
+        ).sort("created_at", -1).to_list(50)
         
         # Clean orders
         for order in orders:
@@ -5144,6 +8788,8 @@ async def init_sample_data():
             product_dict['created_at'] = product_dict['created_at'].isoformat()
             product_dict['updated_at'] = product_dict['updated_at'].isoformat()
             await db.products.insert_one(product_dict)
+            product_search.upsert(product_dict)
+        invalidate_catalog()
         
         return {"message": f"Successfully created {len(sample_products)} sample products"}
         
@@ -5173,7 +8819,7 @@ async def create_admin_with_role(admin_data: AdminCreateWithRole, current_admin:
         admin = Admin(
             username=admin_data.username,
             email=admin_data.email,
-            password_hash=hash_password(admin_data.password),
+            password_hash=await hash_password(admin_data.password),
             role=admin_data.role
         )
         
@@ -5232,7 +8878,7 @@ async def setup_default_admin_accounts(current_admin: AdminResponse = Depends(ge
             admin = Admin(
                 username=admin_data["username"],
                 email=admin_data["email"],
-                password_hash=hash_password(admin_data["password"]),
+                password_hash=await hash_password(admin_data["password"]),
                 role=admin_data["role"]
             )
             
@@ -5274,7 +8920,7 @@ async def create_admin(admin_data: AdminCreate):
     admin = Admin(
         username=admin_data.username,
         email=admin_data.email,
-        password_hash=hash_password(admin_data.password)
+        password_hash=await hash_password(admin_data.password)
     )
     
     # Insert admin
@@ -5292,14 +8938,16 @@ async def create_admin(admin_data: AdminCreate):
 @api_router.post("/admin/login")
 async def admin_login(login_data: AdminLogin):
     admin = await db.admins.find_one({"username": login_data.username})
-    if not admin or not verify_password(login_data.password, admin['password_hash']):
+    if not admin or not await verify_password(login_data.password, admin['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    run_in_background(rehash_password_if_needed("admins", admin['id'], login_data.password, admin['password_hash']))
     
     # Update last login
     await db.admins.update_one(
         {"id": admin['id']},
         {"$set": {"last_login": datetime.now(timezone.utc)}}
     )
+    principal_cache.invalidate("admin", admin['id'])
     
     token = create_admin_jwt_token(admin['id'], admin['username'])
     
@@ -5315,13 +8963,13 @@ async def get_admin_profile(current_admin: AdminResponse = Depends(get_current_a
 
 # News Management Routes
 @api_router.get("/news")
-async def get_news_articles(category: Optional[str] = None, published: bool = True, skip: int = 0, limit: int = 10):
+async def get_news_articles(category: Optional[str] = None, published: bool = True, skip: int = 0, limit: int = 10, cursor: Optional[str] = None):
     query = {"published": published} if published else {}
     if category and category != "전체":
         query["category"] = category
     
-    articles = await db.news_articles.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    return {"articles": articles}
+    result = await keyset_paginate(db.news_articles, query, "created_at", -1, limit, cursor=cursor, include_total=False, offset=skip)
+    return {"articles": result["items"], "next_cursor": result["next_cursor"], "has_more": result["has_more"]}
 
 @api_router.get("/news/{article_id}")
 async def get_news_article(article_id: str):
@@ -5374,19 +9022,20 @@ async def delete_news_article(article_id: str, current_admin: AdminResponse = De
     return {"message": "Article deleted successfully"}
 
 @api_router.get("/admin/news")
-async def get_admin_news_articles(current_admin: AdminResponse = Depends(get_current_admin), category: Optional[str] = None, skip: int = 0, limit: int = 20):
+async def get_admin_news_articles(current_admin: AdminResponse = Depends(get_current_admin), category: Optional[str] = None, skip: int = 0, limit: int = 20, cursor: Optional[str] = None, include_total: bool = True):
     query = {}
     if category and category != "전체":
         query["category"] = category
     
-    articles = await db.news_articles.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    total_count = await db.news_articles.count_documents(query)
+    result = await keyset_paginate(db.news_articles, query, "created_at", -1, limit, cursor=cursor, include_total=include_total, offset=skip)
     
     return {
-        "articles": articles,
-        "total": total_count,
+        "articles": result["items"],
+        "total": result["total"],
         "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": result["next_cursor"],
+        "has_more": result["has_more"]
     }
 
 # File Upload Routes
@@ -5456,27 +9105,12 @@ async def get_members(
     status: str = None,
     page: int = 1,
     pageSize: int = 50,
-    sort: str = "joinedAt:desc"
+    sort: str = "joinedAt:desc",
+    cursor: Optional[str] = None,
+    includeTotal: bool = True
 ):
-    # Build MongoDB query
-    mongo_query = {}
-    
-    # Text search across multiple fields
-    if query:
-        mongo_query["$or"] = [
-            {"name": {"$regex": query, "$options": "i"}},
-            {"phone": {"$regex": query, "$options": "i"}},
-            {"email": {"$regex": query, "$options": "i"}}
-        ]
-    
-    # Filter by status
-    if status:
-        mongo_query["status"] = status
-    
-    # Build parent query for branch filtering
-    parent_query = {}
-    if branch:
-        parent_query["branch"] = branch
+    # Search, filters and paging run as one indexed query
+    search_query = build_member_search_query(query, branch, status)
     
     # Parse sort parameter
     sort_field, sort_order = sort.split(":")
@@ -5490,85 +9124,69 @@ async def get_members(
     }
     sort_field = sort_mapping.get(sort_field, "created_at")
     
-    # Calculate skip for pagination
-    skip = (page - 1) * pageSize
-    
-    # Get users with parent information
     try:
-        # For now, use simpler approach since aggregation might be complex
-        users = await db.users.find(mongo_query).sort(sort_field, sort_direction).skip(skip).limit(pageSize).to_list(pageSize)
+        result = await keyset_paginate(
+            db.member_search, search_query, sort_field, sort_direction, pageSize, page, cursor, includeTotal,
+            projection={"_id": 0, "tokens": 0, "search_text": 0}
+        )
         
-        members = []
-        for user in users:
-            # Clean user data
-            if '_id' in user:
-                del user['_id']
-                
-            # Get parent info
-            parent = await db.parents.find_one({"user_id": user["id"]})
-            if not parent:
-                continue
-                
-            # Clean parent data
-            if '_id' in parent:
-                del parent['_id']
-                
-            # Apply branch filter
-            if branch and parent.get("branch") != branch:
-                continue
-                
-            # Get students
-            students = await db.students.find({"parent_id": parent["id"]}).to_list(10)
-            
-            # Clean student data
-            for student in students:
-                if '_id' in student:
-                    del student['_id']
-            
-            # Get additional search match for students
-            if query:
-                student_match = any(
-                    query.lower() in student.get("name", "").lower() 
-                    for student in students
-                )
-                user_match = (
-                    query.lower() in user.get("name", "").lower() or
-                    query.lower() in user.get("phone", "").lower() or
-                    query.lower() in user.get("email", "").lower()
-                )
-                if not (user_match or student_match):
-                    continue
-            
-            member = MemberListResponse(
-                id=user["id"],
-                parent_name=user.get("name", ""),
-                phone=user.get("phone", ""),
-                email=user.get("email", ""),
-                students=[{"name": s.get("name", ""), "grade": s.get("grade", "")} for s in students],
-                branch=parent.get("branch", ""),
-                household_token=user.get("household_token", ""),
-                joined_at=user.get("created_at"),
-                last_login=user.get("last_login_at"),
-                status=user.get("status", "active")
+        members = [
+            MemberListResponse(
+                id=row["id"],
+                parent_name=row.get("name", ""),
+                phone=row.get("phone", ""),
+                email=row.get("email", ""),
+                students=row.get("students", []),
+                branch=row.get("branch", ""),
+                household_token=row.get("household_token", ""),
+                joined_at=row.get("created_at"),
+                last_login=row.get("last_login_at"),
+                status=row.get("status", "active")
             )
-            members.append(member)
-        
-        # Get total count
-        total_count = await db.users.count_documents(mongo_query)
+            for row in result["items"]
+        ]
         
         return {
             "members": [m.dict() for m in members],
             "pagination": {
                 "page": page,
                 "pageSize": pageSize,
-                "total": total_count,
-                "totalPages": (total_count + pageSize - 1) // pageSize
+                "total": result["total"],
+                "totalPages": total_pages(result["total"], pageSize),
+                "nextCursor": result["next_cursor"],
+                "hasMore": result["has_more"]
             }
         }
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         logging.error(f"Error in get_members: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@api_router.get("/admin/members/export")
+async def export_members(
+    current_admin: AdminResponse = Depends(get_current_admin),
+    format: str = "csv",
+    query: str = None,
+    branch: str = None,
+    status: str = None
+):
+    """Stream the members matching the list filters as CSV or XLSX"""
+    search_query = build_member_search_query(query, branch, status)
+    response = export_response(format, "members_export", MEMBER_EXPORT_COLUMNS, member_export_batches(search_query))
+    
+    # Log audit action
+    await log_audit(
+        actor_user_id=current_admin.id,
+        action="EXPORT",
+        target_type="User",
+        target_id="filter",
+        meta={"admin_username": current_admin.username, "format": format,
+              "filters": {"query": query, "branch": branch, "status": status}}
+    )
+    
+    return response
+
 @api_router.get("/admin/members/{user_id}")
 async def get_member_details(user_id: str, current_admin: AdminResponse = Depends(get_current_admin)):
     # Get user
@@ -5626,34 +9244,25 @@ async def get_member_details(user_id: str, current_admin: AdminResponse = Depend
 
 @api_router.post("/admin/members/bulk/export")
 async def bulk_export_members(user_ids: List[str], current_admin: AdminResponse = Depends(get_current_admin)):
-    import csv
-    import io
-    from datetime import datetime
-    
     # Get member data
     members_data = []
-    for user_id in user_ids:
-        user = await db.users.find_one({"id": user_id})
-        if not user:
-            continue
-            
-        parent = await db.parents.find_one({"user_id": user_id})
-        students = await db.students.find({"parent_id": parent["id"] if parent else ""}).to_list(10)
-        
-        members_data.append({
-            "Parent Name": user.get("name", ""),
-            "Email": user.get("email", ""),
-            "Phone": user.get("phone", ""),
-            "Branch": parent.get("branch", "") if parent else "",
-            "Students": "; ".join([s.get("name", "") for s in students]),
-            "Status": user.get("status", "active"),
-            "Joined At": user.get("created_at", ""),
-            "Last Login": user.get("last_login_at", "")
-        })
+    for batch in chunked(user_ids, BULK_WRITE_CHUNK_SIZE):
+        rows = await db.member_search.find(
+            {"id": {"$in": batch}}, {"_id": 0, "tokens": 0, "search_text": 0}
+        ).to_list(None)
+        rows_by_id = {row["id"]: row for row in rows}
+        # Users the search index doesn't cover yet (no parent record, or not bootstrapped)
+        missing = [user_id for user_id in batch if user_id not in rows_by_id]
+        if missing:
+            rows_by_id.update(await load_member_export_rows(missing))
+        members_data.extend(
+            dict(zip(MEMBER_EXPORT_COLUMNS, member_export_row(rows_by_id[user_id])))
+            for user_id in batch if user_id in rows_by_id
+        )
     
     # Create CSV
     output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=["Parent Name", "Email", "Phone", "Branch", "Students", "Status", "Joined At", "Last Login"])
+    writer = csv.DictWriter(output, fieldnames=MEMBER_EXPORT_COLUMNS)
     writer.writeheader()
     writer.writerows(members_data)
     
@@ -5666,7 +9275,7 @@ async def bulk_export_members(user_ids: List[str], current_admin: AdminResponse
         action="EXPORT",
         target_type="User",
         target_id="bulk",
-        meta={"admin_username": current_admin.username, "export_count": len(user_ids)}
+        meta={"admin_username": current_admin.username, "export_count": len(members_data)}
     )
     
     return {
@@ -5677,8 +9286,11 @@ async def bulk_export_members(user_ids: List[str], current_admin: AdminResponse
 
 @api_router.post("/admin/members/bulk/notify")
 async def bulk_notify_members(request: BulkNotifyRequest, current_admin: AdminResponse = Depends(get_current_admin)):
-    # TODO: Implement AlimTalk integration
-    # For now, just log the action
+    # Queue one message per member; the dispatcher resolves phones and sends in the background
+    await enqueue_notifications([
+        build_notification("member_notice", user_id=user_id, message=request.message)
+        for user_id in dict.fromkeys(request.user_ids)
+    ])
     
     # Log audit action
     await log_audit(
@@ -5694,7 +9306,7 @@ async def bulk_notify_members(request: BulkNotifyRequest, current_admin: AdminRe
     )
     
     return {
-        "message": f"Notification sent to {len(request.user_ids)} members",
+        "message": f"Notification queued for {len(request.user_ids)} members",
         "status": "success"
     }
 
@@ -5705,7 +9317,7 @@ async def reset_member_password(user_id: str, current_admin: AdminResponse = Dep
     import string
     temp_password = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(12))
     
-    hashed_password = hash_password(temp_password)
+    hashed_password = await hash_password(temp_password)
     
     result = await db.users.update_one(
         {"id": user_id},
@@ -5714,6 +9326,7 @@ async def reset_member_password(user_id: str, current_admin: AdminResponse = Dep
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    principal_cache.invalidate("user", user_id)
     
     # Log audit action
     await log_audit(
@@ -5721,7 +9334,8 @@ async def reset_member_password(user_id: str, current_admin: AdminResponse = Dep
         action="RESET_PW",
         target_type="User",
         target_id=user_id,
-        meta={"admin_username": current_admin.username}
+        meta={"admin_username": current_admin.username},
+        durable=True
     )
     
     # TODO: Send email with new password
@@ -5731,6 +9345,21 @@ async def reset_member_password(user_id: str, current_admin: AdminResponse = Dep
         "temporary_password": temp_password  # In production, this should be sent via email
     }
 
+@api_router.post("/admin/members/search-index/rebuild")
+async def rebuild_member_search_index(current_admin: AdminResponse = Depends(get_current_admin)):
+    """Rebuild the member search index from users, parents and students (super admin only)"""
+    try:
+        if current_admin.role != "super_admin":
+            raise HTTPException(status_code=403, detail="Only super admin can rebuild the member search index")
+        
+        result = await rebuild_member_search()
+        return {"message": "Member search index rebuilt successfully", **result}
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"Error rebuilding member search index: {str(e)}")
+
 @api_router.patch("/admin/members/{user_id}/status")
 async def update_member_status(user_id: str, status_data: Dict[str, str], current_admin: AdminResponse = Depends(get_current_admin)):
     status = status_data.get("status")
@@ -5744,6 +9373,9 @@ async def update_member_status(user_id: str, status_data: Dict[str, str], curren
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    # Cut off a disabled account immediately rather than after the cache TTL
+    principal_cache.invalidate("user", user_id)
+    await update_member_search_fields(user_id, {"status": status})
     
     # Log audit action
     action = "ENABLE" if status == "active" else "DISABLE"
@@ -5752,7 +9384,8 @@ async def update_member_status(user_id: str, status_data: Dict[str, str], curren
         action=action,
         target_type="User",
         target_id=user_id,
-        meta={"admin_username": current_admin.username, "new_status": status}
+        meta={"admin_username": current_admin.username, "new_status": status},
+        durable=True
     )
     
     return {"message": f"User status updated to {status}"}
@@ -6127,6 +9760,29 @@ upload_dir = Path("uploads")
 upload_dir.mkdir(exist_ok=True)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+@app.middleware("http")
+async def trace_mongo_queries(request, call_next):
+    """Count the Mongo commands each request issues and aggregate them per route"""
+    if not QUERY_TRACE_ENABLED:
+        return await call_next(request)
+    
+    trace = RequestQueryTrace()
+    token = query_trace.set(trace)
+    started_at = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        query_trace.reset(token)
+    elapsed_ms = (time.perf_counter() - started_at) * 1000
+    route_query_metrics.record(route_template(request), trace, elapsed_ms)
+    
+    if QUERY_TRACE_DEBUG_HEADERS:
+        response.headers["X-Mongo-Commands"] = str(trace.commands)
+        response.headers["X-Mongo-Time-Ms"] = f"{trace.duration_ms:.1f}"
+        response.headers["X-Mongo-Documents"] = str(trace.documents)
+        response.headers["X-Mongo-N-Plus-One"] = str(len(trace.n_plus_one_suspects()))
+    return response
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -6142,6 +9798,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def provision_indexes():
+    if ENSURE_INDEXES_ON_STARTUP:
+        result = await ensure_indexes()
+        logger.info(f"Ensured {len(result['ensured'])} indexes, {len(result['failed'])} failed")
+
+@app.on_event("startup")
+async def start_background_workers():
+    run_in_background(run_flow_event_relay())
+    run_in_background(bootstrap_member_search())
+    run_in_background(student_autocomplete.ensure_loaded())
+    run_in_background(product_search.ensure_loaded())
+    run_in_background(notification_dispatcher.run())
+    run_in_background(audit_log_writer.run())
+    run_in_background(run_order_recovery())
+    if ARCHIVE_ENABLED:
+        run_in_background(run_archival_loop())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in list(background_tasks):
+        task.cancel()
+    await audit_log_writer.flush()
+    password_hasher.shutdown()
     client.close()
\ No newline at end of file
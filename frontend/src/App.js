@@ -1615,7 +1615,7 @@ const Market = () => {
       const params = new URLSearchParams({
         page: currentPage,
         limit: 12,
-        sort_by: 'created_at',
+        sort_by: searchQuery ? 'relevance' : 'created_at',
         sort_order: 'desc'
       });
       
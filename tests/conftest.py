@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+import mongomock
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import ReturnDocument
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "frage_test")
+os.environ.setdefault("ENSURE_INDEXES_ON_STARTUP", "false")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# server.py creates and mounts ./uploads at import time; keep that out of the checkout
+_cwd = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+try:
+    import server  # noqa: E402
+finally:
+    os.chdir(_cwd)
+
+
+_find_and_modify = mongomock.collection.Collection._find_and_modify
+
+
+def _find_and_modify_after_by_id(self, query, projection=None, update=None, upsert=False, sort=None,
+                                 return_document=ReturnDocument.BEFORE, **kwargs):
+    """mongomock re-reads the updated document with the original filter once _id is projected
+    away, so an update that changes a filtered field (e.g. a version guard) returns None;
+    MongoDB returns the updated document
+    """
+    if not projection or return_document is not ReturnDocument.AFTER:
+        return _find_and_modify(self, query, projection, update, upsert, sort, return_document, **kwargs)
+    updated = _find_and_modify(self, query, None, update, upsert, sort, return_document, **kwargs)
+    return self.find_one({"_id": updated["_id"]}, projection) if updated else None
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory database swapped in for server.db, with fresh caches"""
+    monkeypatch.setattr(mongomock.collection.Collection, "_find_and_modify", _find_and_modify_after_by_id)
+    mock_db = AsyncMongoMockClient()["frage_test"]
+    monkeypatch.setattr(server, "db", mock_db)
+    monkeypatch.setattr(server, "product_cache", server.ProductCache())
+    monkeypatch.setattr(server, "flow_registry", server.FlowRegistry(server.FLOW_REGISTRY_TTL))
+    return mock_db
+
+
+@pytest.fixture
+def user():
+    return server.UserResponse(
+        id="user-1",
+        email="parent@example.com",
+        role="parent",
+        status="active",
+        name="Parent",
+        phone="010-0000-0000",
+        household_token="household-1",
+        last_login_at=None,
+        created_at=datetime.now(timezone.utc),
+        email_verified=True
+    )
@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+FLOW = {
+    "flow_key": "kinder_flow",
+    "name": "Kinder",
+    "is_active": True,
+    "steps": [
+        {"key": "seminar", "order": 1},
+        {"key": "application", "order": 2},
+        {"key": "placement", "order": 3}
+    ]
+}
+
+
+def progress_doc(student_id="student-1", **overrides):
+    progress = {
+        "id": f"progress-{student_id}",
+        "student_id": student_id,
+        "household_token": "household-1",
+        "flow_key": FLOW["flow_key"],
+        "current_step": "seminar",
+        "completed_steps": [],
+        "step_data": {},
+        "status": "in_progress",
+        "enrollment_status": "pending",
+        "version": 1,
+        "pending_events": [],
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+    progress.update(overrides)
+    return progress
+
+
+async def seed(db, **overrides):
+    await db.enrollment_flows.insert_one(dict(FLOW))
+    await db.student_enrollment_progress.insert_one(progress_doc(**overrides))
+
+
+async def recorded_event_ids(db, student_id="student-1"):
+    """Ids of events either still in the outbox or already relayed"""
+    progress = await db.student_enrollment_progress.find_one({"student_id": student_id})
+    relayed = await db.flow_events.find({"student_id": student_id}).to_list(None)
+    return {event["id"] for event in progress.get("pending_events", []) + relayed}
+
+
+def bump_version_on_first_read(db, monkeypatch, times=1):
+    """Make another writer update the progress right after apply_flow_event read it"""
+    registry_get = server.flow_registry.get
+    calls = {"count": 0}
+
+    async def get(flow_key, active_only=False):
+        calls["count"] += 1
+        if calls["count"] <= times:
+            await db.student_enrollment_progress.update_one(
+                {"student_id": "student-1"},
+                {"$inc": {"version": 1}, "$set": {"notes": f"concurrent write {calls['count']}"}}
+            )
+        return await registry_get(flow_key, active_only)
+
+    monkeypatch.setattr(server.flow_registry, "get", get)
+    return calls
+
+
+def test_version_conflict_retries_and_applies_event(db, monkeypatch):
+    calls = bump_version_on_first_read(db, monkeypatch)
+
+    async def scenario():
+        await seed(db)
+        event = await server.apply_flow_event("student-1", "seminar.completed", "seminar", {"attended": True})
+        progress = await db.student_enrollment_progress.find_one({"student_id": "student-1"})
+        return event, progress, await recorded_event_ids(db)
+
+    event, progress, event_ids = asyncio.run(scenario())
+
+    assert calls["count"] == 2
+    assert progress["version"] == 3
+    assert progress["notes"] == "concurrent write 1"
+    assert progress["completed_steps"] == ["seminar"]
+    assert progress["current_step"] == "application"
+    assert progress["step_data"]["seminar"] == {"attended": True}
+    assert event["id"] in event_ids
+
+
+def test_version_conflict_gives_up_after_max_retries(db, monkeypatch):
+    bump_version_on_first_read(db, monkeypatch, times=server.FLOW_EVENT_MAX_RETRIES)
+
+    async def scenario():
+        await seed(db)
+        with pytest.raises(RuntimeError):
+            await server.apply_flow_event("student-1", "seminar.completed", "seminar")
+        return await db.student_enrollment_progress.find_one({"student_id": "student-1"})
+
+    progress = asyncio.run(scenario())
+
+    assert progress["version"] == 1 + server.FLOW_EVENT_MAX_RETRIES
+    assert progress["completed_steps"] == []
+    assert progress["pending_events"] == []
+
+
+@pytest.mark.parametrize("event_type, step_key, enrollment_status", [
+    ("payment.paid", "entrance_payment", "payment_completed"),
+    ("exam.scheduled", "consultation", "pending")
+])
+def test_event_for_step_outside_flow_is_still_recorded(db, event_type, step_key, enrollment_status):
+    async def scenario():
+        await seed(db)
+        result = await server.trigger_flow_event("student-1", event_type, step_key, {"source": "test"})
+        progress = await db.student_enrollment_progress.find_one({"student_id": "student-1"})
+        return result, progress, await recorded_event_ids(db)
+
+    result, progress, event_ids = asyncio.run(scenario())
+
+    assert result.get("success") is True
+    assert result["event_id"] in event_ids
+    assert progress["version"] == 2
+    assert progress["current_step"] == "seminar"
+    assert progress["enrollment_status"] == enrollment_status
+
+
+@pytest.mark.parametrize("event_type, step_key", [
+    ("consultation.completed", "consultation"),
+    ("payment.paid", ""),
+    ("payment.paid", "entrance.payment"),
+    ("exam.scheduled", "$set")
+])
+def test_invalid_step_key_is_rejected(db, event_type, step_key):
+    async def scenario():
+        await seed(db)
+        result = await server.trigger_flow_event("student-1", event_type, step_key)
+        progress = await db.student_enrollment_progress.find_one({"student_id": "student-1"})
+        return result, progress
+
+    result, progress = asyncio.run(scenario())
+
+    assert "error" in result
+    assert progress["version"] == 1
+    assert progress["pending_events"] == []
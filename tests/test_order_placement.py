@@ -0,0 +1,222 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def product_doc(product_id, stock_quantity, reservations=None):
+    return {
+        "id": product_id,
+        "name": f"Product {product_id}",
+        "description": "",
+        "price": 10000,
+        "category": "uniform",
+        "subcategory": "shirt",
+        "brand": "Frage EDU",
+        "size_options": [],
+        "color_options": [],
+        "images": [],
+        "stock_quantity": stock_quantity,
+        "is_available": True,
+        "is_featured": False,
+        "tags": [],
+        "specifications": {},
+        "reservations": reservations or [],
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
+def cart_item_doc(item_id, user_id, product_id, quantity):
+    return {
+        "id": item_id,
+        "user_id": user_id,
+        "product_id": product_id,
+        "quantity": quantity,
+        "selected_size": None,
+        "selected_color": None,
+        "price_at_time": 10000,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
+def order_request(**overrides):
+    fields = {
+        "shipping_address": {"address": "Seoul"},
+        "contact_info": {"phone": "010-0000-0000"},
+        "payment_method": "card"
+    }
+    fields.update(overrides)
+    return server.CreateOrderRequest(**fields)
+
+
+def test_concurrent_reserve_of_last_unit_succeeds_once(db):
+    async def scenario():
+        await db.products.insert_one(product_doc("p1", 1))
+        results = await asyncio.gather(
+            server.reserve_stock("order-a", {"p1": 1}),
+            server.reserve_stock("order-b", {"p1": 1}),
+            return_exceptions=True
+        )
+        return results, await db.products.find_one({"id": "p1"})
+
+    results, product = asyncio.run(scenario())
+
+    failures = [result for result in results if isinstance(result, server.InsufficientStockError)]
+    assert len(failures) == 1
+    assert results.count(None) == 1
+    assert product["stock_quantity"] == 0
+    assert len(product["reservations"]) == 1
+
+
+def test_reserve_stock_releases_partial_reservation_on_failure(db):
+    async def scenario():
+        await db.products.insert_many([product_doc("p1", 5), product_doc("p2", 0)])
+        with pytest.raises(server.InsufficientStockError) as excinfo:
+            await server.reserve_stock("order-a", {"p1": 2, "p2": 1})
+        return excinfo.value, await db.products.find_one({"id": "p1"})
+
+    error, product = asyncio.run(scenario())
+
+    assert error.product_id == "p2"
+    assert product["stock_quantity"] == 5
+    assert product["reservations"] == []
+
+
+def test_create_order_replays_idempotency_key(db, user):
+    async def scenario():
+        await db.products.insert_one(product_doc("p1", 5))
+        await db.cart_items.insert_one(cart_item_doc("c1", user.id, "p1", 2))
+        first = await server.create_order(order_request(), current_user=user, idempotency_key="key-1")
+        # The cart is empty now, so only a replay can answer the retry
+        second = await server.create_order(order_request(), current_user=user, idempotency_key="key-1")
+        return first, second, await db.products.find_one({"id": "p1"}), await db.orders.count_documents({})
+
+    first, second, product, order_count = asyncio.run(scenario())
+
+    assert second.id == first.id
+    assert second.order_number == first.order_number
+    assert second.status == "pending"
+    assert order_count == 1
+    assert product["stock_quantity"] == 3
+    assert product["reservations"] == []
+
+
+def test_create_order_replays_idempotency_key_from_body(db, user):
+    async def scenario():
+        await db.products.insert_one(product_doc("p1", 5))
+        await db.cart_items.insert_one(cart_item_doc("c1", user.id, "p1", 1))
+        request = order_request(idempotency_key="key-1")
+        first = await server.create_order(request, current_user=user, idempotency_key=None)
+        second = await server.create_order(request, current_user=user, idempotency_key=None)
+        return first, second, await db.orders.count_documents({})
+
+    first, second, order_count = asyncio.run(scenario())
+
+    assert second.id == first.id
+    assert order_count == 1
+
+
+def test_failed_checkout_releases_only_its_own_reservations(db, user):
+    other_reservation = {
+        "order_id": "other-order",
+        "quantity": 1,
+        "reserved_at": datetime.now(timezone.utc).isoformat()
+    }
+
+    async def scenario():
+        await db.products.insert_many([
+            product_doc("p1", 3, reservations=[other_reservation]),
+            product_doc("p2", 0)
+        ])
+        await db.cart_items.insert_many([
+            cart_item_doc("c1", user.id, "p1", 1),
+            cart_item_doc("c2", user.id, "p2", 1)
+        ])
+        with pytest.raises(HTTPException) as excinfo:
+            await server.create_order(order_request(), current_user=user, idempotency_key="key-1")
+        return (
+            excinfo.value,
+            await db.products.find_one({"id": "p1"}),
+            await db.orders.find_one({"idempotency_key": "key-1"}),
+            await db.cart_items.count_documents({"user_id": user.id})
+        )
+
+    error, product, order, cart_count = asyncio.run(scenario())
+
+    assert error.status_code == 409
+    assert product["stock_quantity"] == 3
+    assert product["reservations"] == [other_reservation]
+    assert order["status"] == "failed"
+    assert order["failure_reason"] == "insufficient_stock"
+    assert cart_count == 2
+
+
+class StatusSnapshotOrders:
+    """Orders collection whose find() reports statuses as the sweep first saw them"""
+
+    def __init__(self, collection, statuses):
+        self._collection = collection
+        self._statuses = statuses
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, query, projection=None):
+        statuses = self._statuses
+
+        class Cursor:
+            async def to_list(self, length):
+                return [{"id": order_id, "status": status} for order_id, status in statuses.items()]
+
+        return Cursor()
+
+
+class DatabaseWithOrders:
+    def __init__(self, database, orders):
+        self._database = database
+        self.orders = orders
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+
+def stale_reservation(order_id, quantity):
+    reserved_at = datetime.now(timezone.utc) - timedelta(seconds=server.ORDER_RESERVATION_TIMEOUT + 60)
+    return {"order_id": order_id, "quantity": quantity, "reserved_at": reserved_at.isoformat()}
+
+
+def test_recovery_releases_stock_of_timed_out_checkout(db):
+    async def scenario():
+        await db.products.insert_one(product_doc("p1", 4, reservations=[stale_reservation("order-a", 1)]))
+        await db.orders.insert_one({"id": "order-a", "status": "reserving", "created_at": "2000-01-01T00:00:00+00:00"})
+        summary = await server.recover_order_reservations()
+        return summary, await db.products.find_one({"id": "p1"}), await db.orders.find_one({"id": "order-a"})
+
+    summary, product, order = asyncio.run(scenario())
+
+    assert summary["released"] == 1
+    assert product["stock_quantity"] == 5
+    assert product["reservations"] == []
+    assert order["status"] == "failed"
+
+
+def test_recovery_commits_order_placed_during_sweep(db, monkeypatch):
+    async def scenario():
+        await db.products.insert_one(product_doc("p1", 4, reservations=[stale_reservation("order-a", 1)]))
+        # The checkout confirmed the order after the sweep read it as still reserving
+        await db.orders.insert_one({"id": "order-a", "status": "pending"})
+        orders = StatusSnapshotOrders(db.orders, {"order-a": "reserving"})
+        monkeypatch.setattr(server, "db", DatabaseWithOrders(db, orders))
+        summary = await server.recover_order_reservations()
+        return summary, await db.products.find_one({"id": "p1"}), await db.orders.find_one({"id": "order-a"})
+
+    summary, product, order = asyncio.run(scenario())
+
+    assert summary == {"released": 0, "committed": 1, "failed_orders": 0}
+    assert product["stock_quantity"] == 4
+    assert product["reservations"] == []
+    assert order["status"] == "pending"